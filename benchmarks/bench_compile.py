@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+"""Measure how long the interpreter takes to compile a long pasted cell,
+and to compile it again, e.g. when re-running it from the history.
+
+Usage::
+
+    python benchmarks/bench_compile.py [--lines 5000] [--repeat 5]
+"""
+
+import argparse
+import time
+
+from pyqtconsole.interpreter import PythonInterpreter
+
+CELL = [
+    "def f{i}(x, y=1.5):",
+    "    '''Return the sum {i}.'''",
+    "    return f'{{x}} {i}' + str(y)  # comment",
+    "x{i} = [f{i}(j) for j in range({i})]",
+    "len(x{i})",
+]
+
+
+def cell(lines):
+    return "\n".join(
+        line.format(i=i) for i in range(lines // len(CELL) + 1) for line in CELL
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    source = cell(args.lines)
+    times = []
+    for _ in range(args.repeat):
+        interpreter = PythonInterpreter(stdin=None, stdout=None)
+        start = time.perf_counter()
+        interpreter.compile(source, "<input>", "multi")
+        times.append(time.perf_counter() - start)
+    print(f"compiled {source.count(chr(10)) + 1} lines in {min(times):.3f}s")
+    cache = getattr(interpreter, "compile_cache", None)
+    if cache is not None:
+        start = time.perf_counter()
+        interpreter.compile(source, "<input>", "multi")
+        print(f"  again from the cache in {time.perf_counter() - start:.6f}s")
+
+
+if __name__ == "__main__":
+    main()
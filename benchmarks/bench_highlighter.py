@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+"""Measure the throughput of the highlighters on representative corpora:
+short REPL lines, long single lines, emoji-heavy text, long triple-quoted
+strings and f-string-dense code, and of the prompt highlighter.
+
+Each case is run ``--repeat`` times, and the minimum and median are
+reported. The Python highlighters are measured tokenizing each block, and
+with the results taken from the cache. ``--json`` writes the results in a
+machine-readable form (``-`` for stdout), e.g. to track them across
+releases. ``--compare`` shows the change relative to such a file.
+
+Usage::
+
+    python benchmarks/bench_highlighter.py [--length 10000] [--repeat 5]
+        [--highlighter python|stateful|all] [-k NAME] [--json results.json]
+        [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from functools import partial
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qtpy import API_NAME, QT_VERSION  # noqa: E402
+from qtpy.QtGui import QSyntaxHighlighter, QTextDocument  # noqa: E402
+from qtpy.QtWidgets import QApplication  # noqa: E402
+
+from pyqtconsole import __version__  # noqa: E402
+from pyqtconsole.highlighter import (  # noqa: E402
+    PromptHighlighter,
+    PythonHighlighter,
+    StatefulPythonHighlighter,
+)
+
+HIGHLIGHTERS = {
+    "python": [PythonHighlighter],
+    "stateful": [StatefulPythonHighlighter],
+    "all": [PythonHighlighter, StatefulPythonHighlighter],
+}
+
+SNIPPET = "if x is not None: y = f(1, 2.5, 'a\\n', \"b\", f'{z}') + 0x1F; "
+
+REPL_LINES = [
+    "import numpy as np",
+    "x = np.arange(10)",
+    "x.sum()",
+    "for i in range(3): print(i, x[i])",
+    "def f(a, b=2): return a * b",
+    "f(3)",
+    "s = 'hello world'",
+    "s.split()",
+    "d = {'a': 1, 'b': [1, 2, 3]}",
+    "len(d)  # number of keys",
+    "class A: pass",
+    "print(f'{s!r}: {len(s)}')",
+]
+
+EMOJI_SNIPPET = 's = "😀 {x} 🎉"; t = f"{y} 👍\\n"  # 🚀 done; '
+
+FSTRING_LINE = (
+    'msg = f"{name!r}: {value:>{width}.{precision}f} '
+    "({100 * part / total:.1f}%) {'ok' if good else f'{err!s}'}\""
+)
+
+
+def line_of_length(snippet, length):
+    return (snippet * (length // len(snippet) + 1))[:length]
+
+
+def long_strings(length):
+    """Return a line with a few long string literals."""
+    size = length // 4
+    a, b, c = "a" * size, "b" * size, "c" * size
+    return f"x = '{a} if 1' + \"{b} else 2\" + f'{{x}} {c}'  # '''"
+
+
+def triple_quoted(lines):
+    """Return a long triple-quoted string, with quotes and code-like text."""
+    body = [
+        f"    Line {i}: 'quoted' \"text\", if x else {i} # not a comment"
+        for i in range(lines)
+    ]
+    return "\n".join(['text = """', *body, '"""', "print(text)"])
+
+
+def corpora(length):
+    """Return the ``(name, text)`` pairs of the documents to highlight."""
+    return [
+        ("repl lines", "\n".join(REPL_LINES * 100)),
+        (f"{length} chars line", line_of_length(SNIPPET, length) + "  # done"),
+        (f"{length} chars emoji", line_of_length(EMOJI_SNIPPET, length)),
+        (f"{length} chars strings", long_strings(length)),
+        ("triple-quoted", triple_quoted(1000)),
+        ("f-strings", "\n".join([FSTRING_LINE] * 1000)),
+    ]
+
+
+def run_highlighter(cls, text, cached):
+    """Return the seconds to highlight each block of ``text`` once."""
+    doc = QTextDocument()
+    doc.setPlainText(text)
+    highlighter = cls(doc)
+    if not cached:
+        highlighter.cache.maxsize = 0
+    # Highlight everything synchronously, and settle the block states:
+    highlighter.time_budget = float("inf")
+    highlighter.rehighlight()
+    blocks = [doc.findBlockByNumber(i) for i in range(doc.blockCount())]
+    # Without the time budget of the Python wrapper, which is lifted anyway:
+    rehighlight_block = QSyntaxHighlighter.rehighlightBlock
+    start = time.perf_counter()
+    for block in blocks:
+        rehighlight_block(highlighter, block)
+    return time.perf_counter() - start
+
+
+def run_prompts(prompts, cached):
+    """Return the seconds to highlight each prompt once."""
+    highlighter = PromptHighlighter()
+    if cached:
+        for prompt in prompts:
+            highlighter.highlight(prompt)
+    else:
+        highlighter.cache.maxsize = 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        highlighter.highlight(prompt)
+    return time.perf_counter() - start
+
+
+def measure(run, repeat, **info):
+    """Run the case ``repeat`` times and return its result record."""
+    times = [run() for _ in range(repeat)]
+    best = min(times)
+    return dict(
+        info,
+        repeat=repeat,
+        min=best,
+        median=statistics.median(times),
+        per_item=best / info["items"],
+        chars_per_second=info["chars"] / best,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--length", type=int, default=10_000, help="long line length")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--highlighter", choices=sorted(HIGHLIGHTERS), default="all")
+    parser.add_argument(
+        "-k", dest="filter", default="", help="only run cases whose name contains this"
+    )
+    parser.add_argument("--json", help="write the results to this file (- for stdout)")
+    parser.add_argument("--compare", help="results file of --json to compare with")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for r in json.load(f)["results"]:
+                baseline[r["name"], r["target"], r["cached"]] = r["per_item"]
+
+    app = QApplication.instance() or QApplication([])
+    results = []
+    for name, text in corpora(args.length):
+        if args.filter not in name:
+            continue
+        for cls in HIGHLIGHTERS[args.highlighter]:
+            for cached in (False, True):
+                results.append(
+                    measure(
+                        partial(run_highlighter, cls, text, cached),
+                        args.repeat,
+                        name=name,
+                        target=cls.__name__,
+                        cached=cached,
+                        items=text.count("\n") + 1,
+                        chars=len(text),
+                    )
+                )
+    prompts = [f"IN [{i}]: " for i in range(1000)] + ["...: ", "OUT[1]: "] * 500
+    if args.filter in "prompts":
+        for cached in (False, True):
+            results.append(
+                measure(
+                    partial(run_prompts, prompts, cached),
+                    args.repeat,
+                    name="prompts",
+                    target=PromptHighlighter.__name__,
+                    cached=cached,
+                    items=len(prompts),
+                    chars=sum(map(len, prompts)),
+                )
+            )
+
+    # Keep stdout clean for the JSON output:
+    out = sys.stderr if args.json == "-" else sys.stdout
+    for r in results:
+        target = r["target"] + (" (cached)" if r["cached"] else "")
+        line = (
+            f"{r['name']:>20} {target:>35}: {r['per_item'] * 1e6:10.2f}us per item,"
+            f" {r['chars_per_second'] / 1e6:7.2f}M chars/s"
+        )
+        before = baseline.get((r["name"], r["target"], r["cached"]))
+        if before:
+            line += f", {r['per_item'] / before - 1:+7.1%}"
+        print(line, file=out)
+    if args.json:
+        report = {
+            "version": 1,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "pyqtconsole": __version__,
+            "python": platform.python_version(),
+            "qt": QT_VERSION,
+            "qt_api": API_NAME,
+            "platform": platform.platform(),
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    app.processEvents()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+"""Measure how long the console takes to insert a large number of output
+lines, as they would arrive from the output buffer in per-frame portions.
+
+Usage::
+
+    python benchmarks/bench_output.py [--lines 1000000] [--chunk 10000] [--virtual]
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qtpy.QtWidgets import QApplication  # noqa: E402
+
+from pyqtconsole.console import PythonConsole  # noqa: E402
+
+
+def run(console, lines, chunk):
+    payload = [
+        "".join(f"line {i:>8}: some payload\n" for i in range(j, j + chunk))
+        for j in range(0, lines, chunk)
+    ]
+    prompt = 0.0
+    insert_prompt_text = console._insert_prompt_text
+
+    def timed_insert_prompt_text(*args):
+        nonlocal prompt
+        start = time.perf_counter()
+        insert_prompt_text(*args)
+        prompt += time.perf_counter() - start
+
+    console._insert_prompt_text = timed_insert_prompt_text
+    start = time.perf_counter()
+    for data in payload:
+        console._output_data_handler([(None, data)])
+    total = time.perf_counter() - start
+    return total, prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--chunk", type=int, default=10_000, help="lines per flush")
+    parser.add_argument(
+        "--virtual", action="store_true", help="use the virtualised output view"
+    )
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    console = PythonConsole(virtual_output=args.virtual)
+    total, prompt = run(console, args.lines, args.chunk)
+    if args.virtual:
+        blocks = len(console.store)
+    else:
+        blocks = console.edit.document().blockCount()
+    print(f"inserted {args.lines} lines ({blocks} lines) in {total:.3f}s")
+    print(f"  prompt bookkeeping: {prompt:.3f}s")
+    print(f"  per line: {total / args.lines * 1e6:.2f}us")
+    console.deleteLater()
+    app.processEvents()
+
+
+if __name__ == "__main__":
+    main()
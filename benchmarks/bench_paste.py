@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+"""Measure how long pasting a long script into the console blocks the event
+loop, and how long the highlighting takes to catch up afterwards.
+
+Usage::
+
+    python benchmarks/bench_paste.py [--lines 5000]
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qtpy.QtWidgets import QApplication  # noqa: E402
+
+from pyqtconsole.console import PythonConsole  # noqa: E402
+
+FUNCTION = [
+    "def f{i}(x, y=1.5):",
+    "    '''Return the sum {i}.'''",
+    "    return f'{{x}} {i}' + str(y)  # comment",
+    "",
+]
+
+
+def script(lines):
+    return "\n".join(
+        line.format(i=i) for i in range(lines // len(FUNCTION) + 1) for line in FUNCTION
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    console = PythonConsole()
+    console.resize(800, 600)
+    console.show()
+    app.processEvents()
+
+    text = script(args.lines)
+    start = time.perf_counter()
+    console.insert_input_text(text)
+    paste = time.perf_counter() - start
+    start = time.perf_counter()
+    slices = 0
+    while console.highlighter._pending:
+        app.processEvents()
+        slices += 1
+    catch_up = time.perf_counter() - start
+    print(f"pasted {text.count(chr(10)) + 1} lines in {paste:.3f}s")
+    print(f"  highlighting caught up in {catch_up:.3f}s ({slices} time slices)")
+    console.deleteLater()
+    app.processEvents()
+
+
+if __name__ == "__main__":
+    main()
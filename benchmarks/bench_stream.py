@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+"""Compare the line buffer of :class:`pyqtconsole.stream.Stream` against the
+previous string based implementation, by feeding a large number of lines and
+reading them back with ``readline()``.
+
+Usage::
+
+    python benchmarks/bench_stream.py [--lines 100000] [--chunk 1000]
+"""
+
+import argparse
+import time
+from threading import Condition
+
+from pyqtconsole.stream import Stream
+
+
+class StringBufferStream:
+    """The previous implementation: a single string that is searched and
+    re-sliced for every line."""
+
+    def __init__(self):
+        self._line_cond = Condition()
+        self._buffer = ""
+
+    def readline(self, timeout=None):
+        data = ""
+        with self._line_cond:
+            first_linesep = self._buffer.find("\n")
+            while first_linesep == -1:
+                notfied = self._line_cond.wait(timeout)
+                first_linesep = self._buffer.find("\n")
+                if not notfied:
+                    break
+            if first_linesep > -1:
+                data = self._buffer[0 : first_linesep + 1]
+                if len(self._buffer) > len(data):
+                    self._buffer = self._buffer[first_linesep + 1 :]
+                else:
+                    self._buffer = ""
+        return data
+
+    def write(self, data):
+        with self._line_cond:
+            self._buffer += data
+            if "\n" in self._buffer:
+                self._line_cond.notify()
+
+
+def run(stream, lines, chunk):
+    payload = [
+        "".join(f"line {i:>8}: some payload\n" for i in range(j, j + chunk))
+        for j in range(0, lines, chunk)
+    ]
+    start = time.perf_counter()
+    for data in payload:
+        stream.write(data)
+    written = time.perf_counter()
+    for _ in range(lines):
+        stream.readline()
+    done = time.perf_counter()
+    return written - start, done - written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--chunk", type=int, default=1000, help="lines per write")
+    args = parser.parse_args()
+
+    for name, stream in [
+        ("string buffer", StringBufferStream()),
+        ("line deque", Stream()),
+    ]:
+        write, read = run(stream, args.lines, args.chunk)
+        print(f"{name:>14}: write {write:8.4f}s  readline {read:8.4f}s")
+
+
+if __name__ == "__main__":
+    main()
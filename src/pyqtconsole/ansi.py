@@ -0,0 +1,322 @@
+import re
+
+from qtpy.QtGui import QColor, QFont, QTextCharFormat
+
+# Complete escape sequences: CSI (e.g. colors, erase), OSC (e.g. window
+# title, terminated by BEL or ST) and other two or three character sequences
+# (e.g. character set selection):
+_SEQUENCE = re.compile(
+    r"(\x1b\[[0-?]*[ -/]*[@-~]"
+    r"|\x1b\](?:[^\x07\x1b]|\x1b[^\\])*(?:\x07|\x1b\\)"
+    r"|\x1b[ -/]*[0-~]"
+    r"|[\r\b])"
+)
+# A sequence that is cut off at the end of the written data:
+_INCOMPLETE = re.compile(
+    r"\x1b(?:\[[0-?]*[ -/]*|\](?:[^\x07\x1b]|\x1b[^\\])*\x1b?|[ -/]*)\Z"
+)
+# Longest incomplete sequence that is held back for the next write:
+_MAX_INCOMPLETE = 256
+
+_BASIC_COLORS = [
+    "#000000",
+    "#cd0000",
+    "#00cd00",
+    "#cdcd00",
+    "#0000ee",
+    "#cd00cd",
+    "#00cdcd",
+    "#e5e5e5",
+    "#7f7f7f",
+    "#ff0000",
+    "#00ff00",
+    "#ffff00",
+    "#5c5cff",
+    "#ff00ff",
+    "#00ffff",
+    "#ffffff",
+]
+
+
+def color_256(index):
+    """Return the color with the given index in the xterm 256 color palette
+    as ``#rrggbb`` string."""
+    if index < 16:
+        return _BASIC_COLORS[index]
+    if index < 232:
+        index -= 16
+        levels = [0, 95, 135, 175, 215, 255]
+        r, g, b = index // 36, index // 6 % 6, index % 6
+        return f"#{levels[r]:02x}{levels[g]:02x}{levels[b]:02x}"
+    gray = 8 + 10 * (index - 232)
+    return f"#{gray:02x}{gray:02x}{gray:02x}"
+
+
+# Text attributes: (foreground, background, bold, italic, underline)
+DEFAULT_ATTRS = (None, None, False, False, False)
+
+
+def apply_sgr(attrs, params):
+    """Return the text attributes after applying the parameters of a SGR
+    (Select Graphic Rendition) sequence."""
+    fg, bg, bold, italic, underline = attrs
+    codes = [int(p) if p.isdigit() else 0 for p in params.replace(":", ";").split(";")]
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        i += 1
+        if code == 0:
+            fg, bg, bold, italic, underline = DEFAULT_ATTRS
+        elif code == 1:
+            bold = True
+        elif code == 3:
+            italic = True
+        elif code == 4:
+            underline = True
+        elif code == 22:
+            bold = False
+        elif code == 23:
+            italic = False
+        elif code == 24:
+            underline = False
+        elif 30 <= code <= 37:
+            fg = _BASIC_COLORS[code - 30]
+        elif 90 <= code <= 97:
+            fg = _BASIC_COLORS[code - 90 + 8]
+        elif code == 39:
+            fg = None
+        elif 40 <= code <= 47:
+            bg = _BASIC_COLORS[code - 40]
+        elif 100 <= code <= 107:
+            bg = _BASIC_COLORS[code - 100 + 8]
+        elif code == 49:
+            bg = None
+        elif code in (38, 48) and i < len(codes):
+            if codes[i] == 5 and i + 1 < len(codes):
+                color = color_256(min(codes[i + 1], 255))
+                i += 2
+            elif codes[i] == 2 and i + 3 < len(codes):
+                r, g, b = (min(c, 255) for c in codes[i + 1 : i + 4])
+                color = f"#{r:02x}{g:02x}{b:02x}"
+                i += 4
+            else:
+                break
+            if code == 38:
+                fg = color
+            else:
+                bg = color
+    return (fg, bg, bold, italic, underline)
+
+
+def char_format(base, attrs):
+    """Return a copy of the QTextCharFormat ``base`` with the given text
+    attributes applied."""
+    fg, bg, bold, italic, underline = attrs
+    fmt = QTextCharFormat(base)
+    if fg is not None:
+        fmt.setForeground(QColor(fg))
+    if bg is not None:
+        fmt.setBackground(QColor(bg))
+    if bold:
+        fmt.setFontWeight(QFont.Bold)
+    if italic:
+        fmt.setFontItalic(True)
+    if underline:
+        fmt.setFontUnderline(True)
+    return fmt
+
+
+def _slice(segments, start, stop):
+    """Return the ``(key, text)`` segments covering the columns from
+    ``start`` to ``stop``."""
+    result = []
+    pos = 0
+    for key, text in segments:
+        end = pos + len(text)
+        if end > start and pos < stop:
+            result.append((key, text[max(start - pos, 0) : stop - pos]))
+        pos = end
+        if pos >= stop:
+            break
+    return result
+
+
+def _merge(segments):
+    """Join adjacent segments with the same key."""
+    result = []
+    for key, text in segments:
+        if result and result[-1][0] == key:
+            result[-1] = (key, result[-1][1] + text)
+        elif text:
+            result.append((key, text))
+    return result
+
+
+class AnsiRenderer:
+    """Interpret carriage returns, backspaces and ANSI escape sequences in
+    output text, like a terminal does for the current line.
+
+    Text is fed in as it is written and collected until :meth:`drain` is
+    called, which returns the changes to apply to the document in one go.
+    This way, a progress bar that redraws its line many times per frame
+    results in a single edit of the last line.
+
+    The text is returned as runs of ``(key, text)``, where ``key`` is either
+    the channel, or ``(channel, attrs)`` if the text has attributes set by
+    SGR sequences (see :func:`char_format`).
+    """
+
+    def __init__(self):
+        self._attrs = {}
+        self._incomplete = ""
+        self.reset()
+
+    def reset(self):
+        """Start a new, empty current line, e.g. after other text was
+        inserted into the document."""
+        self._incomplete = ""
+        # The current line as (key, text) segments, its length and the
+        # column where the next text is written:
+        self._line = []
+        self._length = 0
+        self._col = 0
+        # The current line as it is in the document:
+        self._shown = []
+        self._shown_length = 0
+        # Completed lines since the last drain (if ``_first`` is False), and
+        # the first column of the shown line that was changed:
+        self._done = []
+        self._first = True
+        self._start = None
+
+    def feed(self, text, channel=None):
+        if self._incomplete:
+            text = self._incomplete + text
+            self._incomplete = ""
+        if "\x1b" in text:
+            match = _INCOMPLETE.search(text)
+            if match and len(text) - match.start() <= _MAX_INCOMPLETE:
+                self._incomplete = text[match.start() :]
+                text = text[: match.start()]
+
+        if "\r" not in text and "\b" not in text and "\x1b" not in text:
+            self._write(channel, text)
+            return
+
+        for i, part in enumerate(_SEQUENCE.split(text)):
+            if i % 2 == 0:
+                self._write(channel, part.replace("\x1b", ""))
+            elif part == "\r":
+                self._col = 0
+            elif part == "\b":
+                self._col = max(self._col - 1, 0)
+            elif part.startswith("\x1b["):
+                self._csi(channel, part[2:-1], part[-1])
+
+    def drain(self):
+        """Return the pending changes as ``(removed, runs)``, where
+        ``removed`` is the text to remove from the end of the last line of
+        the document before inserting the ``(key, text)`` runs. Returns None
+        if nothing changed."""
+        if self._start is None:
+            return None
+        removed = _slice(self._shown, self._start, self._shown_length)
+        removed = "".join(text for _, text in removed)
+        if self._first:
+            runs = _slice(self._line, self._start, self._length)
+        else:
+            runs = self._done + self._line
+        self._shown = list(self._line)
+        self._shown_length = self._length
+        self._done = []
+        self._first = True
+        self._start = None
+        return removed, runs
+
+    def _key(self, channel):
+        attrs = self._attrs.get(channel, DEFAULT_ATTRS)
+        return channel if attrs == DEFAULT_ATTRS else (channel, attrs)
+
+    def _changed(self, col):
+        if self._first and (self._start is None or col < self._start):
+            self._start = col
+
+    def _write(self, channel, text):
+        if not text:
+            return
+        key = self._key(channel)
+        if "\n" not in text:
+            self._put(key, text)
+            return
+        first, _, rest = text.partition("\n")
+        self._put(key, first)
+        self._newline(key)
+        # The lines in between need no further processing:
+        middle, newline, last = rest.rpartition("\n")
+        if newline:
+            self._done.append((key, middle + newline))
+        self._put(key, last)
+
+    def _put(self, key, text):
+        if not text:
+            return
+        col = self._col
+        self._changed(min(col, self._length))
+        if col > self._length:
+            text = " " * (col - self._length) + text
+            col = self._length
+        end = col + len(text)
+        if col == self._length:
+            if self._line and self._line[-1][0] == key:
+                self._line[-1] = (key, self._line[-1][1] + text)
+            else:
+                self._line.append((key, text))
+        else:
+            self._line = _merge(
+                _slice(self._line, 0, col)
+                + [(key, text)]
+                + _slice(self._line, end, self._length)
+            )
+        self._length = max(self._length, end)
+        self._col = end
+
+    def _newline(self, key):
+        self._changed(self._length)
+        if self._first:
+            self._done = _slice(self._line, self._start, self._length)
+            self._first = False
+        else:
+            self._done.extend(self._line)
+        self._done.append((key, "\n"))
+        self._line = []
+        self._length = 0
+        self._col = 0
+
+    def _csi(self, channel, params, command):
+        if command == "m":
+            attrs = self._attrs.get(channel, DEFAULT_ATTRS)
+            self._attrs[channel] = apply_sgr(attrs, params)
+            return
+        num = int(params) if params.isdigit() else None
+        if command == "K":
+            # Erase in line: 0 = to the end, 1 = to the start, 2 = all
+            if num in (None, 0):
+                if self._col < self._length:
+                    self._changed(self._col)
+                    self._line = _slice(self._line, 0, self._col)
+                    self._length = self._col
+            elif num == 1:
+                col = self._col
+                self._col = 0
+                self._put(self._key(channel), " " * min(col, self._length))
+                self._col = col
+            elif num == 2:
+                self._changed(0)
+                self._line = []
+                self._length = 0
+        elif command == "G":
+            self._col = max((num or 1) - 1, 0)
+        elif command == "C":
+            self._col += num or 1
+        elif command == "D":
+            self._col = max(self._col - (num or 1), 0)
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Mapping of a bounded size, which discards the least recently used
+    entries first.
+
+    The number of lookups that found an entry (``hits``) and that did not
+    (``misses``) are counted, e.g. to tune ``maxsize``. A ``maxsize`` of 0
+    disables the cache.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        :param maxsize: Maximum number of entries
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value for ``key`` and mark it as recently used, or
+        ``default`` if there is none."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store ``value`` for ``key``, discarding the least recently used
+        entries if the cache is full."""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Discard all entries and reset the counters."""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,121 @@
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+
+from .output import never_block
+
+
+def _load_libc():
+    if sys.platform == "win32":
+        return ctypes.cdll.msvcrt
+    return ctypes.CDLL(ctypes.util.find_library("c") or None)
+
+
+try:
+    _libc = _load_libc()
+except OSError:
+    _libc = None
+
+
+def flush_native_streams():
+    """Flush the stdio buffers of Python and of the C runtime, so that no
+    output that was written before (un)redirecting a file descriptor ends up
+    at the wrong place."""
+    for stream in (sys.__stdout__, sys.__stderr__):
+        if stream is not None:
+            with contextlib.suppress(OSError, ValueError):
+                stream.flush()
+    if _libc is not None:
+        with contextlib.suppress(AttributeError, OSError):
+            _libc.fflush(None)
+
+
+class NativeCapture:
+    """Capture output that is written directly to the process-level file
+    descriptors (e.g. by C extensions), bypassing ``sys.stdout``.
+
+    While active, each captured file descriptor is replaced by the write end
+    of a pipe. A reader thread per pipe forwards the data in large chunks to
+    the ``buffer`` (binary interface) of the corresponding stream.
+
+    Note that this affects the whole process: output of other threads is
+    captured as well.
+    """
+
+    def __init__(self, targets, chunk_size=65536, timeout=5):
+        """
+        :param targets: Dictionary mapping file descriptors to the streams
+                their output should be forwarded to, e.g. ``{1: stdout, 2:
+                stderr}``
+        :type targets: dict
+        :param chunk_size: Maximum number of bytes forwarded at once
+                (Defaults to 65536)
+        :type chunk_size: int
+        :param timeout: Time to wait for the reader threads to drain the
+                pipes when stopping, in seconds (Defaults to 5)
+        :type timeout: float
+        """
+        self.targets = targets
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._saved = {}
+        self._readers = []
+
+    def active(self):
+        return bool(self._saved)
+
+    def start(self):
+        if self._saved:
+            return
+        flush_native_streams()
+        for fd, stream in self.targets.items():
+            read_fd, write_fd = os.pipe()
+            self._saved[fd] = os.dup(fd)
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            reader = threading.Thread(
+                target=self._forward,
+                args=(read_fd, stream),
+                name=f"pyqtconsole-capture-{fd}",
+                daemon=True,
+            )
+            reader.start()
+            self._readers.append(reader)
+
+    def stop(self):
+        if not self._saved:
+            return
+        flush_native_streams()
+        # Restoring the original descriptors closes the last write end of
+        # the pipes (unless inherited by a child process), which makes the
+        # readers see EOF after forwarding the remaining data:
+        for fd, saved in self._saved.items():
+            os.dup2(saved, fd)
+            os.close(saved)
+        self._saved = {}
+        for reader in self._readers:
+            reader.join(self.timeout)
+        self._readers = []
+
+    def _forward(self, read_fd, stream):
+        # The thread writing to the descriptor may be the GUI thread, which
+        # can't flush the output while it waits for this reader:
+        never_block()
+        try:
+            while True:
+                data = os.read(read_fd, self.chunk_size)
+                if not data:
+                    break
+                stream.buffer.write(data)
+        finally:
+            os.close(read_fd)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
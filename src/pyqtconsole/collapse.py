@@ -0,0 +1,99 @@
+from collections import deque
+
+from .highlighter import NoHighlightData
+
+
+class CollapsedOutput:
+    """Output of a command that is kept out of the console document.
+
+    The text is stored in the chunks it was written in, tagged with the
+    output channel, and is only split into lines when a part of it is taken
+    out to be displayed.
+    """
+
+    def __init__(self):
+        self._chunks = deque()
+        self._newlines = 0
+
+    def __len__(self):
+        """Number of lines, including a final unterminated line."""
+        if not self._chunks:
+            return 0
+        return self._newlines + (not self._chunks[-1][1].endswith("\n"))
+
+    def append(self, channel, text):
+        if text:
+            count = text.count("\n")
+            self._chunks.append((channel, text, count))
+            self._newlines += count
+
+    def remove_tail(self, num):
+        """Remove the last ``num`` characters of the last line."""
+        while num > 0 and self._chunks:
+            channel, text, count = self._chunks[-1]
+            if len(text) > num:
+                self._chunks[-1] = (channel, text[:-num], count)
+                break
+            self._chunks.pop()
+            num -= len(text)
+
+    def take_first(self, num):
+        """Remove the first ``num`` lines and return them as a list of
+        ``(channel, text)`` runs."""
+        runs = []
+        while num > 0 and self._chunks:
+            channel, text, count = self._chunks[0]
+            if count < num:
+                self._chunks.popleft()
+                runs.append((channel, text))
+                num -= count
+                self._newlines -= count
+                continue
+            pos = -1
+            for _ in range(num):
+                pos = text.find("\n", pos + 1)
+            runs.append((channel, text[: pos + 1]))
+            if pos + 1 < len(text):
+                self._chunks[0] = (channel, text[pos + 1 :], count - num)
+            else:
+                self._chunks.popleft()
+            self._newlines -= num
+            num = 0
+        return runs
+
+    def take_last(self, num):
+        """Remove the last ``num`` lines and return them as a list of
+        ``(channel, text)`` runs."""
+        if num <= 0 or not self._chunks:
+            return []
+        # The line before the requested ones ends at this newline, counted
+        # from the end:
+        need = num + self._chunks[-1][1].endswith("\n")
+        runs = []
+        while self._chunks:
+            channel, text, count = self._chunks[-1]
+            if count < need:
+                self._chunks.pop()
+                runs.append((channel, text))
+                need -= count
+                self._newlines -= count
+                continue
+            pos = len(text)
+            for _ in range(need):
+                pos = text.rfind("\n", 0, pos)
+            if pos + 1 < len(text):
+                runs.append((channel, text[pos + 1 :]))
+            self._chunks[-1] = (channel, text[: pos + 1], count - need + 1)
+            self._newlines -= need - 1
+            break
+        runs.reverse()
+        return runs
+
+
+class CollapsedData(NoHighlightData):
+    """User data of the placeholder block that stands for the lines of a
+    :class:`CollapsedOutput`."""
+
+    def __init__(self, output):
+        super().__init__()
+        self.output = output
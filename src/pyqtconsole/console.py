@@ -1,17 +1,46 @@
 import ctypes
 import subprocess
 import threading
+import time
 from abc import abstractmethod
-
-from qtpy.QtCore import QEvent, Qt, QThread, Slot
-from qtpy.QtGui import QClipboard, QFontMetrics, QTextCursor
-from qtpy.QtWidgets import QApplication, QFrame, QHBoxLayout, QPlainTextEdit
-
+from functools import partial
+
+from qtpy.QtCore import QEvent, QPoint, Qt, QThread, Slot
+from qtpy.QtGui import (
+    QClipboard,
+    QFontMetrics,
+    QKeySequence,
+    QTextCharFormat,
+    QTextCursor,
+)
+from qtpy.QtWidgets import (
+    QApplication,
+    QFrame,
+    QHBoxLayout,
+    QPlainTextEdit,
+    QShortcut,
+    QVBoxLayout,
+)
+
+from .ansi import AnsiRenderer, char_format
 from .autocomplete import COMPLETE_MODE, AutoComplete
+from .collapse import CollapsedData, CollapsedOutput
 from .commandhistory import CommandHistory
-from .highlighter import NoHighlightData, PromptHighlighter, PythonHighlighter
+from .export import SessionExport
+from .highlighter import (
+    OUTPUT_STATE,
+    STYLES,
+    NoHighlightData,
+    PromptHighlighter,
+    PythonHighlighter,
+    is_output,
+)
 from .interpreter import PythonInterpreter
-from .prompt import PromptArea
+from .linestore import LineStore
+from .output import OutputBuffer, RateLimiter
+from .outputview import OutputView
+from .prompt import PromptArea, PromptDocument
+from .search import FindBar
 from .stream import Stream
 
 try:
@@ -40,6 +69,7 @@ class BaseConsole(QFrame):
         inprompt=None,
         outprompt=None,
         welcome_message=None,
+        virtual_output=False,
     ):
         """
 
@@ -69,6 +99,12 @@ class BaseConsole(QFrame):
                 (Defaults to None). If provided, this message will be
                 displayed before the first prompt. Not syntax highlighted.
         :type welcome_message: str, None
+        :param virtual_output: Keep the output in a :class:`LineStore` that is
+                displayed by an :class:`OutputView`, above an editor that only
+                contains the current input (Defaults to False). This allows
+                for sessions of many millions of lines. Collapsing and the
+                scrollback limit don't apply in this mode.
+        :type virtual_output: bool
         """
         super().__init__(parent)
 
@@ -82,7 +118,33 @@ class BaseConsole(QFrame):
         layout.addWidget(edit)
         layout.setSpacing(0)
         layout.setContentsMargins(0, 0, 0, 0)
-        self.setLayout(layout)
+        outer = QVBoxLayout()
+        outer.setSpacing(0)
+        outer.setContentsMargins(0, 0, 0, 0)
+
+        if virtual_output:
+            self.store = LineStore()
+            self.output_view = OutputView(self.store, self._output_format, pbar)
+            self.output_view.text_margin = int(edit.document().documentMargin())
+            # The formats of the highlighted input moved to the store:
+            self._input_formats = []
+            outer.addWidget(self.output_view, 1)
+            edit.document().blockCountChanged.connect(self._fit_input_area)
+            self.search_index = self.store
+        else:
+            self.store = None
+            self.output_view = None
+            # Copy of the document text for searching in the background. Line
+            # i of the index is block i of the document:
+            self.search_index = LineStore()
+        outer.addLayout(layout, 1)
+
+        self.find_bar = FindBar(self)
+        outer.addWidget(self.find_bar)
+        self.setLayout(outer)
+        find = QShortcut(QKeySequence.Find, self)
+        find.setContext(Qt.WidgetWithChildrenShortcut)
+        find.activated.connect(self.find_bar.open)
 
         if shell_cmd_prefix is True:
             self.shell_cmd_prefix = "!"
@@ -91,16 +153,30 @@ class BaseConsole(QFrame):
         else:
             self.shell_cmd_prefix = None
 
-        self._prompt_doc = [""]
+        self._prompt_doc = PromptDocument()
         self._prompt_pos = 0
         self._output_inserted = False
         self._tab_chars = 4 * " "
         self._ctrl_d_exits = False
         self._copy_buffer = ""
+        self._scrollback_lines = None
+        self._scrollback_chars = None
+        self._collapse_lines = None
+        self._collapse_tail = 20
+        self._collapse_page = 1000
+        # Output lines of the current command, and the output that is kept out
+        # of the document once their number exceeds the collapse limit:
+        self._command_lines = 0
+        self._collapsed = None
+        self._placeholder = None
 
         self._last_input = ""
         self._more = False
         self._current_line = 0
+        # Start time and duration of the executed commands by input number,
+        # and the number, start time and clock of the running command:
+        self._timings = {}
+        self._started = None
 
         self._ps1 = inprompt or "IN [%d]:"
         self._ps1 = self._ps1.strip() + " "
@@ -110,8 +186,33 @@ class BaseConsole(QFrame):
         self._ps = self.in_prompt()
 
         self.stdin = Stream()
-        self.stdout = Stream()
-        self.stdout.write_event.connect(self._stdout_data_handler)
+        # Writes are collected in the calling thread and rendered in batches,
+        # at most once per `output.interval` milliseconds. The streams call
+        # the buffer directly rather than through a signal, so that an
+        # interrupt of a waiting writer is raised in the code that writes:
+        self.output = OutputBuffer(self._output_data_handler, parent=self)
+        self.output.set_filter("stderr", RateLimiter())
+        self.stdout = Stream(readable=False, writer=self.output.write)
+        self.stderr = Stream(
+            readable=False, writer=partial(self.output.write, channel="stderr")
+        )
+        # Tracebacks of the interpreter, displayed like stderr but never
+        # rate-limited:
+        self._errors = Stream(
+            readable=False, writer=partial(self.output.write, channel="errors")
+        )
+        styles = dict(STYLES, **(formats or {}))
+        self._output_formats = {
+            None: QTextCharFormat(),
+            "stderr": styles["stderr"],
+            "errors": styles["stderr"],
+        }
+        self._collapsed_format = styles["collapsed"]
+        # Carriage returns and escape sequences in the output are interpreted
+        # for the last line of the document, as long as nothing else was
+        # inserted after the output (ends at `_output_end`):
+        self._ansi = AnsiRenderer()
+        self._output_end = None
 
         # show frame around both child widgets:
         self.setFrameStyle(edit.frameStyle())
@@ -121,6 +222,8 @@ class BaseConsole(QFrame):
         font.setFamily("Courier New")
         font_width = QFontMetrics(font).width("M")
         self.setFont(font)
+        if virtual_output:
+            self._fit_input_area()
 
         geometry = edit.geometry()
         geometry.setWidth(font_width * 80 + 20)
@@ -129,6 +232,9 @@ class BaseConsole(QFrame):
         edit.resize(font_width * 80 + 20, font_width * 40)
 
         edit.setReadOnly(True)
+        # The console has no undo, and the undo stack would keep a copy of
+        # all text ever inserted or removed:
+        edit.setUndoRedoEnabled(False)
         edit.setTextInteractionFlags(
             Qt.TextSelectableByMouse | Qt.TextSelectableByKeyboard
         )
@@ -170,6 +276,10 @@ class BaseConsole(QFrame):
         self.edit.document().setDefaultFont(font)
         self.edit.setFont(font)
         super().setFont(font)
+        self.pbar.invalidate_cache()
+        if self.output_view is not None:
+            self.output_view.setFont(font)
+            self.output_view.update_contents()
 
     def eventFilter(self, edit, event):
         """Intercepts events from the input control."""
@@ -200,8 +310,14 @@ class BaseConsole(QFrame):
 
     @Slot(bool, object)
     def _finish_command(self, executed, result):
+        self._record_timing()
+        self.output.finish()
+        self._finish_collapse()
         if result is not None:
-            self._insert_output_text(repr(result), prompt=self.out_prompt())
+            # The interpreter passes the formatted result:
+            if not isinstance(result, str):
+                result = repr(result)
+            self._insert_output_text(result, prompt=self.out_prompt())
             self._insert_output_text("\n")
 
         if executed and self._last_input:
@@ -212,6 +328,7 @@ class BaseConsole(QFrame):
         self._show_ps()
 
     def _show_ps(self):
+        self.output.flush()
         if self._output_inserted and not self._more:
             self._insert_output_text("\n")
         self._insert_prompt_text(self._ps)
@@ -465,27 +582,383 @@ class BaseConsole(QFrame):
         self._setTextCursor(cursor)
         self.ensureCursorVisible()
 
-    def _insert_output_text(self, text, lf=False, keep_buffer=False, prompt=""):
+    def _insert_output_text(
+        self, text, lf=False, keep_buffer=False, prompt="", channel=None
+    ):
         if keep_buffer:
             self._copy_buffer = self.input_buffer()
 
+        if self.store is not None:
+            self._commit_input()
+            self._insert_prompt_text(prompt, self.store.prompts)
+            self.store.append(text, channel)
+            self.output_view.update_contents()
+            self._output_inserted = True
+            if lf:
+                self.process_input("")
+            return
+
+        self._index_input()
         cursor = self._textCursor()
         cursor.movePosition(QTextCursor.End)
-        cursor.insertText(text)
+        # The blocks are marked as output before the highlighter sees them,
+        # which happens only at the end of the edit block:
+        cursor.beginEditBlock()
+        first = cursor.block()
+        if (
+            first.length() > 1
+            and not is_output(first)
+            and not isinstance(first.userData(), NoHighlightData)
+        ):
+            # Don't mark a line that already contains input
+            first = first.next()
+        cursor.insertText(text, self._output_format(channel))
+        self._mark_output(first, cursor.block())
+        cursor.endEditBlock()
         self._prompt_pos = cursor.position()
+        self.search_index.append(text)
         self.ensureCursorVisible()
 
-        self._insert_prompt_text(prompt + "\n" * text.count("\n"))
+        self._insert_prompt_text(prompt)
+        self._prompt_doc.add_lines(text.count("\n"))
         self._output_inserted = True
+        self._trim_scrollback()
         if lf:
             self.process_input("")
 
+    def _mark_output(self, first, end):
+        """Mark the blocks from ``first`` to ``end`` as output, which is not
+        highlighted as Python code. ``end`` is only included if it isn't
+        empty, as it may still receive input."""
+        block = first
+        while block.isValid() and block.blockNumber() < end.blockNumber():
+            block.setUserState(OUTPUT_STATE)
+            block = block.next()
+        if end.length() > 1 and block == end:
+            end.setUserState(OUTPUT_STATE)
+
+    def _output_format(self, key):
+        """Return the text format for output of the given channel, or for a
+        ``(channel, attrs)`` key with ANSI text attributes."""
+        fmt = self._output_formats.get(key)
+        if fmt is None:
+            channel, attrs = key
+            fmt = char_format(self._output_formats[channel], attrs)
+            self._output_formats[key] = fmt
+        return fmt
+
+    def _remove_output_tail(self, text):
+        """Remove ``text`` from the end of the last output line."""
+        if self.store is not None:
+            self.store.remove_tail(len(text))
+            return
+        if self._collapsed is not None:
+            self._collapsed.remove_tail(len(text))
+            return
+        size = len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+        cursor = self._textCursor()
+        cursor.setPosition(self._prompt_pos)
+        cursor.setPosition(self._prompt_pos - size, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self._prompt_pos -= size
+        self.search_index.remove_tail(len(text))
+
+    def _insert_collapsible_output(self, text, channel=None):
+        """Insert output of the current command, or keep it out of the
+        document once the command has output more than the collapse limit."""
+        if self._collapsed is not None:
+            self._collapsed.append(channel, text)
+            self._update_placeholder()
+            return
+        count = text.count("\n")
+        limit = self._collapse_lines
+        if (
+            limit is None
+            or self.store is not None
+            or self._command_lines + count <= limit
+        ):
+            self._command_lines += count
+            self._insert_output_text(text, channel=channel)
+            return
+
+        pos = -1
+        for _ in range(limit - self._command_lines):
+            pos = text.find("\n", pos + 1)
+        self._insert_output_text(text[: pos + 1], channel=channel)
+        self._command_lines = limit
+        cursor = self._textCursor()
+        cursor.movePosition(QTextCursor.End)
+        if not cursor.atBlockStart():
+            self._insert_output_text("\n")
+
+        self._collapsed = CollapsedOutput()
+        self._collapsed.append(channel, text[pos + 1 :])
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText("\n")
+        self._prompt_pos = cursor.position()
+        self.search_index.append("\n")
+        self._placeholder = QTextCursor(cursor.block().previous())
+        self._placeholder.block().setUserData(CollapsedData(self._collapsed))
+        self._prompt_doc.add_lines(1)
+        self._update_placeholder()
+
+    def _update_placeholder(self, block=None):
+        """Show the number of hidden lines in the placeholder block, or
+        remove it if there are none left. Returns whether it was removed."""
+        if block is None:
+            block = self._placeholder.block()
+        data = block.userData()
+        if not isinstance(data, CollapsedData):
+            # removed from the scrollback
+            return False
+        cursor = QTextCursor(block)
+        cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+        before = cursor.selectionEnd() - cursor.selectionStart()
+        num = len(data.output)
+        if num or data.output is self._collapsed:
+            cursor.insertText(
+                f"[{num} more lines, click to expand]", self._collapsed_format
+            )
+            self._prompt_pos += cursor.position() - block.position() - before
+        else:
+            cursor.movePosition(QTextCursor.NextBlock, QTextCursor.KeepAnchor)
+            removed = cursor.selectionEnd() - cursor.selectionStart()
+            line = block.blockNumber()
+            cursor.removeSelectedText()
+            self._prompt_pos -= removed
+            del self._prompt_doc[line : line + 1]
+            return True
+        return False
+
+    def _finish_collapse(self):
+        """Display the last lines of the collapsed output of the command that
+        just finished."""
+        self._command_lines = 0
+        collapsed, self._collapsed = self._collapsed, None
+        if collapsed is None:
+            return
+        cursor = QTextCursor(self.edit.document())
+        cursor.beginEditBlock()
+        try:
+            runs = collapsed.take_last(self._collapse_tail)
+            # The placeholder is still followed only by the empty last line,
+            # so the search index stays in sync by removing one empty line:
+            if not len(collapsed) and self._update_placeholder():
+                self.search_index.remove_last_line()
+            for channel, text in runs:
+                self._insert_output_text(text, channel=channel)
+            self._update_placeholder()
+        finally:
+            cursor.endEditBlock()
+        self._placeholder = None
+
+    def expand_output(self, block):
+        """Insert the next page of the collapsed output represented by the
+        given placeholder block into the document.
+
+        :param block: The placeholder block
+        :type block: QTextBlock
+        """
+        data = block.userData()
+        if not isinstance(data, CollapsedData):
+            return
+        text_cursor = self._textCursor()
+        keep_input = text_cursor.position() >= self._prompt_pos
+        input_offset = text_cursor.position() - self._prompt_pos
+
+        runs = data.output.take_first(self._collapse_page)
+        if runs and not runs[-1][1].endswith("\n"):
+            runs.append((runs[-1][0], "\n"))
+        line = block.blockNumber()
+        cursor = QTextCursor(block)
+        cursor.beginEditBlock()
+        try:
+            start = cursor.position()
+            for channel, text in runs:
+                cursor.insertText(text, self._output_format(channel))
+            self._prompt_pos += cursor.position() - start
+            if self._output_end is not None:
+                self._output_end += cursor.position() - start
+            self._prompt_doc.insert_lines(line, cursor.blockNumber() - line)
+            # The inserted text took over the user data of the placeholder:
+            self._mark_output(block, cursor.block())
+            cursor.block().setUserData(CollapsedData(data.output))
+            end = self._prompt_pos
+            removed = self._update_placeholder(cursor.block())
+            if self._output_end is not None:
+                self._output_end += self._prompt_pos - end
+        finally:
+            cursor.endEditBlock()
+        if keep_input:
+            text_cursor.setPosition(self._prompt_pos + input_offset)
+            self._setTextCursor(text_cursor)
+        # The placeholder is an empty line in the search index, the new lines
+        # are inserted before it:
+        text = "".join([text for channel, text in runs])
+        self.search_index.replace_lines(line, int(removed), text)
+        if self.find_bar.isVisible():
+            # The offsets changed:
+            self.find_bar.search()
+
+    def _trim_scrollback(self):
+        """Remove the oldest blocks if the scrollback limit is exceeded.
+
+        To keep the cost per inserted line low, this only does something once
+        the limit is exceeded by a certain margin, and then removes all
+        excess blocks at once."""
+        lines = self._scrollback_lines
+        chars = self._scrollback_chars
+        if lines is None and chars is None:
+            return
+        doc = self.edit.document()
+        num = 0
+        if lines is not None and doc.blockCount() > lines + max(lines // 10, 100):
+            num = doc.blockCount() - lines
+        if chars is not None and doc.characterCount() > chars + max(chars // 10, 10000):
+            num = max(num, doc.findBlock(doc.characterCount() - chars).blockNumber())
+        # Never remove the current input:
+        num = min(num, doc.findBlock(self._prompt_pos).blockNumber())
+        if num > 0:
+            self._remove_blocks(num)
+
+    def _remove_blocks(self, num):
+        """Remove the first ``num`` blocks of the document."""
+        doc = self.edit.document()
+        cursor = QTextCursor(doc)
+        cursor.setPosition(
+            doc.findBlockByNumber(num).position(), QTextCursor.KeepAnchor
+        )
+        self._prompt_pos -= cursor.selectionEnd()
+        cursor.removeSelectedText()
+        del self._prompt_doc[:num]
+        self.search_index.remove_lines(num)
+
     def _update_prompt_pos(self):
+        if self.store is not None:
+            self._commit_input()
+        self._index_input()
         cursor = self._textCursor()
         cursor.movePosition(QTextCursor.End)
         self._prompt_pos = cursor.position()
         self._output_inserted = self._more
 
+    def _index_input(self):
+        """Add the input after the prompt position, which becomes part of the
+        history, to the search index (only without ``virtual_output``)."""
+        if self.store is not None:
+            return
+        cursor = QTextCursor(self.edit.document())
+        cursor.setPosition(self._prompt_pos)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        self.search_index.append(self._selected_text(cursor))
+
+    def show_match(self, start, end):
+        """Select the text between the given offsets of the search index and
+        scroll it into view. Returns False if the text was removed from the
+        console.
+
+        :param start: Start offset of the text
+        :type start: int
+        :param end: End offset of the text
+        :type end: int
+        :rtype: bool
+        """
+        index = self.search_index
+        line = index.line_of(start)
+        if line < 0:
+            return False
+        if self.output_view is not None:
+            self.output_view.show_line(line)
+            return True
+        cursor = QTextCursor(self.edit.document())
+        cursor.setPosition(self._index_position(line, start))
+        cursor.setPosition(
+            self._index_position(index.line_of(end), end), QTextCursor.KeepAnchor
+        )
+        self._setTextCursor(cursor)
+        self.ensureCursorVisible()
+        return True
+
+    def _index_position(self, line, offset):
+        """Return the document position of an offset in the given line of
+        the search index."""
+        index = self.search_index
+        block = self.edit.document().findBlockByNumber(line)
+        text = block.text()[: offset - index.line_range(line)[0]]
+        size = len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+        return block.position() + size
+
+    def _commit_input(self):
+        """Move the content of the input area, including prompts and
+        highlighting, to the line store (only with ``virtual_output``)."""
+        doc = self.edit.document()
+        if doc.isEmpty() and not self._prompt_doc[0]:
+            return
+        block = doc.begin()
+        while block.isValid():
+            if block.blockNumber() > 0:
+                self.store.append("\n")
+            self._insert_prompt_text(
+                self._prompt_doc[block.blockNumber()], self.store.prompts
+            )
+            for key, text in self._block_runs(block):
+                self.store.append(text, key)
+            block = block.next()
+        self.edit.clear()
+        self._prompt_doc = PromptDocument()
+        self._prompt_pos = 0
+        self.output_view.update_contents()
+
+    def _block_runs(self, block):
+        """Return the text of the block as ``(key, text)`` runs, with keys
+        for the formats set by the highlighter."""
+        text = block.text()
+        if not text.isascii():
+            # positions of the layout are in UTF-16 code units:
+            index = [i for i, c in enumerate(text) for _ in range(1 + (c > "\uffff"))]
+            index.append(len(text))
+        else:
+            index = range(len(text) + 1)
+        runs = []
+        pos = 0
+        for fmt_range in sorted(block.layout().formats(), key=lambda r: r.start):
+            start = index[fmt_range.start]
+            end = index[fmt_range.start + fmt_range.length]
+            if start < pos:
+                continue
+            if start > pos:
+                runs.append((None, text[pos:start]))
+            runs.append((self._input_format_key(fmt_range.format), text[start:end]))
+            pos = end
+        if pos < len(text):
+            runs.append((None, text[pos:]))
+        return runs
+
+    def _input_format_key(self, fmt):
+        for i, known in enumerate(self._input_formats):
+            if known == fmt:
+                return ("input", i)
+        key = ("input", len(self._input_formats))
+        # The format of a layout range is deleted along with the range in
+        # PySide, so a copy is kept:
+        fmt = QTextCharFormat(fmt)
+        self._input_formats.append(fmt)
+        self._output_formats[key] = fmt
+        return key
+
+    def _fit_input_area(self):
+        """Resize the input area to its content (only with
+        ``virtual_output``)."""
+        lines = min(max(self.edit.document().blockCount(), 1), 10)
+        margins = self.edit.contentsMargins()
+        height = (
+            lines * self.edit.fontMetrics().lineSpacing()
+            + 2 * int(self.edit.document().documentMargin())
+            + margins.top()
+            + margins.bottom()
+        )
+        self.edit.setFixedHeight(height)
+
     def _show_welcome_message(self):
         """Display the welcome message with plain text formatting.
 
@@ -497,9 +970,10 @@ class BaseConsole(QFrame):
 
         # Clear the current prompt that was shown during init
         self.edit.clear()
-        self._prompt_doc = [""]
+        self._prompt_doc = PromptDocument()
         self._prompt_pos = 0
         self._output_inserted = False
+        self.search_index.clear()
 
         cursor = self._textCursor()
         cursor.movePosition(QTextCursor.End)
@@ -521,6 +995,7 @@ class BaseConsole(QFrame):
             block = cursor.block()
             block.setUserData(NoHighlightData())
 
+        self._index_input()
         self._prompt_pos = cursor.position()
 
         # Update prompt area for the welcome message lines
@@ -587,15 +1062,12 @@ class BaseConsole(QFrame):
         self.ensureCursorVisible()
 
         self._remove_selected_input(self._textCursor())
-        self._textCursor().insertText(text)
+        # Don't inherit the format of preceding output:
+        self._textCursor().insertText(text, QTextCharFormat())
 
         if show_ps and "\n" in text:
             self._update_ps(True)
-            for _ in range(text.count("\n")):
-                # NOTE: need to insert in two steps, because this internally
-                # uses setAlignment, which affects only the first line:
-                self._insert_prompt_text("\n")
-                self._insert_prompt_text(self._ps)
+            self._insert_prompt_text(("\n" + self._ps) * text.count("\n"))
         elif "\n" in text:
             self._insert_prompt_text("\n" * text.count("\n"))
 
@@ -611,10 +1083,12 @@ class BaseConsole(QFrame):
         Otherwise, it is passed to the interpreter for execution.
         """
         self._last_input = source
+        self._started = (self._current_line, time.time(), time.monotonic())
 
         # Check if this is a system command
         if self.shell_cmd_prefix and source.strip().startswith(self.shell_cmd_prefix):
             self._run_system_command(source.strip()[len(self.shell_cmd_prefix) :])
+            self._record_timing()
             self._more = False
             if self._last_input:
                 self._current_line += 1
@@ -633,6 +1107,12 @@ class BaseConsole(QFrame):
                 self.command_history.add(source)
                 self._update_prompt_pos()
 
+    def _record_timing(self):
+        if self._started is not None and self._last_input:
+            number, start, clock = self._started
+            self._timings[number] = (start, time.monotonic() - clock)
+        self._started = None
+
     def _run_system_command(self, command):
         """Execute a system command and display its output."""
         try:
@@ -667,25 +1147,61 @@ class BaseConsole(QFrame):
         else:
             self._last_input = ""
             self.stdout.write("^C\n")
+            # Insert it now, a later flush would mark the output as inserted
+            # again, which adds an empty line before the prompt:
+            self.output.flush()
             self._output_inserted = False
             self._more = False
             self._update_ps(self._more)
             self._show_ps()
 
-    def _stdout_data_handler(self, data):
-        self._insert_output_text(data)
-
-        if len(self._copy_buffer) > 0:
-            self.insert_input_text(self._copy_buffer)
-            self._copy_buffer = ""
-
-    def _insert_prompt_text(self, text):
-        lines = text.split("\n")
-        self._prompt_doc[-1] += lines[0]
-        self._prompt_doc += lines[1:]
-        for line in self._prompt_doc[-len(lines) :]:
+    def _output_data_handler(self, runs):
+        # Group everything into a single edit, so that the document is laid
+        # out and highlighted only once per flush:
+        doc = self.edit.document()
+        if self._output_position() != self._output_end:
+            self._ansi.reset()
+        for channel, data in runs:
+            self._ansi.feed(data, channel)
+        rendered = self._ansi.drain()
+
+        cursor = QTextCursor(doc)
+        cursor.beginEditBlock()
+        try:
+            if rendered is not None:
+                removed, runs = rendered
+                if removed:
+                    self._remove_output_tail(removed)
+                for key, data in runs:
+                    self._insert_collapsible_output(data, channel=key)
+            self._output_end = self._output_position()
+
+            if len(self._copy_buffer) > 0:
+                self.insert_input_text(self._copy_buffer)
+                self._copy_buffer = ""
+        finally:
+            cursor.endEditBlock()
+
+    def _output_position(self):
+        """Return the end of the output, to detect whether anything else was
+        inserted after it."""
+        if self.store is not None:
+            return self.store.size()
+        return self.edit.document().characterCount() - 1
+
+    def _insert_prompt_text(self, text, prompt_doc=None):
+        if prompt_doc is None:
+            prompt_doc = self._prompt_doc
+        # Each distinct prompt only needs to be measured once:
+        for line in dict.fromkeys(prompt_doc.append(text)):
             self.pbar.adjust_width(line)
 
+    def _visible_blocks(self):
+        """Return the first and last block that are visible in the edit."""
+        edit = self.edit
+        bottom = QPoint(0, edit.viewport().height() - 1)
+        return edit.firstVisibleBlock(), edit.cursorForPosition(bottom).block()
+
     def _get_prompt_text(self, line_number):
         return self._prompt_doc[line_number]
 
@@ -715,9 +1231,64 @@ class BaseConsole(QFrame):
     def ctrl_d_exits_console(self, b):
         self._ctrl_d_exits = b
 
+    def set_scrollback(self, lines=None, chars=None):
+        """Limit the number of lines and/or characters kept in the console.
+        The oldest lines are discarded once a limit is exceeded. None means
+        unlimited."""
+        self._scrollback_lines = lines
+        self._scrollback_chars = chars
+        self._trim_scrollback()
+
+    def set_output_collapse(self, lines=None, tail=20, page=1000):
+        """Collapse the output of commands that print many lines.
+
+        Only the first ``lines`` and the last ``tail`` lines of the output of
+        a command are inserted into the console. The lines in between are
+        kept out of the document, represented by a placeholder line. Clicking
+        the placeholder inserts the next ``page`` lines. None disables
+        collapsing."""
+        self._collapse_lines = lines
+        self._collapse_tail = tail
+        self._collapse_page = page
+
+    def export(self, file, format="text", background=False):
+        """Write the console session to a file.
+
+        The lines are written as they are read from the console, so that the
+        memory use does not depend on the length of the session.
+
+        :param file: Path or text file object to write to
+        :type file: str, os.PathLike, io.TextIOBase
+        :param format: ``"text"``, ``"html"`` (with the formats of the
+                output and the highlighting of the input) or ``"jsonl"``
+                (one record per command with its input, output, start time
+                and duration)
+        :type format: str
+        :param background: Walk the console in short time slices of the
+                event loop and write the file from a background thread,
+                instead of blocking until done (Defaults to False)
+        :type background: bool
+        :return: The export, whose ``finished`` signal is emitted when done
+        :rtype: SessionExport
+        """
+        export = SessionExport(self, file, format)
+        if background:
+            export.start()
+        else:
+            export.run()
+        return export
+
     def clear(self):
         """Clear the console display."""
-        self._prompt_doc = [""]
+        if self.store is not None:
+            self.store.clear()
+            self.output_view.update_contents()
+        self.search_index.clear()
+        self.find_bar.search()
+        self._timings = {}
+        self._collapsed = None
+        self._placeholder = None
+        self._prompt_doc = PromptDocument()
         self._prompt_pos = 0
         self._output_inserted = False
         self._more = False
@@ -760,7 +1331,30 @@ class PythonConsole(BaseConsole):
         inprompt=None,
         outprompt=None,
         welcome_message=None,
+        capture_fds=False,
+        virtual_output=False,
+        highlighter_class=PythonHighlighter,
+        output_highlighter=None,
     ):
+        """
+        See :class:`BaseConsole` for the common parameters.
+
+        :param locals: Namespace to execute code in (Defaults to None)
+        :type locals: dict, None
+        :param capture_fds: Also display output that is written directly to
+                the process-level file descriptors 1 and 2 while a command is
+                running, e.g. by C extensions (Defaults to False). Note that
+                this captures the output of all threads of the process.
+        :type capture_fds: bool
+        :param highlighter_class: Syntax highlighter for the input, e.g.
+                :class:`StatefulPythonHighlighter`, which handles multi-line
+                strings and f-strings (Defaults to PythonHighlighter)
+        :type highlighter_class: type
+        :param output_highlighter: Optional highlighter for the output, e.g.
+                :class:`TracebackHighlighter` (Defaults to None, i.e. the
+                output is not highlighted)
+        :type output_highlighter: PromptHighlighter, None
+        """
         super().__init__(
             parent,
             formats=formats,
@@ -768,26 +1362,42 @@ class PythonConsole(BaseConsole):
             inprompt=inprompt,
             outprompt=outprompt,
             welcome_message=welcome_message,
+            virtual_output=virtual_output,
         )
 
         # Display welcome message before creating highlighter
         # to prevent syntax highlighting of the message
         self._show_welcome_message()
 
-        self.highlighter = PythonHighlighter(
+        self.highlighter = highlighter_class(
             self.edit.document(),
             formats=formats,
             shell_cmd_prefix=self.shell_cmd_prefix,
+            output_highlighter=output_highlighter,
+        )
+        self.highlighter.visible_range = self._visible_blocks
+        self.interpreter = PythonInterpreter(
+            self.stdin,
+            self.stdout,
+            locals=locals,
+            capture_fds=capture_fds,
+            stderr=self.stderr,
+            errors=self._errors,
         )
-        self.interpreter = PythonInterpreter(self.stdin, self.stdout, locals=locals)
         self.interpreter.done_signal.connect(self._finish_command)
         self.interpreter.exit_signal.connect(self.exit)
         self.set_auto_complete_mode(COMPLETE_MODE.DROPDOWN)
         self._thread = None
+        self.output.owner_busy = self._gui_busy
 
     def _executing(self):
         return self.interpreter.executing()
 
+    def _gui_busy(self):
+        """Return whether code is running in the GUI thread, which then
+        can't display the output."""
+        return self._thread is None and self._executing()
+
     def _cancel(self):
         if self._thread:
             self._thread.inject_exception(KeyboardInterrupt)
@@ -799,6 +1409,8 @@ class PythonConsole(BaseConsole):
 
     def exit(self):
         """Exit interpreter."""
+        # Don't leave the interpreter thread waiting for the output buffer:
+        self.output.close()
         if self._thread:
             self._thread.exit()
             self._thread.wait()
@@ -873,3 +1485,11 @@ class InputArea(QPlainTextEdit):
 
     def insertFromMimeData(self, mime_data):
         return self.parent().insertFromMimeData(mime_data)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            block = self.cursorForPosition(event.pos()).block()
+            if isinstance(block.userData(), CollapsedData):
+                self.parent().expand_output(block)
+                return
+        super().mousePressEvent(event)
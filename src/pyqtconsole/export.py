@@ -0,0 +1,314 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from html import escape
+
+from qtpy.QtCore import QObject, Qt, QTimer, Signal
+from qtpy.QtGui import QFont, QTextCharFormat
+
+try:  # PyQt >= 5.11
+    QueuedConnection = Qt.ConnectionType.QueuedConnection
+except AttributeError:  # PyQt < 5.11
+    QueuedConnection = Qt.QueuedConnection
+
+
+def _utf16_index(text):
+    """Map the UTF-16 positions used by Qt to indices of ``text``."""
+    if text.isascii():
+        return range(len(text) + 1)
+    index = [i for i, c in enumerate(text) for _ in range(1 + (c > "\uffff"))]
+    index.append(len(text))
+    return index
+
+
+def block_runs(block):
+    """Return the text of a QTextBlock as a list of ``(format, text)`` runs,
+    with the formats set by the highlighter merged into the character
+    formats, as they are displayed."""
+    text = block.text()
+    index = _utf16_index(text)
+    fragments = []
+    it = block.begin()
+    while not it.atEnd():
+        fragment = it.fragment()
+        if fragment.isValid():
+            start = fragment.position() - block.position()
+            fragments.append((start, start + fragment.length(), fragment.charFormat()))
+        it += 1
+    # Copies of the formats, which PySide deletes along with the ranges:
+    ranges = [
+        (r.start, r.start + r.length, QTextCharFormat(r.format))
+        for r in sorted(block.layout().formats(), key=lambda r: r.start)
+    ]
+    bounds = sorted(
+        {b for start, end, _ in fragments + ranges for b in (start, end)}
+        | {0, len(index) - 1}
+    )
+    runs = []
+    for start, end in zip(bounds, bounds[1:]):
+        fmt = QTextCharFormat()
+        for items in (fragments, ranges):
+            for item_start, item_end, item_format in items:
+                if item_start <= start < item_end:
+                    fmt.merge(item_format)
+        runs.append((fmt, text[index[start] : index[end]]))
+    return runs
+
+
+def iter_lines(console, formats=False):
+    """Yield the lines of the console as ``(prompt, text)``, or as ``(prompt,
+    runs)`` with the runs of :func:`block_runs` if ``formats`` is true.
+
+    The document is walked by block number, so that it may be modified
+    between the steps. Lines that are added meanwhile are included, lines
+    that are removed from the scrollback are skipped.
+    """
+    store = console.store
+    if store is not None:
+        for line in range(console.output_view.line_count()):
+            if formats:
+                runs = [
+                    (console._output_format(key), text)
+                    for key, text in store.line_runs(line)
+                ]
+                yield store.prompts[line], runs
+            else:
+                yield store.prompts[line], store.line(line)
+    doc = console.edit.document()
+    line = 0
+    while line < doc.blockCount():
+        block = doc.findBlockByNumber(line)
+        prompt = console._prompt_doc[line]
+        yield prompt, (block_runs(block) if formats else block.text())
+        line += 1
+
+
+def _prompt_width(console):
+    prompts = console._prompt_doc.distinct()
+    if console.store is not None:
+        prompts += console.store.prompts.distinct()
+    return max(map(len, prompts), default=0)
+
+
+def iter_text(console):
+    """Yield the console as plain text, with the prompts right-aligned in
+    front of the lines."""
+    width = _prompt_width(console)
+    for prompt, text in iter_lines(console):
+        yield prompt.rjust(width) + text + "\n"
+
+
+_HTML_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+pre { font-family: monospace; }
+.prompt { color: gray; }
+</style>
+</head>
+<body>
+<pre>
+"""
+
+_HTML_FOOTER = """</pre>
+</body>
+</html>
+"""
+
+
+def html_style(fmt):
+    """Return the CSS style of a QTextCharFormat."""
+    style = []
+    if fmt.foreground().style() != Qt.NoBrush:
+        style.append(f"color: {fmt.foreground().color().name()}")
+    if fmt.background().style() != Qt.NoBrush:
+        style.append(f"background-color: {fmt.background().color().name()}")
+    if fmt.fontWeight() > QFont.Normal:
+        style.append("font-weight: bold")
+    if fmt.fontItalic():
+        style.append("font-style: italic")
+    if fmt.fontUnderline():
+        style.append("text-decoration: underline")
+    return "; ".join(style)
+
+
+def iter_html(console):
+    """Yield the console as HTML document, with the formats of the output
+    and the highlighting of the input."""
+    width = _prompt_width(console)
+    yield _HTML_HEADER
+    for prompt, runs in iter_lines(console, formats=True):
+        parts = [f'<span class="prompt">{escape(prompt.rjust(width))}</span>']
+        for fmt, text in runs:
+            style = html_style(fmt)
+            if style:
+                parts.append(f'<span style="{style}">{escape(text)}</span>')
+            else:
+                parts.append(escape(text))
+        parts.append("\n")
+        yield "".join(parts)
+    yield _HTML_FOOTER
+
+
+def _prompt_pattern(prompt):
+    """Return a regular expression for a prompt format (e.g. ``IN [%d]: ``)
+    with a group for the number."""
+    return re.compile(re.escape(prompt).replace("%d", r"(-?\d+)"))
+
+
+def iter_jsonl(console):
+    """Yield the console as JSON lines, with one record per cell.
+
+    Each record has the ``input`` and ``output`` text of a cell, its
+    ``number`` and, if it was executed, the ``start`` time (in ISO format)
+    and ``duration`` (in seconds). Text before the first input (e.g. the
+    welcome message) is output of a record with ``input`` set to None. The
+    prompt waiting for input is only exported once something was typed.
+    """
+    in_prompt = _prompt_pattern(console._ps1)
+    more = console._ps2.strip()
+    cell = None
+    for prompt, text in iter_lines(console):
+        match = in_prompt.fullmatch(prompt)
+        if match:
+            if cell is not None:
+                yield _record(console, *cell)
+            number = int(match.group(1)) if match.groups() else None
+            cell = (number, [text], [])
+        elif cell is not None and cell[1] and not cell[2] and prompt.strip() == more:
+            cell[1].append(text)
+        else:
+            if cell is None:
+                cell = (None, None, [])
+            cell[2].append(text)
+    if cell is not None and (cell[1] is None or any(cell[1]) or cell[2]):
+        yield _record(console, *cell)
+
+
+def _record(console, number, input_lines, output_lines):
+    start, duration = console._timings.get(number, (None, None))
+    record = {
+        "number": number,
+        "input": None if input_lines is None else "\n".join(input_lines),
+        "output": "\n".join(output_lines),
+        "start": None if start is None else datetime.fromtimestamp(start).isoformat(),
+        "duration": duration,
+    }
+    return json.dumps(record) + "\n"
+
+
+FORMATS = {"text": iter_text, "html": iter_html, "jsonl": iter_jsonl}
+
+
+class SessionExport(QObject):
+    """Writes the lines of a console to a file as they are generated, so
+    that the memory use does not depend on the length of the session.
+
+    :meth:`run` writes everything at once. :meth:`start` instead walks the
+    console in time slices of the event loop, and writes the text in a
+    background thread. ``finished`` is emitted with the exception that
+    occurred, or None.
+    """
+
+    finished = Signal(object)
+    _written = Signal(object)
+
+    # Seconds of the event loop to spend per time slice:
+    time_slice = 0.01
+    # Characters handed to the writer thread at once:
+    batch_size = 1 << 16
+
+    def __init__(self, console, file, format="text"):
+        """
+        :param console: The console to export
+        :type console: BaseConsole
+        :param file: Path or text file object to write to
+        :type file: str, os.PathLike, io.TextIOBase
+        :param format: One of ``"text"``, ``"html"`` or ``"jsonl"``
+        :type format: str
+        """
+        super().__init__(console)
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format: {format!r}")
+        self.file = file
+        self.error = None
+        self.done = False
+        self._pieces = FORMATS[format](console)
+        self._written.connect(self._finish, QueuedConnection)
+
+    def _open(self):
+        if isinstance(self.file, (str, os.PathLike)):
+            return open(self.file, "w", encoding="utf-8"), True
+        return self.file, False
+
+    def run(self):
+        """Write the whole session, blocking until done."""
+        file, close = self._open()
+        try:
+            for piece in self._pieces:
+                file.write(piece)
+        finally:
+            if close:
+                file.close()
+        self._finish(None)
+
+    def start(self):
+        """Start writing in the background."""
+        self._queue = queue.Queue(maxsize=16)
+        thread = threading.Thread(target=self._write_queued, daemon=True)
+        thread.start()
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._produce)
+        self._timer.start(0)
+
+    def _produce(self):
+        deadline = time.monotonic() + self.time_slice
+        batch = []
+        size = 0
+        # Stop early if the writer failed:
+        done = self.error is not None
+        if not done:
+            for piece in self._pieces:
+                batch.append(piece)
+                size += len(piece)
+                if size >= self.batch_size or time.monotonic() > deadline:
+                    break
+            else:
+                done = True
+        self._queue.put((batch, done))
+        if done:
+            self._timer.stop()
+
+    def _write_queued(self):
+        error = None
+        try:
+            file, close = self._open()
+        except Exception as e:
+            file, close, error = None, False, e
+        self.error = error
+        while True:
+            batch, done = self._queue.get()
+            if error is None:
+                try:
+                    file.write("".join(batch))
+                except Exception as e:
+                    # Keep consuming, until the producer notices the error:
+                    self.error = error = e
+            if done:
+                break
+        if close:
+            try:
+                file.close()
+            except Exception as e:
+                error = error or e
+        self._written.emit(error)
+
+    def _finish(self, error):
+        self.error = error
+        self.done = True
+        self.finished.emit(error)
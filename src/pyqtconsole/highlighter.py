@@ -1,14 +1,24 @@
 import keyword
 import re
+import time
+from bisect import bisect_left
 
+from qtpy.QtCore import QTimer
 from qtpy.QtGui import (
     QColor,
     QFont,
     QSyntaxHighlighter,
     QTextBlockUserData,
     QTextCharFormat,
+    QTextCursor,
 )
 
+from .cache import LRUCache
+
+# Characters outside the Basic Multilingual Plane, which take two UTF-16 code
+# units:
+_ASTRAL = re.compile("[\U00010000-\U0010ffff]")
+
 
 class NoHighlightData(QTextBlockUserData):
     """User data to mark blocks that should not be syntax highlighted."""
@@ -16,6 +26,18 @@ class NoHighlightData(QTextBlockUserData):
     pass
 
 
+# Block state marking blocks of program output, which are only highlighted by
+# the output highlighter, if any. Unlike user data, it takes no memory per
+# block. The highlighters keep the state of these blocks, and treat it like
+# the state of a block without any open construct when highlighting the next:
+OUTPUT_STATE = -2
+
+
+def is_output(block):
+    """Return whether ``block`` is marked as program output."""
+    return block.userState() == OUTPUT_STATE
+
+
 def format(color, style=""):
     """Return a QTextCharFormat with the given attributes."""
     _format = QTextCharFormat()
@@ -46,12 +68,21 @@ STYLES = {
     "fstring": format("darkCyan", "bold"),
     "escape": format("darkorange", "bold"),
     "shellcmd": format(None, "bold"),
+    "stderr": format("red"),
+    "collapsed": format("darkGray", "italic"),
+    "tbfile": format("darkBlue"),
+    "tbline": format("darkBlue", "bold"),
+    "tberror": format("red", "bold"),
 }
 
 
 class PromptHighlighter:
+    # Number of texts whose highlighting is cached:
+    cache_size = 256
+
     def __init__(self, formats=None):
         self.styles = styles = dict(STYLES, **(formats or {}))
+        self.cache = LRUCache(self.cache_size)
         self.rules = [
             # Match the prompt incase of a console
             (re.compile(r"IN[^\:]*"), 0, styles["inprompt"]),
@@ -61,9 +92,37 @@ class PromptHighlighter:
         ]
 
     def highlight(self, text):
-        for expression, nth, format in self.rules:
-            for m in expression.finditer(text):
-                yield (m.start(nth), m.end(nth) - m.start(nth), format)
+        """Return the ranges to format as list of ``(start, length, format)``
+        tuples."""
+        ranges = self.cache.get(text)
+        if ranges is None:
+            ranges = [
+                (m.start(nth), m.end(nth) - m.start(nth), format)
+                for expression, nth, format in self.rules
+                for m in expression.finditer(text)
+            ]
+            self.cache.put(text, ranges)
+        return ranges
+
+
+class TracebackHighlighter(PromptHighlighter):
+    """Lightweight highlighter for the output, which marks the file names,
+    line numbers and exceptions of tracebacks."""
+
+    def __init__(self, formats=None):
+        super().__init__(formats)
+        styles = self.styles
+        self.rules = [
+            # File "<path>", line <number>
+            (re.compile(r'^\s*File "([^"]*)"'), 1, styles["tbfile"]),
+            (re.compile(r'^\s*File "[^"]*", line (\d+)'), 1, styles["tbline"]),
+            # The exception at the end, e.g. ValueError or os.error
+            (
+                re.compile(r"^(?:\w+\.)*\w*(?:Error|Exception|Interrupt|Exit)\b"),
+                0,
+                styles["tberror"],
+            ),
+        ]
 
 
 class PythonHighlighter(QSyntaxHighlighter):
@@ -72,7 +131,18 @@ class PythonHighlighter(QSyntaxHighlighter):
     # Python keywords
     keywords = keyword.kwlist
 
-    def __init__(self, document, formats=None, shell_cmd_prefix=None):
+    # Number of (text, state) pairs whose highlighting is cached:
+    cache_size = 1024
+
+    # Seconds that highlighting a change may take, before the remaining
+    # blocks are deferred, e.g. after pasting many lines:
+    time_budget = 0.05
+    # Seconds of the event loop to spend per time slice on deferred blocks:
+    time_slice = 0.01
+
+    def __init__(
+        self, document, formats=None, shell_cmd_prefix=None, output_highlighter=None
+    ):
         """Initialize the syntax highlighter.
 
         :param document: The doc to apply syntax highlighting to
@@ -83,72 +153,222 @@ class PythonHighlighter(QSyntaxHighlighter):
         :param shell_cmd_prefix: Optional string prefix to identify shell
                                  command lines
         :type shell_cmd_prefix: str, None
+        :param output_highlighter: Optional highlighter for the blocks marked
+                                   with OUTPUT_STATE, e.g. TracebackHighlighter
+        :type output_highlighter: PromptHighlighter, None
         """
         QSyntaxHighlighter.__init__(self, document)
 
-        self.styles = styles = dict(STYLES, **(formats or {}))
+        self.styles = dict(STYLES, **(formats or {}))
         self.shell_cmd_prefix = shell_cmd_prefix
-
-        # Multi-line strings (expression, flag, style)
-        # FIXME: The triple-quotes in these two lines will mess up the
-        # syntax highlighting from this point onward
-        self.tri_single = (re.compile("'''"), 1, styles["string2"])
-        self.tri_double = (re.compile('"""'), 2, styles["string2"])
-
-        rules = []
-
-        # Keyword, operator, and brace rules
-        rules += [
-            (rf"\b{w}\b", 0, styles["keyword"]) for w in PythonHighlighter.keywords
-        ]
-
-        # All other rules
-        rules += [
-            # 'self'
-            # (r'\bself\b', 0, STYLES['self']),
-            # Double-quoted string, possibly containing escape sequences
-            (r'"[^"\\]*(\\.[^"\\]*)*"', 0, styles["string"]),
-            # Single-quoted string, possibly containing escape sequences
-            (r"'[^'\\]*(\\.[^'\\]*)*'", 0, styles["string"]),
-            # 'def' followed by an identifier
-            (r"\bdef\b\s*(\w+)", 1, styles["defclass"]),
-            # 'class' followed by an identifier
-            (r"\bclass\b\s*(\w+)", 1, styles["defclass"]),
-            # From '#' until a newline
-            (r"#[^\n]*", 0, styles["comment"]),
+        self.output_highlighter = output_highlighter
+        # The same lines recur often (e.g. recalled commands), so the formats
+        # set for a text and previous block state, and the resulting state,
+        # are remembered:
+        self.cache = LRUCache(self.cache_size)
+        self._ranges = None
+
+        # Optional function that returns the first and last visible
+        # QTextBlock, which are highlighted first when catching up:
+        self.visible_range = None
+        # End of the time budget of the current pass (None if unlimited), and
+        # the ranges of deferred blocks, as cursors at their first and last
+        # block:
+        self._deadline = None
+        self._pending = []
+        # Position after the last deferred block, and the cursor at the end
+        # of its range:
+        self._pending_next = None
+        self._pending_last = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._catch_up)
+        self._budget_document = None
+        self.setDocument(document)
+
+        # Triple-quoted strings may span multiple blocks. The block state
+        # tells in which kind of them the end of a block is (0 = none):
+        self.triple_quotes = {"'''": 1, '"""': 2}
+        self._triple_states = {1: "'''", 2: '"""'}
+
+        self._keywords = frozenset(self.keywords)
+        # The text whose UTF-16 offsets are mapped, and the positions of its
+        # characters that take two UTF-16 code units (None if there are none):
+        self._offset_text = None
+        self._astral = None
+
+        # All other rules are alternatives of a single pattern, so that each
+        # block is tokenized in one pass. Strings and comments are tokens as
+        # well, which is why nothing else is highlighted inside of them:
+        self.token_pattern = re.compile(
+            # From '#' until the end of the line
+            r"(?P<comment>#.*)"
+            # Start of a triple-quoted string, or a single or double quoted
+            # string, possibly containing escape sequences, with an optional
+            # prefix (e.g. f or rb)
+            r"|(?P<prefix>(?<!\w)[rRbBuUfF]{1,2})?"
+            r"(?:(?P<triple>'''|\"\"\")"
+            r"|(?P<string>\"[^\"\\]*(?:\\.[^\"\\]*)*\"|'[^'\\]*(?:\\.[^'\\]*)*'))"
+            # 'def' or 'class' followed by an identifier
+            r"|\b(?P<define>def|class)\b\s*(?P<name>\w+)"
             # Numeric literals
-            (r"\b[+-]?[0-9]+[lL]?\b", 0, styles["numbers"]),
-            (r"\b[+-]?0[xX][0-9A-Fa-f]+[lL]?\b", 0, styles["numbers"]),
-            (r"\b[+-]?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?\b", 0, styles["numbers"]),
-        ]
-
-        # Build a regex object for each pattern
-        self.rules = [(re.compile(pat), index, fmt) for (pat, index, fmt) in rules]
-
-        self.fstring_pattern = re.compile(
-            r"[fF][rR]?(['\"])([^'\"\\]*(\\.[^'\"\\]*)*?)\1"
+            r"|(?P<number>\b[+-]?(?:0[xX][0-9A-Fa-f]+[lL]?"
+            r"|[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|[0-9]+[lL])\b)"
+            # Identifiers, which are looked up in the keywords
+            r"|(?P<word>[^\W\d]\w*)"
         )
-
-        self.string_pattern = re.compile(r"(['\"])([^'\"\\]*(\\.[^'\"\\]*)*?)\1")
         self.escape_pattern = re.compile(
             r"\\(?:[\\\'\"\'abfnrtv0]|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|"
             r"U[0-9a-fA-F]{8}|N\{[^}]+\}|[0-7]{1,3})"
         )
 
+    def setDocument(self, document):
+        """Set the document to highlight. Each change of the document starts
+        a new pass with its own time budget, before it is highlighted."""
+        if self._budget_document is not None:
+            self._budget_document.contentsChange.disconnect(self._start_pass)
+        # Connect before the highlighter does, so that the budget starts
+        # before the change is highlighted:
+        QSyntaxHighlighter.setDocument(self, None)
+        self._budget_document = document
+        self._pending = []
+        if document is not None:
+            document.contentsChange.connect(self._start_pass)
+        QSyntaxHighlighter.setDocument(self, document)
+
+    def rehighlight(self):
+        # The styles may have been changed:
+        self.cache.clear()
+        self._start_pass()
+        QSyntaxHighlighter.rehighlight(self)
+
+    def rehighlightBlock(self, block):
+        self._start_pass()
+        QSyntaxHighlighter.rehighlightBlock(self, block)
+
+    def _start_pass(self, *args):
+        self._deadline = time.monotonic() + self.time_budget
+        self._pending_next = None
+        # Lift the budget (and catch up) once back in the event loop:
+        self._timer.start()
+
+    def _defer(self, block):
+        """Return whether highlighting the block is deferred, because the time
+        budget is used up."""
+        if time.monotonic() > self._deadline:
+            self._add_pending(block)
+            return True
+        if self._pending:
+            start, end = self._pending[0]
+            if start.block() == block:
+                if end.block() == block:
+                    del self._pending[0]
+                else:
+                    start.setPosition(block.next().position())
+        return False
+
+    def _cursor(self, position):
+        """Return a cursor that stays at the given position if text is
+        inserted there."""
+        cursor = QTextCursor(self.document())
+        cursor.setPosition(position)
+        cursor.setKeepPositionOnInsert(True)
+        return cursor
+
+    def _add_pending(self, block):
+        position = block.position()
+        # Qt highlights the blocks in order, so that mostly the range of the
+        # previous deferred block is extended:
+        if position == self._pending_next:
+            self._pending_next = position + block.length()
+            self._pending_last.setPosition(position)
+            return
+        self._pending_next = position + block.length()
+        for start, end in self._pending:
+            if start.block().position() <= position <= end.block().position():
+                if position < end.block().position():
+                    self._pending_next = None
+                self._pending_last = end
+                return
+            if block.previous() == end.block():
+                end.setPosition(position)
+                self._pending_last = end
+                return
+            if block.next() == start.block():
+                start.setPosition(position)
+                self._pending_next = None
+                return
+        self._pending.append((self._cursor(position), self._cursor(position)))
+        self._pending_last = self._pending[-1][1]
+
+    def _catch_up(self):
+        """Highlight the deferred blocks for one time slice, the visible ones
+        first."""
+        self._deadline = time.monotonic() + self.time_slice
+        self._pending_next = None
+        try:
+            if self._pending and self.visible_range is not None:
+                self._prioritize_visible(*self.visible_range())
+            while self._pending and time.monotonic() < self._deadline:
+                block = self._pending[0][0].block()
+                if not block.isValid():
+                    del self._pending[0]
+                    continue
+                QSyntaxHighlighter.rehighlightBlock(self, block)
+        finally:
+            self._deadline = None
+        if self._pending:
+            self._timer.start()
+
+    def _prioritize_visible(self, first, last):
+        """Move the pending blocks between the given blocks to the front."""
+        visible, hidden = [], []
+        for start, end in self._pending:
+            if (
+                end.block().position() < first.position()
+                or start.block().position() > last.position()
+            ):
+                hidden.append((start, end))
+                continue
+            if start.block().position() < first.position():
+                hidden.append((start, self._cursor(first.previous().position())))
+                start = self._cursor(first.position())
+            visible.append((start, end))
+        self._pending = visible + hidden
+
     def _to_utf16_offset(self, text, position):
         """Convert Python string position to UTF-16 offset for Qt.
 
         Qt uses UTF-16 encoding internally, where some characters (like emoji)
         take 2 code units.
         This converts Python string indices to UTF-16 positions.
+
+        The positions of such characters are found once per text (i.e. per
+        block), so that each conversion takes O(log n), or O(1) if there are
+        none.
         """
-        return len(text[:position].encode("utf-16-le")) // 2
+        if text is not self._offset_text:
+            self._offset_text = text
+            self._astral = None
+            if not text.isascii():
+                self._astral = [m.start() for m in _ASTRAL.finditer(text)] or None
+        if self._astral is None:
+            return position
+        return position + bisect_left(self._astral, position)
 
     def highlightBlock(self, text):
         """Apply syntax highlighting to the given block of text."""
+        if self._deadline is not None and self._defer(self.currentBlock()):
+            return
+
         # Skip highlighting if block is marked as no-highlight
         if isinstance(self.currentBlockUserData(), NoHighlightData):
             return
+        if self.currentBlockState() == OUTPUT_STATE:
+            if self.output_highlighter is not None:
+                for start, length, style in self.output_highlighter.highlight(text):
+                    self._set_format(text, start, start + length, style)
+            return
 
         # Check if this is a shell command line
         if self.shell_cmd_prefix and text.lstrip().startswith(self.shell_cmd_prefix):
@@ -161,139 +381,283 @@ class PythonHighlighter(QSyntaxHighlighter):
             self.setCurrentBlockState(0)
             return
 
-        s = self.styles["string"]
-        # Find all positions inside strings (using Python string indices)
-        string_positions = {
-            pos
-            for expression, nth, fmt in self.rules
-            if fmt == s
-            for m in expression.finditer(text)
-            for pos in range(m.start(nth), m.end(nth))
-        }
-
-        # Apply formatting, skipping non-string rules inside strings
-        for expression, nth, format in self.rules:
-            for m in expression.finditer(text):
-                # Skip non-string formatting if it's inside a string
-                # Check using Python string index, not UTF-16 offset
-                if format != s and m.start(nth) in string_positions:
-                    # Skip non-string formatting if it's inside a string
-                    continue
-                start_pos = self._to_utf16_offset(text, m.start(nth))
-                end_pos = self._to_utf16_offset(text, m.end(nth))
-                self.setFormat(start_pos, end_pos - start_pos, format)
-
-        # Highlight f-string interpolations
-        self.highlight_fstring_interpolations(text)
-
-        # Highlight escape sequences in strings
-        self.highlight_escape_sequences(text)
-
-        self.setCurrentBlockState(0)
-
-        # Do multi-line strings
-        in_multiline = self.match_multiline(text, *self.tri_single)
-        if not in_multiline:
-            in_multiline = self.match_multiline(text, *self.tri_double)
-
-    def match_multiline(self, text, delimiter, in_state, style):
-        """Do highlighting of multi-line strings. ``delimiter`` should be a
-        ``re.Pattern`` for triple-single-quotes or triple-double-quotes, and
-        ``in_state`` should be a unique integer to represent the corresponding
-        state changes when inside those strings. Returns True if we're still
-        inside a multi-line string when this function is finished.
-        """
-        # If inside triple-single quotes, start at 0
-        if self.previousBlockState() == in_state:
-            start = 0
-            add = 0
-        # Otherwise, look for the delimiter on this line
-        else:
-            m = delimiter.search(text)
-            if m:
-                start = m.start()
-                # Move past this match
-                add = m.end() - m.start()
-            else:
-                start = -1
-                add = -1
-
-        # As long as there's a delimiter match on this line...
-        while start >= 0:
-            # Look for the ending delimiter
-            m = delimiter.search(text, start + add)
-            # Ending delimiter on this line?
-            if m and (m.start() >= add):
-                # length = end - start + add + m.end() - m.start()
-                length = add + m.end() - start
+        # No state (-1, e.g. for the first block) is the same as state 0:
+        key = (text, max(self.previousBlockState(), 0))
+        cached = self.cache.get(key)
+        if cached is not None:
+            ranges, state = cached
+            for start, length, style in ranges:
+                self.setFormat(start, length, style)
+            self.setCurrentBlockState(state)
+            return
+        self._ranges = ranges = []
+        try:
+            self._highlight_tokens(text)
+        finally:
+            self._ranges = None
+        self.cache.put(key, (ranges, self.currentBlockState()))
+
+    def _highlight_tokens(self, text):
+        """Highlight the Python code of the block."""
+        styles = self.styles
+        pos = 0
+        state = self.previousBlockState()
+        if state in self._triple_states:
+            pos = self._triple_string(text, 0, 0, state)
+        while pos is not None:
+            m = self.token_pattern.search(text, pos)
+            if m is None:
                 self.setCurrentBlockState(0)
-            # No; multi-line string
-            else:
-                self.setCurrentBlockState(in_state)
-                length = len(text) - start + add
-            # Apply formatting - convert to UTF-16 positions
-            start_utf16 = self._to_utf16_offset(text, start)
-            end_utf16 = self._to_utf16_offset(text, start + length)
-            self.setFormat(start_utf16, end_utf16 - start_utf16, style)
-            # Look for the next match
-            m = delimiter.search(text, start + length)
-            if m:
-                start = m.start()
-            else:
                 break
-
-        # Return True if still inside a multi-line string, False otherwise
-        return self.currentBlockState() == in_state
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "word":
+                if m.group() in self._keywords:
+                    self._set_format(text, m.start(), m.end(), styles["keyword"])
+            elif kind == "triple":
+                state = self.triple_quotes[m.group("triple")]
+                pos = self._triple_string(text, m.start("triple"), pos, state)
+            elif kind == "string":
+                start, end = m.span("string")
+                self._set_format(text, start, end, styles["string"])
+                if "f" in (m.group("prefix") or "").lower():
+                    self._highlight_interpolations(text, start + 1, end - 1)
+                self._highlight_escapes(text, start + 1, end - 1)
+            elif kind == "name":
+                self._set_format(text, *m.span("define"), styles["keyword"])
+                self._set_format(text, *m.span("name"), styles["defclass"])
+            elif kind == "number":
+                self._set_format(text, m.start(), m.end(), styles["numbers"])
+            else:
+                self._set_format(text, m.start(), m.end(), styles["comment"])
+
+    def _triple_string(self, text, start, pos, state):
+        """Highlight a triple-quoted string that starts at ``start``, and
+        whose closing quotes are searched from ``pos``. Returns the end of
+        the string, or None if it continues in the next block."""
+        end = text.find(self._triple_states[state], pos)
+        if end < 0:
+            self._set_format(text, start, len(text), self.styles["string2"])
+            self.setCurrentBlockState(state)
+            return None
+        self._set_format(text, start, end + 3, self.styles["string2"])
+        return end + 3
+
+    def _set_format(self, text, start, end, style):
+        """Apply the style to the characters from ``start`` to ``end`` (as
+        Python string indices)."""
+        start_utf16 = self._to_utf16_offset(text, start)
+        end_utf16 = self._to_utf16_offset(text, end)
+        self.setFormat(start_utf16, end_utf16 - start_utf16, style)
+        if self._ranges is not None:
+            self._ranges.append((start_utf16, end_utf16 - start_utf16, style))
+
+    def _strings(self, text):
+        """Yield the single-line string tokens of the text as match objects."""
+        for m in self.token_pattern.finditer(text):
+            if m.lastgroup == "string":
+                yield m
 
     def highlight_fstring_interpolations(self, text):
         """Highlight f-string interpolations (the {} parts)."""
-        for m in self.fstring_pattern.finditer(text):
-            string_content = m.group(2)
-            ln = len(string_content)
-            content_start = m.start(2)
-
-            i = 0
-            while i < ln:
-                if string_content[i] == "{":
-                    # Skip escaped braces {{
-                    if i + 1 < ln and string_content[i + 1] == "{":
-                        i += 2
-                        continue
-
-                    # Find matching closing brace
-                    brace_count = 1
-                    j = i + 1
-                    while j < ln and brace_count > 0:
-                        if string_content[j : j + 2] == "}}":
-                            j += 2  # Skip escaped }}
-                        elif string_content[j] == "{":
-                            brace_count += 1
-                            j += 1
-                        elif string_content[j] == "}":
-                            brace_count -= 1
-                            j += 1
-                        else:
-                            j += 1
-
-                    if brace_count == 0:
-                        start_utf16 = self._to_utf16_offset(text, content_start + i)
-                        end_utf16 = self._to_utf16_offset(text, content_start + j)
-                        self.setFormat(
-                            start_utf16, end_utf16 - start_utf16, self.styles["fstring"]
-                        )
-                        i = j
-                    else:
-                        i += 1
-                else:
-                    i += 1
+        for m in self._strings(text):
+            if "f" in (m.group("prefix") or "").lower():
+                start, end = m.span("string")
+                self._highlight_interpolations(text, start + 1, end - 1)
 
     def highlight_escape_sequences(self, text):
         """Highlight escape sequences in strings."""
-        for m in self.string_pattern.finditer(text):
-            content_start = m.start(2)
-            for esc in self.escape_pattern.finditer(m.group(2)):
-                start_utf16 = self._to_utf16_offset(text, content_start + esc.start())
-                end_utf16 = self._to_utf16_offset(text, content_start + esc.end())
-                self.setFormat(
-                    start_utf16, end_utf16 - start_utf16, self.styles["escape"]
-                )
+        for m in self._strings(text):
+            start, end = m.span("string")
+            self._highlight_escapes(text, start + 1, end - 1)
+
+    def _highlight_interpolations(self, text, start, end):
+        """Highlight the interpolations in the string content from ``start``
+        to ``end``."""
+        i = start
+        while i < end:
+            if text[i] == "{":
+                # Skip escaped braces {{
+                if i + 1 < end and text[i + 1] == "{":
+                    i += 2
+                    continue
+
+                # Find matching closing brace
+                brace_count = 1
+                j = i + 1
+                while j < end and brace_count > 0:
+                    if text[j] == "}" and j + 1 < end and text[j + 1] == "}":
+                        j += 2  # Skip escaped }}
+                    elif text[j] == "{":
+                        brace_count += 1
+                        j += 1
+                    elif text[j] == "}":
+                        brace_count -= 1
+                        j += 1
+                    else:
+                        j += 1
+
+                if brace_count == 0:
+                    self._set_format(text, i, j, self.styles["fstring"])
+                    i = j
+                else:
+                    i += 1
+            else:
+                i += 1
+
+    def _highlight_escapes(self, text, start, end):
+        """Highlight the escape sequences in the string content from
+        ``start`` to ``end``."""
+        for esc in self.escape_pattern.finditer(text, start, end):
+            self._set_format(text, esc.start(), esc.end(), self.styles["escape"])
+
+
+class StatefulPythonHighlighter(PythonHighlighter):
+    """Python highlighter that lexes each block with a state machine, which
+    is carried over from one block to the next.
+
+    The state at the end of a block is the stack of strings and f-string
+    replacement fields that are still open there, e.g. a triple-quoted
+    f-string with a ``{`` that is closed in a later block. This handles
+    strings that contain the other kind of triple quotes, nested f-strings
+    (also with the same quotes), replacement fields that span multiple lines
+    and strings that are continued with a backslash.
+
+    Each distinct stack is stored once, and its index is the block state.
+    As Qt only highlights the next block again if the state of a block
+    changed, an edit re-lexes only the changed block and the blocks whose
+    state depends on it.
+    """
+
+    def __init__(
+        self, document, formats=None, shell_cmd_prefix=None, output_highlighter=None
+    ):
+        """See :class:`PythonHighlighter`."""
+        # The stacks, with the empty stack (i.e. plain code) as state 0:
+        self._stacks = [()]
+        self._stack_ids = {(): 0}
+        self._continued = False
+        super().__init__(document, formats, shell_cmd_prefix, output_highlighter)
+
+        self.code_pattern = re.compile(
+            # From '#' until the end of the line
+            r"(?P<comment>#.*)"
+            # Start of a string, with an optional prefix (e.g. f or rb)
+            r"|(?P<prefix>(?<!\w)[rRbBuUfF]{1,2})?(?P<quote>'''|\"\"\"|'|\")"
+            # 'def' or 'class' followed by an identifier
+            r"|\b(?P<define>def|class)\b\s*(?P<name>\w+)"
+            # Numeric literals
+            r"|(?P<number>\b[+-]?(?:0[xX][0-9A-Fa-f]+[lL]?"
+            r"|[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|[0-9]+[lL])\b)"
+            # Identifiers, which are looked up in the keywords
+            r"|(?P<word>[^\W\d]\w*)"
+            # Brackets, which are counted inside replacement fields
+            r"|(?P<open>[\[({])|(?P<close>[\])}])"
+        )
+        # The special characters inside strings, by quote and f-string flag:
+        self._string_patterns = {}
+        for quote in ("'''", '"""', "'", '"'):
+            end = re.escape(quote)
+            self._string_patterns[quote, False] = re.compile(r"\\|" + end)
+            self._string_patterns[quote, True] = re.compile(r"\\|\{\{|\}\}|\{|" + end)
+
+    def _highlight_tokens(self, text):
+        state = self.previousBlockState()
+        stack = list(self._stacks[state] if 0 < state < len(self._stacks) else ())
+        styles = self.styles
+        pos = 0
+        if stack and not isinstance(stack[-1], int):
+            pos = self._lex_string(text, 0, 0, stack)
+        while pos is not None:
+            # Code, either at the top level or in a replacement field, where
+            # it has the f-string style unless it is a token with its own:
+            field = styles["fstring"] if stack else None
+            m = self.code_pattern.search(text, pos)
+            if m is None:
+                if field is not None:
+                    self._set_format(text, pos, len(text), field)
+                break
+            if field is not None and m.start() > pos:
+                self._set_format(text, pos, m.start(), field)
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "word":
+                if m.group() in self._keywords:
+                    self._set_format(text, m.start(), pos, styles["keyword"])
+                elif field is not None:
+                    self._set_format(text, m.start(), pos, field)
+            elif kind == "quote":
+                prefix = (m.group("prefix") or "").lower()
+                stack.append((m.group("quote"), "f" in prefix, "r" in prefix))
+                pos = self._lex_string(text, m.start("quote"), pos, stack)
+            elif kind == "name":
+                self._set_format(text, *m.span("define"), styles["keyword"])
+                self._set_format(text, *m.span("name"), styles["defclass"])
+            elif kind == "number":
+                self._set_format(text, m.start(), pos, styles["numbers"])
+            elif kind == "comment":
+                self._set_format(text, m.start(), pos, styles["comment"])
+            elif field is not None:
+                self._set_format(text, m.start(), pos, field)
+                if kind == "open":
+                    stack[-1] += 1
+                elif stack[-1] > 0:
+                    stack[-1] -= 1
+                elif m.group() == "}":
+                    # End of the replacement field, back in the string:
+                    stack.pop()
+                    pos = self._lex_string(text, pos, pos, stack)
+
+        # Strings with single quotes end with the line, unless the newline is
+        # escaped with a backslash (i.e. the string is on top of the stack):
+        for i, context in enumerate(stack):
+            if isinstance(context, tuple) and len(context[0]) == 1:
+                if i < len(stack) - 1 or not self._continued:
+                    del stack[i:]
+                break
+        self.setCurrentBlockState(self._stack_id(tuple(stack)))
+
+    def _lex_string(self, text, start, pos, stack):
+        """Highlight the string on top of the stack, which starts at
+        ``start``, and whose content is searched from ``pos``. Returns the
+        position after the string, or after the ``{`` that starts a
+        replacement field. Returns None if the block ends first."""
+        quote, fstring, raw = stack[-1]
+        style = self.styles["string2" if len(quote) == 3 else "string"]
+        pattern = self._string_patterns[quote, fstring]
+        self._continued = False
+        while True:
+            m = pattern.search(text, pos)
+            if m is None:
+                self._set_format(text, start, len(text), style)
+                return None
+            token = m.group()
+            pos = m.end()
+            if token == "\\":
+                if pos == len(text):
+                    self._set_format(text, start, pos, style)
+                    self._continued = True
+                    return None
+                escape = self.escape_pattern.match(text, m.start())
+                end = escape.end() if escape else pos + 1
+                if not raw:
+                    self._set_format(text, start, m.start(), style)
+                    self._set_format(text, m.start(), end, self.styles["escape"])
+                    start = end
+                pos = end
+            elif token == "{":
+                self._set_format(text, start, m.start(), style)
+                self._set_format(text, m.start(), pos, self.styles["fstring"])
+                stack.append(0)
+                return pos
+            elif token not in ("{{", "}}"):
+                self._set_format(text, start, pos, style)
+                stack.pop()
+                return pos
+
+    def _stack_id(self, stack):
+        stack_id = self._stack_ids.get(stack)
+        if stack_id is None:
+            stack_id = self._stack_ids[stack] = len(self._stacks)
+            self._stacks.append(stack)
+        return stack_id
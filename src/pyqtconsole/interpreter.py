@@ -1,29 +1,59 @@
 import ast
 import contextlib
+import reprlib
 import sys
+import time
 from code import InteractiveInterpreter
+from collections import deque
 from functools import partial
 
 from qtpy.QtCore import QObject, Signal, Slot
 
+from .cache import LRUCache
+from .capture import NativeCapture
+
 
 class PythonInterpreter(QObject, InteractiveInterpreter):
     exec_signal = Signal(object)
     done_signal = Signal(bool, object)
     exit_signal = Signal(object)
 
-    def __init__(self, stdin, stdout, locals=None):
+    compile_cache_size = 128
+
+    def __init__(
+        self, stdin, stdout, locals=None, capture_fds=False, stderr=None, errors=None
+    ):
         QObject.__init__(self)
         InteractiveInterpreter.__init__(self, locals)
         self.locals["exit"] = Exit()
         self.stdin = stdin
         self.stdout = stdout
+        self.stderr = stderr or stdout
+        # Tracebacks and syntax errors of the interpreter itself, kept apart
+        # from the stderr of the user code so that they are never filtered:
+        self.errors = errors or self.stderr
+        # Optionally also capture output written directly to the file
+        # descriptors 1 and 2, e.g. by C extensions:
+        self.native_capture = (
+            NativeCapture({1: self.stdout, 2: self.stderr}) if capture_fds else None
+        )
         self._executing = False
-        self.compile = partial(compile_multi, self.compile)
+        # Compiled cells are cached, so that running them again from the
+        # history is faster:
+        self.compile_cache = LRUCache(self.compile_cache_size)
+        self.compile = partial(compile_multi, self.compile, cache=self.compile_cache)
+        # Results are formatted in the execution context, only the (bounded)
+        # text is passed to the GUI:
+        self.result_repr = ResultRepr()
+        self.last_result = None
 
     def executing(self):
         return self._executing
 
+    def full_repr(self):
+        """Return the complete, untruncated repr of the last result."""
+        return repr(self.last_result)
+
     def runcode(self, code):
         self.exec_signal.emit(code)
 
@@ -36,36 +66,41 @@ class PythonInterpreter(QObject, InteractiveInterpreter):
         # redirect IO, since we don't how IO is handled within the code we
         # are running. Same thing for the except hook, we don't know what the
         # user are doing in it.
+        capture = self.native_capture or contextlib.nullcontext()
         try:
-            with redirected_io(self.stdout):
+            with redirected_io(self.stdout, self.stderr), capture:
                 for code, mode in codes:
                     if mode == "eval":
                         result = eval(code, self.locals)
                     else:
                         exec(code, self.locals)
+                if result is not None:
+                    self.last_result = result
+                    result = self.result_repr.repr(result)
         except SystemExit as e:
             self.exit_signal.emit(e)
         except BaseException:
+            result = None
             self.showtraceback()
         finally:
             self._executing = False
             self.done_signal.emit(True, result)
 
     def write(self, data):
-        self.stdout.write(data)
+        self.errors.write(data)
 
     def showtraceback(self):
         type_, value, tb = sys.exc_info()
-        self.stdout.write("\n")
+        self.errors.write("\n")
 
         if type_ is KeyboardInterrupt:
-            self.stdout.write("KeyboardInterrupt\n")
+            self.errors.write("KeyboardInterrupt\n")
         else:
             with disabled_excepthook():
                 InteractiveInterpreter.showtraceback(self)
 
     def showsyntaxerror(self, filename=None, **kwargs):
-        self.stdout.write("\n")
+        self.errors.write("\n")
 
         with disabled_excepthook():
             # It seems Python 3.13 requires **kwargs, older versions don't
@@ -73,26 +108,181 @@ class PythonInterpreter(QObject, InteractiveInterpreter):
         self.done_signal.emit(False, None)
 
 
-def compile_multi(compiler, source, filename, symbol):
+class ResultRepr(reprlib.Repr):
+    """Format results with a bounded size and time.
+
+    Builtin containers are abbreviated after ``max_items`` items and the text
+    is cut after ``max_chars`` characters. Once ``timeout`` seconds have
+    passed, the remaining items are abbreviated as well. Objects of other
+    types are formatted using their own ``repr``, whose exceptions are passed
+    on. Values within the limits are formatted exactly like ``repr()`` does.
+    """
+
+    # Only these types are abbreviated, not their subclasses, which may have a
+    # repr of their own:
+    containers = (list, tuple, dict, set, frozenset, deque)
+
+    def __init__(self, max_chars=100_000, max_items=1000, timeout=1.0):
+        """
+        :param max_chars: Maximum length of the text (Defaults to 100000)
+        :type max_chars: int
+        :param max_items: Maximum number of items shown per container
+                (Defaults to 1000)
+        :type max_items: int
+        :param timeout: Time after which the remaining items are abbreviated,
+                in seconds (Defaults to 1)
+        :type timeout: float
+        """
+        super().__init__()
+        self.maxlevel = 20
+        self.maxtuple = self.maxlist = self.maxdict = max_items
+        self.maxset = self.maxfrozenset = self.maxdeque = max_items
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self._deadline = None
+        self._running = set()
+
+    def repr(self, x):
+        self._deadline = time.perf_counter() + self.timeout
+        self._running.clear()
+        return self._cut(super().repr(x))
+
+    def repr1(self, x, level):
+        if time.perf_counter() > self._deadline:
+            return "..."
+        if type(x) not in self.containers:
+            return self._cut(repr(x))
+        # Recursive containers are shown like repr() does:
+        if id(x) in self._running:
+            return "{...}" if type(x) is dict else "[...]"
+        self._running.add(id(x))
+        try:
+            return super().repr1(x, level)
+        finally:
+            self._running.discard(id(x))
+
+    def _cut(self, text):
+        if len(text) > self.max_chars:
+            text = text[: self.max_chars] + "..."
+        return text
+
+    def repr_dict(self, x, level):
+        # Unlike reprlib, keep the insertion order like repr() does:
+        if not x:
+            return "{}"
+        if level <= 0:
+            return "{...}"
+        items = []
+        for i, (key, value) in enumerate(x.items()):
+            if i >= self.maxdict:
+                items.append("...")
+                break
+            key = self.repr1(key, level - 1)
+            value = self.repr1(value, level - 1)
+            items.append(f"{key}: {value}")
+        return "{" + ", ".join(items) + "}"
+
+    def repr_set(self, x, level):
+        # Unlike reprlib, keep the iteration order like repr() does:
+        if not x:
+            return "set()"
+        return self._repr_iterable(x, level, "{", "}", self.maxset)
+
+    def repr_frozenset(self, x, level):
+        if not x:
+            return "frozenset()"
+        return self._repr_iterable(x, level, "frozenset({", "})", self.maxfrozenset)
+
+    def repr_deque(self, x, level):
+        right = "])" if x.maxlen is None else f"], maxlen={x.maxlen})"
+        return self._repr_iterable(x, level, "deque([", right, self.maxdeque)
+
+
+def compile_multi(compiler, source, filename, symbol, cache=None):
     """If mode is 'multi', split code into individual toplevel expressions or
-    statements. Returns a list of tuples ``(code, mode)``."""
+    statements. Returns a list of tuples ``(code, mode)``.
+
+    The result for a complete source is stored in ``cache`` (an
+    :class:`~pyqtconsole.cache.LRUCache`), if given, so that running the same
+    source again skips the compilation."""
     if symbol != "multi":
         return [(compiler(source, filename, symbol), symbol)]
-    # First, check if the source compiles at all. This raises an exception if
-    # there is a SyntaxError, or returns None if the code is incomplete:
-    if compiler(source, filename, "exec") is None:
-        return None
-    # Now split into individual 'single' units:
-    module = ast.parse(source)
+    if cache is not None:
+        codes = cache.get((source, filename))
+        if codes is not None:
+            return codes
+    # The source is parsed only once, and the tree is reused for all checks
+    # and the compilation:
+    try:
+        module = ast.parse(source, filename)
+    except SyntaxError:
+        # Let the compiler tell apart incomplete code (None) from invalid code,
+        # for which it raises the exception:
+        if compiler(source, filename, "exec") is None:
+            return None
+        raise
+    # The nodes are compiled separately, which would accept these anywhere:
+    check_future_imports(module, source, filename)
     # When entering a code block, the standard python interpreter waits for an
     # additional empty line to apply the input. We adhere to this convention,
-    # checked by `compiler(..., 'single')`:
+    # checked by `compiler(..., 'single')` on the last statement only:
     if module.body:
-        block_lineno = module.body[-1].lineno
-        block_source = source[find_nth("\n" + source, "\n", block_lineno) :]
-        if compiler(block_source, filename, "single") is None:
+        block_start = line_start(source, module.body[-1].lineno)
+        if compiler(source[block_start:], filename, "single") is None:
             return None
-    return [compile_single_node(node, filename) for node in module.body]
+    codes = compile_nodes(module.body, filename)
+    if cache is not None:
+        cache.put((source, filename), codes)
+    return codes
+
+
+def check_future_imports(module, source, filename):
+    """Raise a SyntaxError if a ``from __future__`` import of the module
+    follows other statements than a docstring and future imports."""
+    body = module.body
+    start = 0
+    if body and isinstance(body[0], ast.Expr):
+        value = body[0].value
+        if isinstance(value, ast.Constant) and isinstance(value.value, str):
+            start = 1
+    while (
+        start < len(body)
+        and isinstance(body[start], ast.ImportFrom)
+        and body[start].module == "__future__"
+    ):
+        start += 1
+    for node in body[start:]:
+        if isinstance(node, ast.ImportFrom) and node.module == "__future__":
+            line = source[line_start(source, node.lineno) :].partition("\n")[0]
+            raise SyntaxError(
+                "from __future__ imports must occur at the beginning of the file",
+                (filename, node.lineno, node.col_offset + 1, line),
+            )
+
+
+def compile_nodes(nodes, filename):
+    """Compile toplevel ast nodes, expressions in 'eval' mode so that their
+    value can be shown, and each run of statements in between as one unit in
+    'exec' mode. Returns a list of tuples ``(code, mode)``."""
+    codes = []
+    statements = []
+    for node in nodes:
+        if isinstance(node, ast.Expr):
+            if statements:
+                codes.append(compile_statements(statements, filename))
+                statements = []
+            codes.append(compile_single_node(node, filename))
+        else:
+            statements.append(node)
+    if statements:
+        codes.append(compile_statements(statements, filename))
+    return codes
+
+
+def compile_statements(nodes, filename):
+    """Compile a list of statements as one unit in 'exec' mode."""
+    root = ast.Module(nodes, type_ignores=[])
+    return (compile(root, filename, "exec"), "exec")
 
 
 def compile_single_node(node, filename):
@@ -105,9 +295,14 @@ def compile_single_node(node, filename):
     return (compile(root, filename, mode), mode)
 
 
-def find_nth(string, char, n):
-    """Find the n'th occurence of a character within a string."""
-    return [i for i, c in enumerate(string) if c == char][n - 1]
+def line_start(source, lineno):
+    """Return the index at which the line ``lineno`` (counting from 1) of
+    ``source`` starts. The search runs backwards from the end, since only the
+    last lines are of interest."""
+    start = len(source)
+    for _ in range(source.count("\n") - lineno + 2):
+        start = source.rfind("\n", 0, start)
+    return start + 1
 
 
 @contextlib.contextmanager
@@ -126,17 +321,19 @@ def disabled_excepthook():
 
 
 @contextlib.contextmanager
-def redirected_io(stdout):
+def redirected_io(stdout, stderr=None):
+    if stderr is None:
+        stderr = stdout
     old_stdout = sys.stdout
     old_stderr = sys.stderr
     sys.stdout = stdout
-    sys.stderr = stdout
+    sys.stderr = stderr
     try:
         yield
     finally:
         if sys.stdout is stdout:
             sys.stdout = old_stdout
-        if sys.stderr is stdout:
+        if sys.stderr is stderr:
             sys.stderr = old_stderr
 
 
@@ -0,0 +1,204 @@
+from array import array
+from bisect import bisect_right
+
+from .prompt import PromptDocument
+
+
+class LineStore:
+    """Append-only storage for the lines of a long console session.
+
+    The text is kept in an arena of large string chunks. Lines are only
+    represented by their start offsets in the arena, and formats by the
+    offsets where a run of text with a new format key starts, so that each
+    line costs a few bytes on top of its text. The prompts of the lines are
+    kept in a :class:`PromptDocument`.
+    """
+
+    # Chunks are extended up to this size before a new one is started:
+    chunk_size = 1 << 16
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._chunks = []
+        self._chunk_starts = array("q")
+        self._size = 0
+        self._line_starts = array("q", [0])
+        self._run_starts = array("q")
+        self._run_keys = array("l")
+        self._keys = []
+        self._key_ids = {}
+        self.prompts = PromptDocument()
+        # Length of the longest line, e.g. for horizontal scrolling:
+        self.max_length = 0
+
+    def __len__(self):
+        return len(self._line_starts)
+
+    def size(self):
+        """Offset of the end, i.e. the total number of characters that were
+        appended, including newlines."""
+        return self._size
+
+    def chunks(self):
+        """Return a snapshot of the text arena as lists of chunks and their
+        start offsets, which may be read from another thread."""
+        return list(self._chunks), list(self._chunk_starts)
+
+    def line_of(self, offset):
+        """Return the line containing the given offset, or -1 if that line
+        has been removed."""
+        return bisect_right(self._line_starts, offset) - 1
+
+    def _key_id(self, key):
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = self._key_ids[key] = len(self._keys)
+            self._keys.append(key)
+        return key_id
+
+    def append(self, text, key=None):
+        """Append text with the given format key. Each newline starts a new
+        line."""
+        self.prompts.add_lines(self._append(text, key))
+
+    def _append(self, text, key):
+        """Append text without updating the prompts, and return the number
+        of lines that were started."""
+        if not text:
+            return 0
+        key_id = self._key_id(key)
+        if not self._run_keys or self._run_keys[-1] != key_id:
+            self._run_starts.append(self._size)
+            self._run_keys.append(key_id)
+
+        start = self._size
+        if self._chunks and len(self._chunks[-1]) + len(text) <= self.chunk_size:
+            self._chunks[-1] += text
+        else:
+            self._chunks.append(text)
+            self._chunk_starts.append(start)
+        self._size += len(text)
+
+        num = len(self._line_starts)
+        line_start = self._line_starts[-1]
+        pos = text.find("\n")
+        while pos >= 0:
+            self.max_length = max(self.max_length, start + pos - line_start)
+            line_start = start + pos + 1
+            self._line_starts.append(line_start)
+            pos = text.find("\n", pos + 1)
+        self.max_length = max(self.max_length, self._size - line_start)
+        return len(self._line_starts) - num
+
+    def _truncate(self, size):
+        """Remove the text after offset ``size``, which must be in the last
+        line."""
+        self._size = size
+        while self._chunk_starts and self._chunk_starts[-1] >= size:
+            self._chunks.pop()
+            self._chunk_starts.pop()
+        if self._chunks:
+            self._chunks[-1] = self._chunks[-1][: size - self._chunk_starts[-1]]
+        while self._run_starts and self._run_starts[-1] >= size:
+            self._run_starts.pop()
+            self._run_keys.pop()
+
+    def remove_tail(self, num):
+        """Remove the last ``num`` characters of the last line."""
+        num = min(num, self._size - self._line_starts[-1])
+        if num <= 0:
+            return
+        self._truncate(self._size - num)
+
+    def replace_lines(self, line, num, text=""):
+        """Replace the ``num`` lines starting at ``line`` (which must not
+        include the last line) by ``text``, which must be empty or end with a
+        newline. Only the lines after them are moved, so that this is cheap
+        near the end."""
+        start = self._line_starts[line]
+        tail = self._runs(self._line_starts[line + num], self._size)
+        del self._line_starts[line + 1 :]
+        self._truncate(start)
+        added = self._append(text, None)
+        for key, run in tail:
+            self._append(run, key)
+        self.prompts.remove(line, num)
+        self.prompts.insert_lines(line, added)
+
+    def remove_last_line(self):
+        """Remove the last line and the newline before it."""
+        if len(self) < 2:
+            return
+        self.remove_tail(self._size - self._line_starts[-1])
+        self._line_starts.pop()
+        del self.prompts[len(self) :]
+        self.remove_tail(1)
+
+    def remove_lines(self, num):
+        """Remove the first ``num`` lines. Offsets stay valid for the
+        remaining lines."""
+        num = min(num, len(self) - 1)
+        if num <= 0:
+            return
+        start = self._line_starts[num]
+        del self._line_starts[:num]
+        i = bisect_right(self._chunk_starts, start) - 1
+        del self._chunks[:i]
+        del self._chunk_starts[:i]
+        i = bisect_right(self._run_starts, start) - 1
+        if i > 0:
+            del self._run_starts[:i]
+            del self._run_keys[:i]
+        del self.prompts[:num]
+
+    def text(self, start, stop):
+        """Return the text between the given offsets."""
+        stop = min(stop, self._size)
+        parts = []
+        i = bisect_right(self._chunk_starts, start) - 1
+        while start < stop:
+            chunk_start = self._chunk_starts[i]
+            chunk = self._chunks[i]
+            parts.append(chunk[start - chunk_start : stop - chunk_start])
+            start = chunk_start + len(chunk)
+            i += 1
+        return "".join(parts)
+
+    def line_range(self, line):
+        """Return the start and end offset of the given line, excluding the
+        newline."""
+        start = self._line_starts[line]
+        if line + 1 < len(self._line_starts):
+            return start, self._line_starts[line + 1] - 1
+        return start, self._size
+
+    def line(self, line):
+        """Return the text of the given line, without newline."""
+        return self.text(*self.line_range(line))
+
+    def line_runs(self, line):
+        """Return the text of the given line as list of ``(key, text)``
+        runs."""
+        return self._runs(*self.line_range(line))
+
+    def _runs(self, start, stop):
+        """Return the text between the given offsets as list of ``(key,
+        text)`` runs."""
+        text = self.text(start, stop)
+        runs = []
+        i = max(bisect_right(self._run_starts, start) - 1, 0)
+        pos = start
+        while pos < stop:
+            if i + 1 < len(self._run_starts):
+                end = min(self._run_starts[i + 1], stop)
+            else:
+                end = stop
+            if end > pos:
+                runs.append(
+                    (self._keys[self._run_keys[i]], text[pos - start : end - start])
+                )
+            pos = end
+            i += 1
+        return runs
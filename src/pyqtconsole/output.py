@@ -0,0 +1,479 @@
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from itertools import groupby
+
+from qtpy.QtCore import QObject, Qt, QTimer, Signal, Slot
+
+try:  # PyQt >= 5.11
+    QueuedConnection = Qt.ConnectionType.QueuedConnection
+except AttributeError:  # PyQt < 5.11
+    QueuedConnection = Qt.QueuedConnection
+
+
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+
+# Spilled text is stored as records of a channel index and the length of the
+# UTF-8 encoded text that follows:
+_RECORD = struct.Struct("<BI")
+_RECORD_CHARS = 1 << 16
+
+_thread_state = threading.local()
+
+
+def never_block():
+    """Never make writes of the calling thread wait for the GUI, even with
+    the ``"block"`` overflow policy. Their text is spilled instead. This is
+    for threads that the GUI thread may itself be waiting on, e.g. the
+    readers of captured file descriptors."""
+    _thread_state.never_block = True
+
+
+class OutputBuffer(QObject):
+    """Collects text written to the console streams and hands it over to a
+    sink at most once per ``interval`` milliseconds.
+
+    :meth:`write` may be called from any thread. The sink is always called
+    from the thread owning the buffer (normally the GUI thread), with a list
+    of ``(channel, text)`` tuples. Consecutive writes to the same channel are
+    joined, so that the list usually contains only one item per switch
+    between e.g. ``stdout`` and ``stderr``.
+
+    Optionally, the amount of text waiting to be flushed can be limited to
+    ``max_pending`` characters. What happens when a writer exceeds this
+    budget is decided by the ``overflow`` policy:
+
+    - ``"block"``: the writing thread waits until the GUI caught up. While
+      the GUI thread is busy (see ``owner_busy``), or for threads marked with
+      :func:`never_block`, the text is spilled instead
+    - ``"drop"``: the oldest lines are discarded and replaced by a marker
+    - ``"spill"``: the text is moved to a temporary file and fed to the GUI
+      in portions of at most ``max_pending`` characters
+    """
+
+    _wakeup = Signal()
+
+    def __init__(
+        self, sink, interval=16, max_pending=None, overflow="block", parent=None
+    ):
+        """
+        :param sink: Callable receiving a list of ``(channel, text)`` tuples
+        :type sink: callable
+        :param interval: Minimum time between two flushes in milliseconds
+                (Defaults to 16, i.e. roughly once per frame)
+        :type interval: int
+        :param max_pending: Maximum number of characters waiting to be
+                flushed (Defaults to None, i.e. unlimited)
+        :type max_pending: int, None
+        :param overflow: What to do when ``max_pending`` is exceeded, one of
+                ``"block"``, ``"drop"`` or ``"spill"`` (Defaults to "block")
+        :type overflow: str
+        :param parent: Parent object (Defaults to None)
+        :type parent: QObject, None
+        """
+        super().__init__(parent)
+        self.interval = interval
+        self.filters = {}
+        # Callable returning whether the owning thread is busy (e.g. running
+        # code) and can't flush, so that waiting for it would never end:
+        self.owner_busy = None
+        self._sink = sink
+        self._owner = threading.get_ident()
+        self._cond = threading.Condition()
+        self._chunks = deque()
+        self._size = 0
+        self._scheduled = False
+        self._closed = False
+        self._last_flush = 0.0
+        self._dropped_lines = 0
+        self._channels = [None]
+        self._spill = None
+        self._spill_read = 0
+        self._spill_write = 0
+        self.set_limit(max_pending, overflow)
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._flush_portion)
+        self._wakeup.connect(self._schedule, QueuedConnection)
+
+        self.reset_stats()
+
+    def set_limit(self, max_pending, overflow="block"):
+        """Limit the number of characters waiting to be flushed, see the
+        class documentation for the available ``overflow`` policies."""
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow must be one of {OVERFLOW_POLICIES}, not {overflow!r}"
+            )
+        with self._cond:
+            self.max_pending = max_pending
+            self.overflow = overflow
+            self._cond.notify_all()
+
+    def set_filter(self, channel, filter):
+        """Pass all text written to ``channel`` through ``filter`` (e.g. a
+        :class:`RateLimiter`), or remove the filter if None."""
+        if filter is None:
+            self.filters.pop(channel, None)
+        else:
+            self.filters[channel] = filter
+
+    def close(self):
+        """Stop enforcing the limit, e.g. to release writers blocked on a
+        console that is being shut down."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def write(self, data, channel=None):
+        """Queue ``data`` for the next flush. Thread-safe."""
+        filter = self.filters.get(channel)
+        if filter is not None:
+            data = filter.feed(data)
+        if not data:
+            return
+        flush_now = False
+        with self._cond:
+            self.writes += 1
+            if self._spill is not None:
+                self._spill_data(channel, data)
+            else:
+                self._chunks.append((channel, data))
+                self._size += len(data)
+                if self._over_limit():
+                    flush_now = self._handle_overflow()
+            wakeup = not self._scheduled
+            self._scheduled = True
+        if flush_now:
+            self.flush()
+        elif wakeup:
+            # Only the first write after a flush wakes up the GUI thread, all
+            # further writes piggyback on the already pending flush:
+            self._wakeup.emit()
+
+    def pending(self):
+        """Return whether there is text waiting to be flushed."""
+        with self._cond:
+            return bool(self._chunks) or self._spill is not None
+
+    def _over_limit(self):
+        return (
+            self.max_pending is not None
+            and self._size > self.max_pending
+            and not self._closed
+        )
+
+    def _handle_overflow(self):
+        # Must hold self._cond. Returns whether the caller should flush.
+        if self.overflow == "drop":
+            self._drop_oldest()
+        elif self.overflow == "spill":
+            self._spill_chunks()
+        elif threading.get_ident() == self._owner:
+            # Blocking the thread that flushes would deadlock, so we flush
+            # right away instead:
+            return True
+        elif self._may_block():
+            self._block()
+        else:
+            self._spill_chunks()
+        return False
+
+    def _may_block(self):
+        if getattr(_thread_state, "never_block", False):
+            return False
+        return self.owner_busy is None or not self.owner_busy()
+
+    def _block(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self._wakeup.emit()
+        while self._over_limit() and self._chunks:
+            if not self._may_block():
+                self._spill_chunks()
+                return
+            # Use a timeout, so that exceptions injected into the writing
+            # thread (e.g. KeyboardInterrupt) get a chance to be raised:
+            self._cond.wait(0.05)
+
+    def _spill_chunks(self):
+        # Must hold self._cond
+        for channel, data in self._chunks:
+            self._spill_data(channel, data)
+        self._chunks.clear()
+        self._size = 0
+
+    def _drop_oldest(self):
+        excess = self._size - self.max_pending
+        while excess > 0 and self._chunks:
+            channel, chunk = self._chunks[0]
+            if len(chunk) <= excess:
+                self._chunks.popleft()
+                self._size -= len(chunk)
+                excess -= len(chunk)
+                self._dropped_lines += chunk.count("\n")
+                continue
+            # Keep the remainder of this chunk, starting at a line boundary:
+            cut = chunk.find("\n", excess - 1) + 1
+            if cut <= 0:
+                cut = len(chunk)
+            self._dropped_lines += chunk.count("\n", 0, cut)
+            self._chunks[0] = (channel, chunk[cut:])
+            self._size -= cut
+            excess -= cut
+            if not self._chunks[0][1]:
+                self._chunks.popleft()
+        self._dropped_lines = max(self._dropped_lines, 1)
+
+    def _spill_data(self, channel, data):
+        # Must hold self._cond
+        if self._spill is None:
+            # closed in _read_spill() once everything has been read back:
+            self._spill = tempfile.TemporaryFile()  # noqa: SIM115
+            self._spill_read = self._spill_write = 0
+        if channel not in self._channels:
+            self._channels.append(channel)
+        index = self._channels.index(channel)
+        self._spill.seek(self._spill_write)
+        for start in range(0, len(data), _RECORD_CHARS):
+            text = data[start : start + _RECORD_CHARS]
+            text = text.encode("utf-8", "surrogatepass")
+            self._spill.write(_RECORD.pack(index, len(text)))
+            self._spill.write(text)
+            self._spill_write += _RECORD.size + len(text)
+
+    def _read_spill(self, size):
+        # Must hold self._cond
+        chunks = []
+        self._spill.seek(self._spill_read)
+        while size > 0 and self._spill_read < self._spill_write:
+            index, length = _RECORD.unpack(self._spill.read(_RECORD.size))
+            text = self._spill.read(length).decode("utf-8", "surrogatepass")
+            self._spill_read += _RECORD.size + length
+            chunks.append((self._channels[index], text))
+            size -= len(text)
+        if self._spill_read >= self._spill_write:
+            self._spill.close()
+            self._spill = None
+        return chunks
+
+    def _take(self, limit):
+        # Must hold self._cond
+        chunks = []
+        if self._dropped_lines:
+            chunks.append((None, f"[{self._dropped_lines} lines suppressed]\n"))
+            self._dropped_lines = 0
+        if self._spill is not None:
+            chunks += self._read_spill(limit or self.max_pending or 1 << 20)
+            if self._spill is not None:
+                return chunks
+        chunks.extend(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        self._cond.notify_all()
+        return chunks
+
+    def _release_filters(self, final):
+        for channel, filter in list(self.filters.items()):
+            data = filter.finish() if final else filter.release()
+            if data:
+                with self._cond:
+                    self._chunks.append((channel, data))
+                    self._size += len(data)
+
+    @Slot()
+    def _schedule(self):
+        if self._timer.isActive():
+            return
+        elapsed = (time.monotonic() - self._last_flush) * 1000
+        self._timer.start(int(max(0, self.interval - elapsed)))
+
+    @Slot()
+    def _flush_portion(self):
+        self._release_filters(False)
+        self._flush(self.max_pending)
+
+    @Slot()
+    def flush(self):
+        """Pass all pending text to the sink. Must be called from the thread
+        owning the buffer."""
+        self._release_filters(False)
+        self._flush(None)
+
+    def finish(self):
+        """Flush, including any text held back by the filters (e.g. a
+        summary of repeated lines). Call this when a command has finished.
+        Must be called from the thread owning the buffer."""
+        self._release_filters(True)
+        self._flush(None)
+
+    def _flush(self, limit):
+        while True:
+            with self._cond:
+                chunks = self._take(limit)
+                more = self._spill is not None
+                self._scheduled = more
+            if chunks:
+                runs = [
+                    (channel, "".join(text for _, text in group))
+                    for channel, group in groupby(chunks, key=lambda c: c[0])
+                ]
+                start = time.perf_counter()
+                self._sink(runs)
+                self.flush_time += time.perf_counter() - start
+                self._last_flush = time.monotonic()
+                self.flushes += 1
+                self.chars += sum(len(text) for _, text in runs)
+            if not more:
+                return
+            if limit is not None:
+                # Feed the rest of the spilled data in the next frames:
+                self._timer.start(self.interval)
+                return
+
+    def reset_stats(self):
+        """Reset the throughput counters."""
+        self.writes = 0
+        self.flushes = 0
+        self.chars = 0
+        self.flush_time = 0.0
+
+    def stats(self):
+        """Return the throughput counters as a dictionary.
+
+        ``writes`` is the number of :meth:`write` calls, ``flushes`` the
+        number of times the sink was called, ``chars`` the number of
+        characters passed to the sink and ``flush_time`` the total time spent
+        in the sink (in seconds).
+        """
+        return {
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "chars": self.chars,
+            "flush_time": self.flush_time,
+            "writes_per_flush": self.writes / self.flushes if self.flushes else 0.0,
+            "chars_per_second": (
+                self.chars / self.flush_time if self.flush_time else 0.0
+            ),
+        }
+
+
+class RateLimiter:
+    """Output filter that collapses repeated identical lines and limits the
+    number of lines passed through per time period.
+
+    Use it with :meth:`OutputBuffer.set_filter`. Lines are held back until
+    they are complete (or until the next flush of the output buffer), and
+    summaries of collapsed or suppressed lines are emitted once a different
+    line arrives, a new period starts or the command finished. The last
+    ``tail`` suppressed lines are shown after the summary, so that the end of
+    a burst (e.g. the error message of a traceback) is never lost.
+    """
+
+    def __init__(self, max_lines=50, period=1.0, tail=10, clock=time.monotonic):
+        """
+        :param max_lines: Maximum number of lines per period (Defaults to 50)
+        :type max_lines: int
+        :param period: Length of a period in seconds (Defaults to 1)
+        :type period: float
+        :param tail: Number of suppressed lines shown at the end of a burst
+                (Defaults to 10)
+        :type tail: int
+        """
+        self.max_lines = max_lines
+        self.period = period
+        self.tail = tail
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._partial = []
+        self._reset()
+
+    def _reset(self):
+        self._last = None
+        self._last_shown = False
+        self._repeats = 0
+        self._suppressed = 0
+        self._suppressed_tail = deque(maxlen=self.tail)
+        self._window_start = None
+        self._window_count = 0
+
+    def feed(self, data):
+        """Return the part of ``data`` that should be displayed now."""
+        with self._lock:
+            self._partial.append(data)
+            if "\n" not in data:
+                # progress bars use carriage returns, don't hold them back:
+                return self._release_partial() if "\r" in data else ""
+            lines = "".join(self._partial).split("\n")
+            rest = lines.pop()
+            self._partial = [rest] if rest else []
+            return "".join([self._feed_line(line) for line in lines])
+
+    def _feed_line(self, line):
+        if line == self._last:
+            if self._last_shown:
+                self._repeats += 1
+            else:
+                self._suppress(line)
+            return ""
+        output = self._repeat_summary()
+        self._last = line
+
+        now = self._clock()
+        if self._window_start is None or now - self._window_start >= self.period:
+            output += self._suppressed_summary()
+            self._window_start = now
+            self._window_count = 0
+
+        self._last_shown = self._window_count < self.max_lines
+        if not self._last_shown:
+            self._suppress(line)
+            return output
+        self._window_count += 1
+        return output + line + "\n"
+
+    def _repeat_summary(self):
+        repeats, self._repeats = self._repeats, 0
+        if repeats:
+            return f"[previous line repeated {repeats} more times]\n"
+        return ""
+
+    def _suppress(self, line):
+        self._suppressed += 1
+        if self.tail > 0:
+            self._suppressed_tail.append(line + "\n")
+
+    def _suppressed_summary(self):
+        suppressed, self._suppressed = self._suppressed, 0
+        tail = "".join(self._suppressed_tail)
+        suppressed -= len(self._suppressed_tail)
+        self._suppressed_tail.clear()
+        if suppressed:
+            return f"[{suppressed} lines suppressed]\n" + tail
+        return tail
+
+    def _release_partial(self):
+        data = "".join(self._partial)
+        self._partial = []
+        if not data:
+            return ""
+        # The rest of this line will not be compared to the last line:
+        self._last = None
+        return self._repeat_summary() + data
+
+    def release(self):
+        """Return text held back only because its line is not yet complete."""
+        with self._lock:
+            return self._release_partial()
+
+    def finish(self):
+        """Return all text and summaries held back, and start over."""
+        with self._lock:
+            # The incomplete last line came after the summarized lines:
+            summary = self._repeat_summary() + self._suppressed_summary()
+            data = summary + self._release_partial()
+            self._reset()
+            return data
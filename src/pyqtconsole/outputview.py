@@ -0,0 +1,205 @@
+from qtpy.QtCore import QRect, Qt
+from qtpy.QtGui import QKeySequence, QPainter
+from qtpy.QtWidgets import QAbstractScrollArea, QApplication, QFrame
+
+
+class OutputView(QAbstractScrollArea):
+    """Displays the lines of a :class:`~pyqtconsole.linestore.LineStore`.
+
+    Unlike a QPlainTextEdit, nothing is laid out in advance: every paint only
+    looks at the lines that are currently visible. This keeps the cost of
+    adding, scrolling and displaying output independent of the number of
+    lines. Lines are not wrapped and can be selected (line-wise) and copied.
+    """
+
+    def __init__(self, store, get_format, prompt_area, parent=None):
+        """
+        :param store: The lines to display
+        :type store: LineStore
+        :param get_format: Function returning the QTextCharFormat for a
+                format key of the store
+        :type get_format: callable
+        :param prompt_area: The prompt area of the input, which is used to
+                draw the prompts with the same width and appearance
+        :type prompt_area: PromptArea
+        """
+        super().__init__(parent)
+        self.store = store
+        self.get_format = get_format
+        self.prompt_area = prompt_area
+        self.setFrameStyle(QFrame.NoFrame)
+        self.setFocusPolicy(Qt.ClickFocus)
+        self.viewport().setCursor(Qt.IBeamCursor)
+        self._selection = None
+        self._fonts = {}
+        # Space between the prompts and the text, like the document margin
+        # of the input area:
+        self.text_margin = 4
+
+    def line_height(self):
+        return self.fontMetrics().height()
+
+    def line_count(self):
+        """Return the number of displayed lines. The last line of the store
+        is not displayed while it is empty, as it would be followed by the
+        input."""
+        count = len(self.store)
+        if count > 1 and self.store.line_range(count - 1)[0] == self.store.size():
+            count -= 1
+        return count
+
+    def _layout(self):
+        """Return the first visible line and its vertical position. At the
+        end, the last line is aligned to the bottom."""
+        height = self.line_height()
+        vbar = self.verticalScrollBar()
+        first = vbar.value()
+        if first < vbar.maximum() or first == 0:
+            return first, 0
+        count = self.line_count()
+        first = max(count - self.viewport().height() // height - 1, 0)
+        return first, min(self.viewport().height() - (count - first) * height, 0)
+
+    def update_contents(self):
+        """Update the scroll ranges after the store has changed. If the view
+        was scrolled to the end, it follows the new lines."""
+        vbar = self.verticalScrollBar()
+        at_end = vbar.value() >= vbar.maximum()
+        page = max(self.viewport().height() // self.line_height(), 1)
+        vbar.setRange(0, max(self.line_count() - page, 0))
+        vbar.setPageStep(page)
+        if at_end:
+            vbar.setValue(vbar.maximum())
+
+        hbar = self.horizontalScrollBar()
+        width = self.viewport().width()
+        content = (
+            self.prompt_area.width()
+            + self.store.max_length * self.fontMetrics().width("M")
+        )
+        hbar.setRange(0, max(content - width, 0))
+        hbar.setPageStep(width)
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_contents()
+
+    def changeEvent(self, event):
+        self._fonts = {}
+        super().changeEvent(event)
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def _font(self, fmt):
+        key = (fmt.fontWeight(), fmt.fontItalic(), fmt.fontUnderline())
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._fonts[key] = self.font()
+            font.setWeight(fmt.fontWeight())
+            font.setItalic(fmt.fontItalic())
+            font.setUnderline(fmt.fontUnderline())
+        return font
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        palette = self.palette()
+        painter.fillRect(event.rect(), palette.base())
+        metrics = self.fontMetrics()
+        height = metrics.height()
+        ascent = metrics.ascent()
+        gutter = self.prompt_area.width()
+        width = self.viewport().width()
+        self.prompt_area.validate_cache()
+        first, y = self._layout()
+        last = min(self.line_count(), first + self.viewport().height() // height + 2)
+        offset = gutter + self.text_margin - self.horizontalScrollBar().value()
+        selection = self.selected_lines()
+
+        for line in range(first, last):
+            top = y + (line - first) * height
+            selected = selection is not None and selection[0] <= line <= selection[1]
+            if selected:
+                painter.fillRect(QRect(0, top, width, height), palette.highlight())
+            x = offset
+            for key, text in self.store.line_runs(line):
+                fmt = self.get_format(key)
+                text = text.expandtabs(8)
+                text_width = metrics.width(text)
+                if fmt.background().style() != Qt.NoBrush and not selected:
+                    painter.fillRect(
+                        QRect(x, top, text_width, height), fmt.background()
+                    )
+                if selected:
+                    color = palette.highlightedText().color()
+                elif fmt.foreground().style() != Qt.NoBrush:
+                    color = fmt.foreground().color()
+                else:
+                    color = palette.text().color()
+                painter.setPen(color)
+                painter.setFont(self._font(fmt))
+                painter.drawText(x, top + ascent, text)
+                x += text_width
+                if x > width:
+                    break
+            # the prompts are not scrolled horizontally:
+            rect = QRect(0, top, gutter, height)
+            painter.fillRect(rect, palette.highlight() if selected else palette.base())
+            self.prompt_area.draw_prompt(painter, rect, self.store.prompts[line])
+        painter.end()
+
+    def line_at(self, pos):
+        """Return the number of the line displayed at the given position."""
+        first, y = self._layout()
+        line = first + (pos.y() - y) // self.line_height()
+        return min(max(line, 0), self.line_count() - 1)
+
+    def selected_lines(self):
+        """Return the first and last selected line, or None."""
+        if self._selection is None:
+            return None
+        return min(self._selection), max(self._selection)
+
+    def selected_text(self):
+        selection = self.selected_lines()
+        if selection is None:
+            return ""
+        first, last = selection
+        return "".join(self.store.line(i) + "\n" for i in range(first, last + 1))
+
+    def show_line(self, line):
+        """Select the given line and scroll it into view."""
+        self._selection = [line, line]
+        vbar = self.verticalScrollBar()
+        page = vbar.pageStep()
+        if not vbar.value() <= line < vbar.value() + page:
+            vbar.setValue(line - page // 2)
+        self.viewport().update()
+
+    def copy(self):
+        text = self.selected_text()
+        if text:
+            QApplication.clipboard().setText(text)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            line = self.line_at(event.pos())
+            self._selection = [line, line]
+            self.viewport().update()
+        super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton and self._selection is not None:
+            self._selection[1] = self.line_at(event.pos())
+            self.viewport().update()
+        super().mouseMoveEvent(event)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Copy):
+            self.copy()
+        elif event.key() == Qt.Key_Escape:
+            self._selection = None
+            self.viewport().update()
+        else:
+            super().keyPressEvent(event)
@@ -1,10 +1,21 @@
-from qtpy.QtCore import QRect, Qt
-from qtpy.QtGui import QPainter
+from array import array
+from bisect import bisect_left
+
+from qtpy.QtCore import QEvent, QRect, Qt
+from qtpy.QtGui import QPainter, QPixmap
 from qtpy.QtWidgets import QWidget
 
 
 class PromptArea(QWidget):
-    """Widget that displays the prompts on the left of the input area."""
+    """Widget that displays the prompts on the left of the input area.
+
+    Each distinct prompt is rendered only once into a pixmap, which is then
+    reused for every line and repaint showing the same prompt, until the font,
+    width or default color change.
+    """
+
+    # Maximum number of prompts whose pixmap and width are cached:
+    cache_size = 256
 
     def __init__(self, edit, get_text, highlighter):
         super().__init__(edit)
@@ -12,13 +23,45 @@ class PromptArea(QWidget):
         self.edit = edit
         self.get_text = get_text
         self.highlighter = highlighter
+        self._cache = {}
+        self._cache_key = None
+        self._widths = {}
         edit.updateRequest.connect(self.updateContents)
 
+    def invalidate_cache(self):
+        """Discard the rendered prompts, e.g. after changing the formats of
+        the highlighter."""
+        self._cache = {}
+        self._cache_key = None
+        self._widths = {}
+        self.update()
+
+    def changeEvent(self, event):
+        if event.type() in (QEvent.FontChange, QEvent.PaletteChange):
+            self.invalidate_cache()
+        super().changeEvent(event)
+
+    def validate_cache(self):
+        """Discard the rendered prompts if they no longer match the current
+        font, width or default color. Must be called before painting."""
+        edit = self.edit
+        cache_key = (
+            edit.font().key(),
+            self.width(),
+            edit.fontMetrics().height(),
+            self.devicePixelRatioF(),
+            edit.currentCharFormat().foreground().color().rgba(),
+        )
+        if cache_key != self._cache_key:
+            self._cache = {}
+            self._cache_key = cache_key
+
     def paintEvent(self, event):
         edit = self.edit
         height = edit.fontMetrics().height()
         block = edit.firstVisibleBlock()
         count = block.blockNumber()
+        self.validate_cache()
         painter = QPainter(self)
         painter.fillRect(event.rect(), edit.palette().base())
         first = True
@@ -43,35 +86,182 @@ class PromptArea(QWidget):
             self.update()
 
     def adjust_width(self, new_text):
-        width = calc_text_width(self.edit, new_text)
+        if not new_text:
+            return
+        width = self._widths.get(new_text)
+        if width is None:
+            if len(self._widths) >= self.cache_size:
+                self._widths = {}
+            width = self._widths[new_text] = calc_text_width(self.edit, new_text)
         if width > self.width():
             self.setFixedWidth(width)
 
     def draw_block(self, painter, rect, block, first):
         """Draw the info corresponding to a given block (text line) of the text
         document."""
-        pen = painter.pen()
-        text = self.get_text(block.blockNumber())
+        self.draw_prompt(painter, rect, self.get_text(block.blockNumber()))
+
+    def draw_prompt(self, painter, rect, text):
+        """Draw the given prompt right-aligned into ``rect``, which must have
+        the width of the prompt area and the line height."""
+        if not text:
+            return
+        pixmap = self._cache.get(text)
+        if pixmap is None:
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+            pixmap = self._cache[text] = self.render_prompt(text, rect.size())
+        painter.drawPixmap(rect.topLeft(), pixmap)
+
+    def render_prompt(self, text, size):
+        """Render the highlighted prompt ``text`` right-aligned into a
+        transparent pixmap of the given size."""
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(size * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
 
         default = self.edit.currentCharFormat()
         formats = [default] * len(text)
-        painter.setFont(self.edit.font())
-
         for index, length, format in self.highlighter.highlight(text):
             formats[index : index + length] = [format] * length
 
-        for idx, (_char, format) in enumerate(zip(text, formats)):
-            rpos = len(text) - idx - 1
-            pen.setColor(format.foreground().color())
+        painter = QPainter(pixmap)
+        painter.setFont(self.edit.font())
+        pen = painter.pen()
+        rect = QRect(0, 0, size.width(), size.height())
+        # Draw runs of equal format, padded with spaces to keep the alignment
+        # (the font is monospace):
+        start = 0
+        for end in range(1, len(text) + 1):
+            if end < len(text) and formats[end] is formats[start]:
+                continue
+            pen.setColor(formats[start].foreground().color())
             painter.setPen(pen)
-            painter.drawText(rect, Qt.AlignRight, text[idx] + " " * rpos)
+            painter.drawText(
+                rect, Qt.AlignRight, text[start:end] + " " * (len(text) - end)
+            )
+            start = end
+        painter.end()
+        return pixmap
 
 
 def calc_text_width(widget, text):
     """Estimate the width that the given text would take within the widget."""
+    metrics = widget.fontMetrics()
     return (
-        widget.fontMetrics().width(text)
-        + widget.fontMetrics().width("M")
+        metrics.width(text)
+        + metrics.width("M")
         + widget.contentsMargins().left()
         + widget.contentsMargins().right()
     )
+
+
+class PromptDocument:
+    """The prompt texts of all lines (blocks) of the console document.
+
+    Most lines are output and have no prompt, so only the lines that do have
+    one are stored: a sorted array of their line numbers, and for each an
+    index into a table of distinct prompt strings. Appending any number of
+    lines without prompt is O(1), looking up a line is O(log n).
+    """
+
+    def __init__(self):
+        self._count = 1
+        # Removing lines from the start only increases the offset, instead
+        # of renumbering all stored lines:
+        self._offset = 0
+        self._lines = array("q")
+        self._ids = array("l")
+        self._table = []
+        self._table_index = {}
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, line):
+        if line < 0:
+            line += self._count
+        if not 0 <= line < self._count:
+            raise IndexError("line number out of range")
+        line += self._offset
+        i = bisect_left(self._lines, line)
+        if i < len(self._lines) and self._lines[i] == line:
+            return self._table[self._ids[i]]
+        return ""
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("only contiguous slices of lines can be deleted")
+        start, stop, _ = key.indices(self._count)
+        if stop > start:
+            self.remove(start, stop - start)
+
+    def _intern(self, text):
+        index = self._table_index.get(text)
+        if index is None:
+            index = self._table_index[text] = len(self._table)
+            self._table.append(text)
+        return index
+
+    def _set_last(self, text):
+        line = self._offset + self._count - 1
+        if self._lines and self._lines[-1] == line:
+            self._ids[-1] = self._intern(text)
+        else:
+            self._lines.append(line)
+            self._ids.append(self._intern(text))
+
+    def distinct(self):
+        """Return the distinct prompt strings, e.g. to find the longest.
+        This may include prompts of lines that were removed."""
+        return list(self._table)
+
+    def add_lines(self, num):
+        """Append ``num`` lines without prompt."""
+        self._count += num
+
+    def append(self, text):
+        """Append ``text`` to the prompts, where each newline starts a new
+        line, and the text before the first newline extends the prompt of the
+        last line. Returns the list of non-empty prompts that were changed or
+        added."""
+        head, sep, tail = text.partition("\n")
+        changed = []
+        if head:
+            changed.append(self[-1] + head)
+            self._set_last(changed[-1])
+        if not sep:
+            return changed
+        if not tail.strip("\n"):
+            self.add_lines(len(tail) + 1)
+            return changed
+        for line in tail.split("\n"):
+            self._count += 1
+            if line:
+                self._set_last(line)
+                changed.append(line)
+        return changed
+
+    def insert_lines(self, line, num):
+        """Insert ``num`` lines without prompt before line ``line``."""
+        first = bisect_left(self._lines, self._offset + line)
+        for i in range(first, len(self._lines)):
+            self._lines[i] += num
+        self._count += num
+
+    def remove(self, start, num):
+        """Remove ``num`` lines starting at line ``start``."""
+        num = min(num, self._count - start)
+        if num <= 0:
+            return
+        first = bisect_left(self._lines, self._offset + start)
+        last = bisect_left(self._lines, self._offset + start + num)
+        del self._lines[first:last]
+        del self._ids[first:last]
+        self._count -= num
+        if start == 0:
+            self._offset += num
+        else:
+            for i in range(first, len(self._lines)):
+                self._lines[i] -= num
@@ -0,0 +1,244 @@
+import re
+import threading
+import time
+
+from qtpy.QtCore import QEvent, QObject, Qt, QTimer, Signal
+from qtpy.QtWidgets import (
+    QCheckBox,
+    QFrame,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QToolButton,
+)
+
+try:  # PyQt >= 5.11
+    QueuedConnection = Qt.ConnectionType.QueuedConnection
+except AttributeError:  # PyQt < 5.11
+    QueuedConnection = Qt.QueuedConnection
+
+
+def split_chunks(chunks, starts):
+    """Join the chunks of a :class:`LineStore` into pieces that end at line
+    ends, so that no line is split between two pieces. Yields the start
+    offset and text of each piece."""
+    carry = ""
+    carry_start = starts[0] if starts else 0
+    for chunk, start in zip(chunks, starts):
+        end = chunk.rfind("\n") + 1
+        if end == 0:
+            carry += chunk
+            continue
+        yield carry_start, carry + chunk[:end]
+        carry = chunk[end:]
+        carry_start = start + end
+    if carry:
+        yield carry_start, carry
+
+
+class Searcher(QObject):
+    """Searches the text of a :class:`LineStore` in a background thread.
+
+    The thread works on a snapshot of the chunks of the store, so that
+    output can be appended meanwhile. The matches are reported as lists of
+    ``(start, end)`` offsets in the store, in batches at most every
+    ``interval`` seconds. Each search has a generation number, so that
+    results of a search that was replaced by a new one can be ignored.
+    """
+
+    found = Signal(int, object)
+    finished = Signal(int)
+
+    interval = 0.05
+    max_matches = 100_000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._cancel = threading.Event()
+
+    def start(self, store, regex):
+        """Start searching for the compiled regular expression.
+
+        :param store: The text to search
+        :type store: LineStore
+        :param regex: The pattern to search for
+        :type regex: re.Pattern
+        """
+        self.cancel()
+        self.generation += 1
+        self._cancel = threading.Event()
+        chunks, starts = store.chunks()
+        thread = threading.Thread(
+            target=self._run,
+            args=(self.generation, chunks, starts, regex, self._cancel),
+            daemon=True,
+        )
+        thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self, generation, chunks, starts, regex, cancel):
+        matches = []
+        count = 0
+        emitted = time.monotonic()
+        for start, text in split_chunks(chunks, starts):
+            if cancel.is_set():
+                return
+            for match in regex.finditer(text):
+                if match.end() > match.start():
+                    matches.append((start + match.start(), start + match.end()))
+            if count + len(matches) >= self.max_matches:
+                del matches[self.max_matches - count :]
+                break
+            if matches and time.monotonic() - emitted > self.interval:
+                self.found.emit(generation, matches)
+                count += len(matches)
+                matches = []
+                emitted = time.monotonic()
+        if not cancel.is_set():
+            if matches:
+                self.found.emit(generation, matches)
+            self.finished.emit(generation)
+
+
+class FindBar(QFrame):
+    """Bar for searching the text of a console, shown with Ctrl+F.
+
+    The search is restarted whenever the text or the options change. Matches
+    are shown with :meth:`BaseConsole.show_match` as they arrive, starting
+    with the first one. Enter and Shift+Enter move to the next and previous
+    match, Escape closes the bar.
+    """
+
+    def __init__(self, console):
+        """
+        :param console: The console to search
+        :type console: BaseConsole
+        """
+        super().__init__(console)
+        self.console = console
+        self.matches = []
+        self.current = -1
+        self._done = False
+        self.searcher = Searcher(self)
+        self.searcher.found.connect(self._add_matches, QueuedConnection)
+        self.searcher.finished.connect(self._search_finished, QueuedConnection)
+
+        self.edit = QLineEdit()
+        self.edit.setPlaceholderText("Find")
+        self.edit.installEventFilter(self)
+        self.regex = QCheckBox("Regex")
+        self.case = QCheckBox("Match case")
+        self.status = QLabel()
+        previous = QToolButton()
+        previous.setText("Previous")
+        previous.clicked.connect(self.find_previous)
+        next_ = QToolButton()
+        next_.setText("Next")
+        next_.clicked.connect(self.find_next)
+        close = QToolButton()
+        close.setText("Close")
+        close.clicked.connect(self.dismiss)
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(2, 2, 2, 2)
+        for widget in (self.edit, self.regex, self.case, previous, next_):
+            layout.addWidget(widget)
+        layout.addWidget(self.status, 1)
+        layout.addWidget(close)
+        self.setLayout(layout)
+
+        # Wait for a pause in typing before starting a new search:
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(150)
+        self._timer.timeout.connect(self.search)
+        self.edit.textChanged.connect(self._timer.start)
+        self.regex.toggled.connect(self._timer.start)
+        self.case.toggled.connect(self._timer.start)
+        self.hide()
+
+    def open(self):
+        """Show the bar and focus the search text."""
+        self.show()
+        self.edit.setFocus()
+        self.edit.selectAll()
+        self.search()
+
+    def dismiss(self):
+        """Hide the bar and return the focus to the console."""
+        self.searcher.cancel()
+        self.hide()
+        self.console.edit.setFocus()
+
+    def eventFilter(self, edit, event):
+        if event.type() == QEvent.KeyPress:
+            if event.key() in (Qt.Key_Return, Qt.Key_Enter):
+                if event.modifiers() & Qt.ShiftModifier:
+                    self.find_previous()
+                else:
+                    self.find_next()
+                return True
+            if event.key() == Qt.Key_Escape:
+                self.dismiss()
+                return True
+        return False
+
+    def search(self):
+        """Start a new search for the current text."""
+        self._timer.stop()
+        self.searcher.cancel()
+        self.matches = []
+        self.current = -1
+        self._done = False
+        text = self.edit.text()
+        if not text:
+            self.status.setText("")
+            return
+        flags = re.MULTILINE
+        if not self.case.isChecked():
+            flags |= re.IGNORECASE
+        if not self.regex.isChecked():
+            text = re.escape(text)
+        try:
+            regex = re.compile(text, flags)
+        except re.error as e:
+            self.status.setText(f"Invalid pattern: {e}")
+            return
+        self.status.setText("Searching...")
+        self.searcher.start(self.console.search_index, regex)
+
+    def _add_matches(self, generation, matches):
+        if generation != self.searcher.generation:
+            return
+        self.matches.extend(matches)
+        if self.current < 0:
+            self.find_next()
+        self._update_status()
+
+    def _search_finished(self, generation):
+        if generation == self.searcher.generation:
+            self._done = True
+            self._update_status()
+
+    def _update_status(self):
+        if not self.matches:
+            self.status.setText("No matches" if self._done else "Searching...")
+        else:
+            more = "" if self._done else "+"
+            self.status.setText(f"{self.current + 1} of {len(self.matches)}{more}")
+
+    def find_next(self):
+        self._show(self.current + 1)
+
+    def find_previous(self):
+        self._show(self.current - 1)
+
+    def _show(self, index):
+        if not self.matches:
+            return
+        self.current = index % len(self.matches)
+        self.console.show_match(*self.matches[self.current])
+        self._update_status()
@@ -1,4 +1,7 @@
-from threading import Condition
+import codecs
+import io
+from collections import deque
+from threading import Condition, Lock
 
 from qtpy.QtCore import QObject, Signal
 
@@ -8,14 +11,39 @@ class Stream(QObject):
     flush_event = Signal(str)
     close_event = Signal()
 
-    def __init__(self):
+    encoding = "utf-8"
+    errors = "replace"
+
+    def __init__(self, readable=True, writer=None):
+        """
+        :param readable: Whether written data is kept for reading (Defaults
+                to True). Output streams that are only observed through
+                ``write_event`` or ``writer`` should pass False, so that they
+                don't accumulate everything that was ever written.
+        :type readable: bool
+        :param writer: Callable receiving the written data in the writing
+                thread, e.g. :meth:`OutputBuffer.write`. Unlike a slot of
+                ``write_event``, its exceptions (e.g. a KeyboardInterrupt
+                injected while it waits) are raised in the writing code.
+        :type writer: callable, None
+        """
         super().__init__()
+        self.writer = writer
+        # Binary interface, like ``sys.stdout.buffer``:
+        self.buffer = StreamBuffer(self)
+        self._readable = readable
         self._line_cond = Condition()
-        self._buffer = ""
+        # Complete lines (including their trailing newline) waiting to be
+        # read, and the chunks of the last, not yet terminated line. This
+        # keeps write() and readline() linear in the size of the data:
+        self._lines = deque()
+        self._partial = []
+        self._closed = False
 
     def _reset_buffer(self):
-        data = self._buffer
-        self._buffer = ""
+        data = "".join(self._lines) + "".join(self._partial)
+        self._lines.clear()
+        self._partial = []
         return data
 
     def _flush(self):
@@ -25,33 +53,42 @@ class Stream(QObject):
 
         return data
 
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return True
+
+    def _check_readable(self):
+        if not self._readable:
+            raise io.UnsupportedOperation("not readable")
+
+    def _wait(self, ready, timeout):
+        # Block until ``ready()`` or a timeout, must hold self._line_cond:
+        while not ready() and not self._closed:
+            notified = self._line_cond.wait(timeout)
+
+            # We had a timeout, break !
+            if not notified:
+                break
+
     def readline(self, timeout=None):
+        self._check_readable()
         data = ""
 
         try:
             with self._line_cond:
-                first_linesep = self._buffer.find("\n")
-
                 # Is there already some lines in the buffer, write might have
                 # been called before we read !
-                while first_linesep == -1:
-                    notfied = self._line_cond.wait(timeout)
-                    first_linesep = self._buffer.find("\n")
-
-                    # We had a timeout, break !
-                    if not notfied:
-                        break
+                self._wait(lambda: self._lines, timeout)
 
                 # Check if there really is something in the buffer after
                 # waiting for line_cond. There might have been a timeout, and
                 # there is still no data available
-                if first_linesep > -1:
-                    data = self._buffer[0 : first_linesep + 1]
-
-                    if len(self._buffer) > len(data):
-                        self._buffer = self._buffer[first_linesep + 1 :]
-                    else:
-                        self._buffer = ""
+                if self._lines:
+                    data = self._lines.popleft()
+                elif self._closed:
+                    data = self._reset_buffer()
 
         # Tricky RuntimeError !, wait releases the lock and waits for notify
         # and then acquire the lock again !. There might be an exception, i.e
@@ -63,14 +100,78 @@ class Stream(QObject):
 
         return data
 
-    def write(self, data):
+    def readlines(self, hint=-1):
+        """Return the complete lines that are currently available, without
+        waiting for more. Stop once the total size exceeds ``hint``."""
+        self._check_readable()
+        lines = []
+        size = 0
+        with self._line_cond:
+            while self._lines and (hint <= 0 or size < hint):
+                line = self._lines.popleft()
+                lines.append(line)
+                size += len(line)
+        return lines
+
+    def read(self, size=-1, timeout=None):
+        """Wait until data is available (or a timeout occurs) and return at
+        most ``size`` characters of it, or everything if ``size`` is
+        negative."""
+        self._check_readable()
         with self._line_cond:
-            self._buffer += data
+            self._wait(lambda: self._lines or self._partial, timeout)
+
+            if size < 0:
+                return self._reset_buffer()
+
+            chunks = []
+            while size > 0 and self._lines:
+                line = self._lines[0]
+                if len(line) > size:
+                    chunks.append(line[:size])
+                    self._lines[0] = line[size:]
+                    size = 0
+                else:
+                    chunks.append(self._lines.popleft())
+                    size -= len(line)
+
+            if size > 0 and self._partial:
+                partial = "".join(self._partial)
+                chunks.append(partial[:size])
+                self._partial = [partial[size:]] if len(partial) > size else []
+
+            return "".join(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def _append(self, data):
+        # Must hold self._line_cond
+        if "\n" in data:
+            lines = data.split("\n")
+            self._partial.append(lines[0])
+            self._lines.append("".join(self._partial) + "\n")
+            self._lines.extend([line + "\n" for line in lines[1:-1]])
+            self._partial = [lines[-1]] if lines[-1] else []
+        elif data:
+            self._partial.append(data)
 
-            if "\n" in self._buffer:
+    def write(self, data):
+        with self._line_cond:
+            if self._readable:
+                self._append(data)
                 self._line_cond.notify()
 
-            self.write_event.emit(data)
+        if self.writer is not None:
+            self.writer(data)
+        self.write_event.emit(data)
+        return len(data)
 
     def flush(self):
         data = self._flush()
@@ -78,4 +179,52 @@ class Stream(QObject):
         return data
 
     def close(self):
+        with self._line_cond:
+            self._closed = True
+            self._line_cond.notify_all()
         self.close_event.emit()
+
+
+class StreamBuffer:
+    """Binary interface of a :class:`Stream`, available as ``stream.buffer``.
+
+    Written bytes are decoded incrementally, so multibyte sequences may be
+    split across writes. The decoded text is passed on to the stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = Lock()
+        self._decoder = codecs.getincrementaldecoder(stream.encoding)(stream.errors)
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        # The decoder accepts any bytes-like object, memoryviews and
+        # bytearrays are decoded without copying them first:
+        size = memoryview(data).nbytes
+        with self._lock:
+            text = self._decoder.decode(data)
+        if text:
+            self._stream.write(text)
+        return size
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        return self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            text = self._decoder.decode(b"", True)
+        if text:
+            self._stream.write(text)
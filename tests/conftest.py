@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+# Allow running the widget tests without a display:
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    """Return the (single) QApplication instance."""
+    from qtpy.QtWidgets import QApplication
+
+    return QApplication.instance() or QApplication([])
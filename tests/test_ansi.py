@@ -0,0 +1,56 @@
+from pyqtconsole.ansi import DEFAULT_ATTRS, AnsiRenderer, apply_sgr, color_256
+
+RED = (("#cd0000", None, False, False, False),)
+
+
+def test_ansi_plain_text():
+    renderer = AnsiRenderer()
+    renderer.feed("hello\nwor")
+    assert renderer.drain() == ("", [(None, "hello"), (None, "\n"), (None, "wor")])
+    renderer.feed("ld\n")
+    assert renderer.drain() == ("", [(None, "ld"), (None, "\n")])
+    assert renderer.drain() is None
+
+
+def test_ansi_carriage_return():
+    renderer = AnsiRenderer()
+    renderer.feed("0%")
+    renderer.feed("\r10%")
+    renderer.feed("\r20%")
+    assert renderer.drain() == ("", [(None, "20%")])
+    # overwrites within a frame are coalesced:
+    renderer.feed("\r30%\r40%\r50%")
+    assert renderer.drain() == ("20%", [(None, "50%")])
+    # like a terminal, a shorter text only overwrites the start:
+    renderer.feed("\rX\n")
+    assert renderer.drain() == ("50%", [(None, "X0%"), (None, "\n")])
+
+
+def test_ansi_escape_sequences():
+    renderer = AnsiRenderer()
+    renderer.feed("\x1b[31mred\x1b[0m plain\x1b]0;title\x07\n", "stderr")
+    assert renderer.drain() == (
+        "",
+        [(("stderr",) + RED, "red"), ("stderr", " plain"), ("stderr", "\n")],
+    )
+    # sequences may be split across writes:
+    renderer.feed("a\x1b[3")
+    renderer.feed("1mb\x1b[")
+    renderer.feed("0m")
+    assert renderer.drain() == ("", [(None, "a"), ((None,) + RED, "b")])
+    # erase the line:
+    renderer.feed("\r\x1b[2Kc")
+    assert renderer.drain() == ("ab", [(None, "c")])
+
+
+def test_ansi_sgr():
+    assert apply_sgr(DEFAULT_ATTRS, "1;4;32;44") == (
+        "#00cd00",
+        "#0000ee",
+        True,
+        False,
+        True,
+    )
+    attrs = apply_sgr(DEFAULT_ATTRS, "38;5;196;48;2;1;2;3")
+    assert attrs[:2] == (color_256(196), "#010203") == ("#ff0000", "#010203")
+    assert apply_sgr(attrs, "") == DEFAULT_ATTRS
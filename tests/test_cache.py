@@ -0,0 +1,25 @@
+from pyqtconsole.cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used now:
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.get("a") == 1
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a", 0) == 0
+    assert len(cache) == 0
@@ -0,0 +1,28 @@
+import os
+
+from pyqtconsole.capture import NativeCapture
+from pyqtconsole.stream import Stream
+
+
+def test_native_capture_forwards_fd_output():
+    stdout, stderr = Stream(), Stream()
+    with NativeCapture({1: stdout, 2: stderr}, chunk_size=7):
+        os.write(1, b"written to fd 1\n")
+        os.write(2, "written to fd 2 \N{SNOWMAN}\n".encode())
+
+    assert stdout.read(timeout=0) == "written to fd 1\n"
+    assert stderr.read(timeout=0) == "written to fd 2 \N{SNOWMAN}\n"
+
+
+def test_native_capture_restores_fds(capfd):
+    stream = Stream()
+    capture = NativeCapture({1: stream})
+    capture.start()
+    assert capture.active()
+    os.write(1, b"captured\n")
+    capture.stop()
+    assert not capture.active()
+    os.write(1, b"not captured\n")
+
+    assert stream.read(timeout=0) == "captured\n"
+    assert capfd.readouterr().out == "not captured\n"
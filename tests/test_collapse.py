@@ -0,0 +1,24 @@
+from pyqtconsole.collapse import CollapsedOutput
+
+
+def test_collapsed_output_take_first():
+    output = CollapsedOutput()
+    output.append(None, "a\nb\nc")
+    output.append("stderr", "d\ne\n")
+    assert len(output) == 4
+    assert output.take_first(2) == [(None, "a\nb\n")]
+    assert output.take_first(1) == [(None, "c"), ("stderr", "d\n")]
+    assert len(output) == 1
+    assert output.take_first(5) == [("stderr", "e\n")]
+    assert len(output) == 0
+
+
+def test_collapsed_output_take_last():
+    output = CollapsedOutput()
+    output.append(None, "a\nb\n")
+    output.append("stderr", "c\n")
+    output.append(None, "d")
+    assert len(output) == 4
+    assert output.take_last(2) == [("stderr", "c\n"), (None, "d")]
+    assert output.take_last(1) == [(None, "b\n")]
+    assert output.take_first(5) == [(None, "a\n")]
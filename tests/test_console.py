@@ -0,0 +1,390 @@
+import pytest
+
+from pyqtconsole.console import PythonConsole
+
+
+@pytest.fixture
+def console(qapp):
+    console = PythonConsole()
+    console.eval_queued()
+    yield console
+    console.exit()
+    console.deleteLater()
+
+
+def run(console, source):
+    """Enter ``source`` as if typed by the user and wait for the result."""
+    from qtpy.QtWidgets import QApplication
+
+    console.insert_input_text(source)
+    buffer = console.input_buffer()
+    console.insert_input_text("\n", show_ps=False)
+    console.process_input(buffer)
+    QApplication.processEvents()
+    while console._executing() or console.output.pending():
+        QApplication.processEvents()
+
+
+def test_console_output(console):
+    run(console, "print('hello'); 1 + 1")
+    text = console.edit.toPlainText()
+    assert "hello\n2\n" in text
+    assert console.edit.document().blockCount() == len(console._prompt_doc)
+
+
+def test_console_scrollback_limit(console):
+    console.set_scrollback(lines=200)
+    for _ in range(3):
+        run(console, "for i in range(1000): print(i)\n")
+    doc = console.edit.document()
+    assert 200 <= doc.blockCount() <= 200 + 100 + 2
+    assert doc.blockCount() == len(console._prompt_doc)
+    assert doc.lastBlock().text() == ""
+    assert console._get_prompt_text(doc.blockCount() - 1) == console.in_prompt()
+
+    # the input still works after trimming:
+    run(console, "'abc'")
+    assert doc.blockCount() == len(console._prompt_doc)
+    assert console.edit.toPlainText().endswith("'abc'\n'abc'\n\n")
+    assert console.input_buffer() == ""
+
+
+def test_console_scrollback_chars(console):
+    console.set_scrollback(chars=20000)
+    run(console, "for i in range(10000): print(i)\n")
+    doc = console.edit.document()
+    assert doc.characterCount() <= 20000 + 10000
+    assert doc.blockCount() == len(console._prompt_doc)
+
+
+def test_console_prompt_cache(console):
+    from qtpy.QtGui import QFont
+
+    run(console, "1")
+    console.resize(400, 300)
+    console.pbar.grab()
+    assert set(console.pbar._cache) == {"IN [0]: ", "OUT[0]: ", "IN [1]: "}
+    cached = console.pbar._cache["IN [0]: "]
+    console.pbar.grab()
+    assert console.pbar._cache["IN [0]: "] is cached
+
+    font = QFont(console.font())
+    font.setPointSize(font.pointSize() + 4)
+    console.setFont(font)
+    console.pbar.grab()
+    assert console.pbar._cache["IN [0]: "] is not cached
+
+
+def test_console_output_collapse(console):
+    console.set_output_collapse(lines=100, tail=10, page=500)
+    run(console, "for i in range(2000): print(i)\n")
+    doc = console.edit.document()
+    text = console.edit.toPlainText()
+    assert "\n99\n[1890 more lines, click to expand]\n1990\n" in text
+    assert "\n100\n" not in text
+    assert text.endswith("1999\n\n")
+    assert doc.blockCount() == len(console._prompt_doc)
+
+    placeholder = doc.find("more lines, click to expand").block()
+    console.expand_output(placeholder)
+    text = console.edit.toPlainText()
+    assert "\n599\n[1390 more lines, click to expand]\n1990\n" in text
+    assert doc.blockCount() == len(console._prompt_doc)
+
+    for _ in range(3):
+        console.expand_output(doc.find("more lines, click to expand").block())
+    text = console.edit.toPlainText()
+    assert "click to expand" not in text
+    assert "".join(f"{i}\n" for i in range(2000)) in text
+    assert doc.blockCount() == len(console._prompt_doc)
+
+    # the input still works:
+    run(console, "'abc'")
+    assert console.edit.toPlainText().endswith("'abc'\n'abc'\n\n")
+    assert console._get_prompt_text(doc.blockCount() - 1) == console.in_prompt()
+
+
+def test_console_short_output_not_collapsed(console):
+    console.set_output_collapse(lines=100)
+    run(console, "for i in range(100): print(i)\n")
+    assert "click to expand" not in console.edit.toPlainText()
+
+
+def test_console_result_repr(console):
+    console.interpreter.result_repr.max_chars = 100
+    run(console, "list(range(1000))")
+    text = console.edit.toPlainText()
+    assert "[0, 1, 2, 3" in text
+    assert "999" not in text
+    assert console.interpreter.full_repr() == repr(list(range(1000)))
+
+
+def test_console_traceback_not_rate_limited(console):
+    run(console, "def f(n):\n    return f(n - 1) if n else int('x')\n\n")
+    run(console, "f(80)")
+    text = console.edit.toPlainText()
+    assert "suppressed" not in text
+    assert "ValueError: invalid literal" in text
+
+
+def test_console_interrupt_output_loop(qapp):
+    import time
+
+    from qtpy.QtWidgets import QApplication
+
+    console = PythonConsole()
+    console.eval_in_thread()
+    try:
+        console.insert_input_text("while True: print('x' * 50)\n")
+        buffer = console.input_buffer()
+        console.insert_input_text("\n", show_ps=False)
+        console.process_input(buffer)
+        end = time.monotonic() + 0.3
+        while time.monotonic() < end:
+            QApplication.processEvents()
+        # The interrupt is raised in the user code, even while it writes:
+        console._handle_ctrl_c()
+        while console._executing() or console.output.pending():
+            QApplication.processEvents()
+        assert "KeyboardInterrupt\n" in console.edit.toPlainText()
+    finally:
+        console.exit()
+        console.deleteLater()
+
+
+def test_console_ctrl_c_at_prompt(console):
+    from qtpy.QtWidgets import QApplication
+
+    console.insert_input_text("abc")
+    console._handle_ctrl_c()
+    QApplication.processEvents()
+    assert console.edit.toPlainText() == "abc^C\n"
+    assert len(console._prompt_doc) == console.edit.document().blockCount() == 2
+    assert console._prompt_doc[1] == console.in_prompt()
+
+
+def test_console_capture_with_block_policy(qapp):
+    console = PythonConsole(capture_fds=True)
+    console.eval_queued()
+    try:
+        console.output.set_limit(1000, "block")
+        console.output.interval = 0
+        # More than fits into the pipe, while the GUI thread runs the code:
+        run(console, "import os; os.write(1, b'x' * 300000)")
+        assert "x" * 300000 in console.edit.toPlainText()
+    finally:
+        console.exit()
+        console.deleteLater()
+
+
+def test_console_progress_bar(console):
+    from qtpy.QtGui import QTextDocument
+
+    run(
+        console,
+        "import sys\n"
+        "for i in range(101): sys.stdout.write(f'\\r{i}%')\n"
+        "print(' done'); print('\\x1b[31mred\\x1b[0m')\n",
+    )
+    text = console.edit.toPlainText()
+    assert "\n100% done\nred\n" in text
+    assert "\r" not in text and "\x1b" not in text
+    doc = console.edit.document()
+    assert doc.blockCount() == len(console._prompt_doc)
+    block = doc.find("red", doc.characterCount(), QTextDocument.FindBackward).block()
+    color = block.begin().fragment().charFormat().foreground().color()
+    assert color.name() == "#cd0000"
+
+
+def search(console, text, regex=False):
+    """Search with the find bar and wait for all matches."""
+    from qtpy.QtWidgets import QApplication
+
+    bar = console.find_bar
+    bar.regex.setChecked(regex)
+    bar.edit.setText(text)
+    bar.search()
+    while not bar._done:
+        QApplication.processEvents()
+    return bar
+
+
+def test_console_search(console):
+    console.set_output_collapse(lines=100, tail=10, page=500)
+    run(console, "for i in range(2000): print(f'line {i}')\n")
+    doc = console.edit.document()
+    console.expand_output(doc.find("more lines, click to expand").block())
+    run(console, "print('Needle')")
+
+    bar = search(console, "needle")
+    assert len(bar.matches) == 2
+    assert bar.status.text() == "1 of 2"
+    cursor = console._textCursor()
+    assert cursor.selectedText() == "Needle"
+    assert cursor.block().text() == "print('Needle')"
+    bar.find_next()
+    assert console._textCursor().block().text() == "Needle"
+    bar.case.setChecked(True)
+    assert search(console, "needle").matches == []
+
+    bar = search(console, r"^line (599|1990)$", regex=True)
+    assert len(bar.matches) == 2
+    bar.find_next()
+    assert console._textCursor().selectedText() == "line 1990"
+    bar.find_previous()
+    assert console._textCursor().selectedText() == "line 599"
+
+    # matches in lines removed from the scrollback are skipped:
+    first = search(console, "^line 0$", regex=True).matches[0]
+    console.set_scrollback(lines=20)
+    run(console, "print('line 1990')")
+    assert not console.show_match(*first)
+    bar = search(console, r"^line 1990$", regex=True)
+    assert len(bar.matches) == 2
+    bar.find_previous()
+    assert console._textCursor().block().blockNumber() == doc.blockCount() - 3
+
+
+def test_console_search_index_after_expand(console):
+    console.set_output_collapse(lines=100, tail=10, page=500)
+    run(console, "for i in range(1300): print(f'line {i}')\n")
+    run(console, "print('after')")
+    doc = console.edit.document()
+    index = console.search_index
+    while True:
+        placeholder = doc.find("more lines, click to expand")
+        if placeholder.isNull():
+            break
+        console.expand_output(placeholder.block())
+        lines = [doc.findBlockByNumber(i).text() for i in range(len(index) - 1)]
+        placeholder = doc.find("more lines, click to expand").block().blockNumber()
+        if placeholder >= 0:
+            lines[placeholder] = ""
+        assert [index.line(i) for i in range(len(index) - 1)] == lines
+    assert index.line(1300 + 1) == "line 1299"
+
+
+def test_console_export(console, tmp_path):
+    import io
+    import json
+
+    from qtpy.QtWidgets import QApplication
+
+    run(console, "print('a<b'); 1 + 1")
+    run(console, "def f():\n    return 1\n")
+
+    file = io.StringIO()
+    console.export(file)
+    assert file.getvalue().startswith("IN [0]: print('a<b'); 1 + 1\n        a<b\n")
+    assert "OUT[0]: 2\n" in file.getvalue()
+    assert "   ...:     return 1\n" in file.getvalue()
+
+    file = io.StringIO()
+    console.export(file, "html")
+    assert '<span class="prompt">IN [0]: </span>' in file.getvalue()
+    assert "a&lt;b\n" in file.getvalue()
+    assert "font-weight: bold" in file.getvalue()
+
+    path = tmp_path / "session.jsonl"
+    export = console.export(path, "jsonl", background=True)
+    while not export.done:
+        QApplication.processEvents()
+    assert export.error is None
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    # without the empty prompt waiting for input:
+    assert [r["number"] for r in records] == [0, 1]
+    assert records[0]["input"] == "print('a<b'); 1 + 1"
+    assert records[0]["output"] == "a<b\n2\n"
+    assert records[0]["duration"] >= 0
+    assert records[1]["input"] == "def f():\n    return 1\n"
+
+    console.insert_input_text("x = 1")
+    file = io.StringIO()
+    console.export(file, "jsonl")
+    record = json.loads(file.getvalue().splitlines()[-1])
+    assert (record["number"], record["input"], record["start"]) == (2, "x = 1", None)
+
+    with pytest.raises(ValueError):
+        console.export(io.StringIO(), "pdf")
+
+
+def test_console_virtual_output(qapp):
+    console = PythonConsole(virtual_output=True)
+    console.eval_queued()
+    try:
+        run(console, "for i in range(1000): print(i)\n")
+        run(console, "'abc'")
+        store = console.store
+        assert console.edit.toPlainText() == ""
+        assert console._prompt_doc[0] == console.in_prompt()
+        assert store.line(0) == "for i in range(1000): print(i)"
+        assert store.prompts[0] == "IN [0]: "
+        assert store.prompts[1] == "   ...: "
+        assert store.line(2) == "0"
+        assert store.line(1001) == "999"
+        assert [store.line(i) for i in range(1002, len(store))] == [
+            "",
+            "'abc'",
+            "'abc'",
+            "",
+            "",
+        ]
+        assert store.prompts[1004] == "OUT[1]: "
+        # the input is kept with its highlighting:
+        assert store.line_runs(0)[0] == (("input", 0), "for")
+
+        console.resize(400, 300)
+        console.grab()
+        view = console.output_view
+        assert view.line_count() == len(store) - 1
+        view._selection = [1003, 1004]
+        assert view.selected_text() == "'abc'\n'abc'\n"
+
+        # search works on the store:
+        bar = search(console, "^99\\d$", regex=True)
+        assert len(bar.matches) == 10
+        assert view.selected_lines() == (992, 992)
+    finally:
+        console.exit()
+        console.deleteLater()
+
+
+def test_console_stateful_highlighter(qapp):
+    from pyqtconsole.highlighter import StatefulPythonHighlighter
+
+    console = PythonConsole(highlighter_class=StatefulPythonHighlighter)
+    console.eval_queued()
+    try:
+        assert isinstance(console.highlighter, StatefulPythonHighlighter)
+        run(console, 's = """a\nb"""\n')
+        run(console, "print(s)")
+        assert "a\nb\n" in console.edit.toPlainText()
+    finally:
+        console.exit()
+        console.deleteLater()
+
+
+def test_console_output_not_highlighted(qapp):
+    from pyqtconsole.highlighter import TracebackHighlighter, is_output
+
+    console = PythonConsole(output_highlighter=TracebackHighlighter())
+    console.eval_queued()
+    try:
+        run(console, "print('for x in 1\\nimport 2')")
+        run(console, "1 / 0")
+        doc = console.edit.document()
+        blocks = [doc.findBlockByNumber(i) for i in range(doc.blockCount())]
+        output = {b.text(): b for b in blocks if is_output(b)}
+        assert {"for x in 1", "import 2", "ZeroDivisionError: division by zero"} <= set(
+            output
+        )
+        # Input is highlighted, output only by the output highlighter:
+        assert blocks[0].layout().formats()
+        assert not output["for x in 1"].layout().formats()
+        assert not output["import 2"].layout().formats()
+        error = output["ZeroDivisionError: division by zero"].layout().formats()
+        assert [(r.start, r.length) for r in error] == [(0, 17)]
+        assert not is_output(blocks[-1])
+    finally:
+        console.exit()
+        console.deleteLater()
@@ -1,9 +1,14 @@
 from unittest.mock import MagicMock, call
 
 import pytest
-from qtpy.QtGui import QTextDocument
+from qtpy.QtGui import QTextCharFormat, QTextCursor, QTextDocument
 
-from pyqtconsole.highlighter import PythonHighlighter
+from pyqtconsole.highlighter import (
+    PromptHighlighter,
+    PythonHighlighter,
+    StatefulPythonHighlighter,
+    TracebackHighlighter,
+)
 
 
 @pytest.fixture
@@ -298,3 +303,245 @@ def test_escape_backslash_at_end(highlighter):
 
     # Should highlight \\ at position 5, length 2
     highlighter.setFormat.assert_called_once_with(5, 2, highlighter.styles["escape"])
+
+
+# Tests for highlightBlock
+
+
+def block_formats(text, line=0, cls=PythonHighlighter):
+    """Highlight ``text`` and return the formatted ranges of the given line
+    as ``(text, style name)`` tuples."""
+    doc = QTextDocument()
+    doc.setPlainText(text)
+    highlighter = cls(doc)
+    highlighter.rehighlight()
+    block = doc.findBlockByNumber(line)
+    result = []
+    for r in sorted(block.layout().formats(), key=lambda r: r.start):
+        name = next(n for n, fmt in highlighter.styles.items() if fmt == r.format)
+        result.append((block.text()[r.start : r.start + r.length], name))
+    return result
+
+
+def test_highlight_block_tokens():
+    text = "def f(x): return x if x else 0x1F + 2.5"
+    assert block_formats(text) == [
+        ("def", "keyword"),
+        ("f", "defclass"),
+        ("return", "keyword"),
+        ("if", "keyword"),
+        ("else", "keyword"),
+        ("0x1F", "numbers"),
+        ("2.5", "numbers"),
+    ]
+
+
+def test_highlight_block_strings_and_comments():
+    # nothing is highlighted inside of strings and comments:
+    text = "x = \"it's if 1\" + 'a\\n' # if 2 'b'"
+    assert block_formats(text) == [
+        ('"it\'s if 1"', "string"),
+        ("'a", "string"),
+        ("\\n", "escape"),
+        ("'", "string"),
+        ("# if 2 'b'", "comment"),
+    ]
+
+
+def test_highlight_block_fstring():
+    text = "print(f'{x}', 'x{y}')"
+    assert block_formats(text) == [
+        ("'", "string"),
+        ("{x}", "fstring"),
+        ("'", "string"),
+        ("'x{y}'", "string"),
+    ]
+
+
+def test_utf16_offsets(highlighter):
+    """Characters outside the BMP take two UTF-16 code units."""
+    highlighter.setFormat = MagicMock()
+
+    highlighter.highlight_escape_sequences('"\U0001f600\\n" + "é\U0001f600\\t"')
+    calls = highlighter.setFormat.call_args_list
+    assert calls == [
+        call(3, 2, highlighter.styles["escape"]),
+        call(13, 2, highlighter.styles["escape"]),
+    ]
+
+    # the offsets of another text are not mixed up with the previous one:
+    highlighter.setFormat.reset_mock()
+    highlighter.highlight_escape_sequences('"a\\n"')
+    highlighter.setFormat.assert_called_once_with(2, 2, highlighter.styles["escape"])
+
+
+def test_highlight_block_triple_quotes():
+    text = 's = """abc\nif 1 \'\'\'\n"""; x = 2\ny = 3'
+    assert block_formats(text, 0) == [('"""abc', "string2")]
+    assert block_formats(text, 1) == [("if 1 '''", "string2")]
+    assert block_formats(text, 2) == [('"""', "string2"), ("2", "numbers")]
+    assert block_formats(text, 3) == [("3", "numbers")]
+
+
+def test_highlight_block_triple_quotes_in_strings():
+    # triple quotes within strings and comments don't start a string:
+    text = "x = \"'''\"  # '''\ny = 1"
+    assert block_formats(text, 0) == [("\"'''\"", "string"), ("# '''", "comment")]
+    assert block_formats(text, 1) == [("1", "numbers")]
+
+
+def stateful_formats(text, line=0):
+    return block_formats(text, line, StatefulPythonHighlighter)
+
+
+def block_state(doc, line):
+    return doc.findBlockByNumber(line).userState()
+
+
+def test_stateful_highlighter_tokens():
+    text = "def f(x): return x + 1.5  # one"
+    assert stateful_formats(text) == block_formats(text)
+    text = r"""s = r'a\n' + b"\x00" """
+    assert stateful_formats(text) == [
+        (r"'a\n'", "string"),
+        ('"', "string"),
+        (r"\x00", "escape"),
+        ('"', "string"),
+    ]
+
+
+def test_stateful_highlighter_multiline_strings():
+    text = 's = """a \'\'\'\nb""" + \'c\\\nd\' + 1\n2'
+    assert stateful_formats(text, 0) == [("\"\"\"a '''", "string2")]
+    assert stateful_formats(text, 1) == [('b"""', "string2"), ("'c\\", "string")]
+    assert stateful_formats(text, 2) == [("d'", "string"), ("1", "numbers")]
+    assert stateful_formats(text, 3) == [("2", "numbers")]
+
+
+def test_stateful_highlighter_fstrings():
+    text = """f'{x["a"]!r} {f'{y}'}'"""
+    assert stateful_formats(text) == [
+        ("'", "string"),
+        ("{x[", "fstring"),
+        ('"a"', "string"),
+        ("]!r}", "fstring"),
+        (" ", "string"),
+        ("{", "fstring"),
+        ("'", "string"),
+        ("{y}", "fstring"),
+        ("'", "string"),
+        ("}", "fstring"),
+        ("'", "string"),
+    ]
+    # Replacement fields in triple-quoted f-strings may span lines:
+    text = 'f"""a {\nnot 1} b"""\nc'
+    assert stateful_formats(text, 0) == [('"""a ', "string2"), ("{", "fstring")]
+    assert stateful_formats(text, 1) == [
+        ("not", "keyword"),
+        (" ", "fstring"),
+        ("1", "numbers"),
+        ("}", "fstring"),
+        (' b"""', "string2"),
+    ]
+    assert stateful_formats(text, 2) == []
+
+
+def test_stateful_highlighter_incremental(qapp):
+    doc = QTextDocument()
+    doc.setPlainText("\n".join(f"x = {i}" for i in range(100)))
+    # Changes are only highlighted if the document has a layout:
+    doc.documentLayout()
+    highlighter = StatefulPythonHighlighter(doc)
+    # Count every block that is lexed, instead of taking it from the cache:
+    highlighter.cache.maxsize = 0
+    highlighter.rehighlight()
+    highlighted = []
+    highlight_tokens = highlighter._highlight_tokens
+
+    def count(text):
+        highlighted.append(text)
+        highlight_tokens(text)
+
+    highlighter._highlight_tokens = count
+
+    # Edits that don't change the state only highlight the edited block:
+    cursor = QTextCursor(doc.findBlockByNumber(50))
+    cursor.insertText("y = ")
+    assert highlighted == ["y = x = 50"]
+
+    # An open string highlights the following blocks, until it is closed:
+    highlighted.clear()
+    cursor.insertText('"""')
+    assert len(highlighted) == 50
+    assert block_state(doc, 99) != 0
+    highlighted.clear()
+    QTextCursor(doc.findBlockByNumber(52)).insertText('"""')
+    assert len(highlighted) == 48
+    assert block_state(doc, 53) == 0
+    assert block_state(doc, 99) == 0
+
+
+def test_traceback_highlighter():
+    highlighter = TracebackHighlighter()
+    styles = highlighter.styles
+    text = '  File "/tmp/a.py", line 12, in f'
+    assert list(highlighter.highlight(text)) == [
+        (8, 9, styles["tbfile"]),
+        (25, 2, styles["tbline"]),
+    ]
+    text = "json.decoder.JSONDecodeError: Expecting value"
+    assert list(highlighter.highlight(text)) == [(0, 28, styles["tberror"])]
+    assert list(highlighter.highlight("no error here")) == []
+
+
+def test_deferred_highlighting(qapp):
+    doc = QTextDocument()
+    doc.documentLayout()
+    highlighter = PythonHighlighter(doc)
+    # Defer all blocks of the next change:
+    highlighter.time_budget = -1
+    doc.setPlainText("\n".join(f"x = {i}" for i in range(200)))
+    assert not doc.lastBlock().layout().formats()
+    assert highlighter._pending
+
+    highlighted = []
+    highlight_tokens = highlighter._highlight_tokens
+
+    def record(text):
+        highlighted.append(text)
+        highlight_tokens(text)
+
+    highlighter._highlight_tokens = record
+    highlighter.visible_range = lambda: (
+        doc.findBlockByNumber(150),
+        doc.findBlockByNumber(160),
+    )
+    while highlighter._pending:
+        qapp.processEvents()
+    # The visible blocks are highlighted first, every block is lexed once:
+    assert highlighted[0] == "x = 150"
+    assert len(highlighted) == 200
+    assert set(highlighted) == {f"x = {i}" for i in range(200)}
+    assert doc.lastBlock().layout().formats()
+    assert doc.firstBlock().layout().formats()
+
+
+def test_highlight_cache(qapp):
+    doc = QTextDocument()
+    doc.setPlainText("x = 'a' + 1\ny = '''\nx = 'a' + 1\n'''\nx = 'a' + 1")
+    highlighter = PythonHighlighter(doc)
+    highlighter.rehighlight()
+    # The first and last line have the same text and previous state:
+    assert (highlighter.cache.hits, highlighter.cache.misses) == (1, 4)
+    formats = [
+        [
+            (r.start, r.length, QTextCharFormat(r.format))
+            for r in block.layout().formats()
+        ]
+        for block in (doc.firstBlock(), doc.findBlockByNumber(2), doc.lastBlock())
+    ]
+    assert formats[0] == formats[2] != formats[1]
+
+    prompt = PromptHighlighter()
+    assert prompt.highlight("IN [1]: ") is prompt.highlight("IN [1]: ")
+    assert (prompt.cache.hits, prompt.cache.misses) == (1, 1)
@@ -0,0 +1,103 @@
+from codeop import CommandCompiler
+from collections import deque
+
+import pytest
+
+from pyqtconsole.cache import LRUCache
+from pyqtconsole.interpreter import PythonInterpreter, ResultRepr, compile_multi
+
+
+def test_result_repr_small_values_unchanged():
+    result_repr = ResultRepr()
+    recursive = [1]
+    recursive.append(recursive)
+    for value in [
+        1,
+        "abc",
+        [1, (2, 3)],
+        {"b": 1, "a": [2]},
+        {1},
+        {"b", "a", "c", 10, 2},
+        frozenset({3, 1, 2}),
+        deque([1, 2], maxlen=3),
+        deque(),
+        (1,),
+        recursive,
+        None,
+        1.5,
+    ]:
+        assert result_repr.repr(value) == repr(value)
+
+
+def test_result_repr_error():
+    class Bad:
+        def __repr__(self):
+            raise RuntimeError("bad repr")
+
+    with pytest.raises(RuntimeError, match="bad repr"):
+        ResultRepr().repr(Bad())
+    with pytest.raises(RuntimeError, match="bad repr"):
+        ResultRepr().repr([1, Bad()])
+
+
+def test_result_repr_bounded():
+    result_repr = ResultRepr(max_chars=1000, max_items=10)
+    assert result_repr.repr(list(range(100))) == repr(list(range(10)))[:-1] + ", ...]"
+    assert len(result_repr.repr("x" * 10**6)) <= 1003
+    assert len(result_repr.repr([["y" * 900] * 10] * 10)) <= 1003
+
+
+def test_result_repr_timeout():
+    result_repr = ResultRepr(timeout=0)
+    assert result_repr.repr(list(range(10))) == "..."
+
+
+def compile_modes(source, cache=None):
+    codes = compile_multi(CommandCompiler(), source, "<input>", "multi", cache)
+    return None if codes is None else [mode for code, mode in codes]
+
+
+def test_compile_multi_splits_expressions():
+    assert compile_modes("x = 1\ny = 2\nx\nz = 3\nx + y") == [
+        "exec",
+        "eval",
+        "exec",
+        "eval",
+    ]
+    assert compile_modes("# comment") == []
+
+
+def test_compile_multi_incomplete():
+    assert compile_modes("x = (1,") is None
+    assert compile_modes("if x:\n    y = 1") is None
+    assert compile_modes("x = 1\nfor i in x:\n    y = 1") is None
+    assert compile_modes("x = 1\nfor i in x:\n    y = 1\n") == ["exec"]
+
+
+def test_compile_multi_invalid():
+    for source in [
+        "x = = 1",
+        "return 1",
+        "x = 1\nfrom __future__ import annotations",
+        "x\nfrom __future__ import annotations",
+        "'doc'\nx\nfrom __future__ import annotations",
+    ]:
+        with pytest.raises(SyntaxError):
+            compile_modes(source)
+    assert compile_modes(
+        "'doc'\nfrom __future__ import annotations\nfrom __future__ import division"
+    ) == ["eval", "exec"]
+
+
+def test_compile_multi_cache():
+    interpreter = PythonInterpreter(None, None)
+    cache = interpreter.compile_cache
+    codes = interpreter.compile("x = 1\nx", "<input>", "multi")
+    assert interpreter.compile("x = 1\nx", "<input>", "multi") is codes
+    assert (cache.hits, len(cache)) == (1, 1)
+    # Incomplete code is not cached:
+    assert interpreter.compile("if x:", "<input>", "multi") is None
+    assert len(cache) == 1
+    uncached = LRUCache(maxsize=0)
+    assert compile_modes("x", uncached) == ["eval"]
+    assert len(uncached) == 0
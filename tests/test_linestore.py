@@ -0,0 +1,112 @@
+from pyqtconsole.linestore import LineStore
+from pyqtconsole.search import split_chunks
+
+
+def lines(store):
+    return [store.line_runs(i) for i in range(len(store))]
+
+
+def test_line_store_append():
+    store = LineStore()
+    store.chunk_size = 8
+    store.append("hello\nwor")
+    store.append("ld\n", "stderr")
+    store.prompts.append("OUT: ")
+    store.append("abc")
+    assert len(store) == 3
+    assert store.size() == 15
+    assert [store.line(i) for i in range(3)] == ["hello", "world", "abc"]
+    assert lines(store) == [
+        [(None, "hello")],
+        [(None, "wor"), ("stderr", "ld")],
+        [(None, "abc")],
+    ]
+    assert [store.prompts[i] for i in range(3)] == ["", "", "OUT: "]
+    assert store.max_length == 5
+
+
+def test_line_store_remove_tail():
+    store = LineStore()
+    store.append("line\n")
+    store.append("50%", "a")
+    store.remove_tail(2)
+    store.append("75%", "b")
+    assert lines(store) == [[(None, "line")], [("a", "5"), ("b", "75%")]]
+    # only the last line can be shortened:
+    store.remove_tail(100)
+    assert store.size() == 5
+    assert lines(store) == [[(None, "line")], []]
+
+
+def test_line_store_remove_everything():
+    store = LineStore()
+    store.append("abc")
+    store.remove_tail(3)
+    assert store.size() == 0
+    assert lines(store) == [[]]
+    store.append("xyz\n")
+    store.remove_last_line()
+    store.remove_tail(3)
+    assert lines(store) == [[]]
+    store.append("d", "a")
+    assert lines(store) == [[("a", "d")]]
+
+
+def test_line_store_remove_lines():
+    store = LineStore()
+    store.chunk_size = 4
+    for i in range(10):
+        store.append(f"line {i}\n", i % 2)
+    offset = store.line_range(7)[0]
+    store.remove_lines(5)
+    assert len(store) == 6
+    assert store.line(0) == "line 5"
+    assert store.line_runs(1) == [(0, "line 6")]
+    assert store.line_of(offset) == 2
+    assert store.line_of(0) == -1
+
+
+def test_line_store_replace_lines():
+    store = LineStore()
+    store.chunk_size = 8
+    store.append("a\nplaceholder\n")
+    store.append("b\n", "stderr")
+    store.prompts.append("IN: ")
+    store.append("c")
+    store.replace_lines(1, 0, "x\ny\n")
+    assert [store.line(i) for i in range(len(store))] == [
+        "a",
+        "x",
+        "y",
+        "placeholder",
+        "b",
+        "c",
+    ]
+    store.replace_lines(3, 1)
+    assert lines(store)[3:] == [[("stderr", "b")], [(None, "c")]]
+    assert [store.prompts[i] for i in range(len(store))] == ["", "", "", "", "IN: "]
+    assert store.size() == len("a\nx\ny\nb\nc")
+
+
+def test_split_chunks():
+    store = LineStore()
+    store.chunk_size = 8
+    for i in range(20):
+        store.append(f"line {i}\n")
+    store.append("end")
+    pieces = list(split_chunks(*store.chunks()))
+    assert all(text.endswith("\n") for _, text in pieces[:-1])
+    assert "".join(text for _, text in pieces) == store.text(0, store.size())
+    for start, text in pieces:
+        assert store.text(start, start + len(text)) == text
+
+
+def test_line_store_remove_last_line():
+    store = LineStore()
+    store.append("a\nbc\nd")
+    store.prompts.append("x\ny\nz")
+    store.remove_last_line()
+    assert [store.line(i) for i in range(len(store))] == ["a", "bc"]
+    assert len(store.prompts) == 2
+    store.append("e\n")
+    assert [store.line(i) for i in range(len(store))] == ["a", "bce", ""]
@@ -0,0 +1,269 @@
+import threading
+
+import pytest
+
+from pyqtconsole.output import OutputBuffer, RateLimiter, never_block
+
+
+class Sink:
+    """Records the runs passed to the sink of an OutputBuffer."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, runs):
+        self.calls.append(runs)
+
+    def texts(self):
+        return ["".join(text for _, text in runs) for runs in self.calls]
+
+
+def test_output_buffer_coalesces_writes():
+    sink = Sink()
+    buffer = OutputBuffer(sink)
+
+    buffer.write("a")
+    buffer.write("")
+    buffer.write("b\n")
+    assert sink.calls == []
+    assert buffer.pending()
+
+    buffer.flush()
+    assert sink.calls == [[(None, "ab\n")]]
+    assert not buffer.pending()
+
+    stats = buffer.stats()
+    assert stats["writes"] == 2
+    assert stats["flushes"] == 1
+    assert stats["chars"] == 3
+
+
+def test_output_buffer_keeps_channel_order():
+    sink = Sink()
+    buffer = OutputBuffer(sink)
+    buffer.write("a")
+    buffer.write("b")
+    buffer.write("err", channel="stderr")
+    buffer.write("c")
+    buffer.flush()
+    assert sink.calls == [[(None, "ab"), ("stderr", "err"), (None, "c")]]
+
+
+def test_output_buffer_flush_without_data():
+    sink = Sink()
+    buffer = OutputBuffer(sink)
+    buffer.flush()
+    assert sink.calls == []
+    assert buffer.stats()["flushes"] == 0
+
+
+def test_output_buffer_threaded_writes():
+    sink = Sink()
+    buffer = OutputBuffer(sink)
+
+    def produce():
+        for i in range(1000):
+            buffer.write(f"{i}\n")
+
+    threads = [threading.Thread(target=produce) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    buffer.flush()
+
+    assert len(sink.calls) == 1
+    assert sink.texts()[0].count("\n") == 4000
+    assert buffer.stats()["writes"] == 4000
+
+
+def test_output_buffer_timer_flush(qapp):
+    from qtpy.QtCore import QEventLoop, QTimer
+
+    sink = Sink()
+    buffer = OutputBuffer(sink, interval=5)
+    for i in range(100):
+        buffer.write(f"{i}\n")
+
+    loop = QEventLoop()
+    QTimer.singleShot(200, loop.quit)
+    loop.exec_()
+
+    assert len(sink.calls) == 1
+    assert sink.texts()[0].count("\n") == 100
+
+
+def test_output_buffer_invalid_policy():
+    with pytest.raises(ValueError):
+        OutputBuffer(print, max_pending=10, overflow="explode")
+
+
+def test_output_buffer_drop_oldest():
+    sink = Sink()
+    buffer = OutputBuffer(sink, max_pending=20, overflow="drop")
+    for i in range(100):
+        buffer.write(f"line {i}\n")
+    buffer.flush()
+
+    text = sink.texts()[0]
+    assert text.startswith("[")
+    marker, *lines = text.splitlines()
+    assert marker == f"[{100 - len(lines)} lines suppressed]"
+    assert lines[-1] == "line 99"
+    assert sum(len(line) + 1 for line in lines) <= 20
+
+
+def test_output_buffer_spill(qapp):
+    sink = Sink()
+    buffer = OutputBuffer(sink, max_pending=100, overflow="spill")
+    expected = "".join(f"line {i} \N{SNOWMAN}\n" for i in range(1000))
+    for line in expected.splitlines(keepends=True):
+        buffer.write(line)
+    buffer.write("error\n", channel="stderr")
+
+    # portions are limited to the budget:
+    buffer._flush_portion()
+    assert len(sink.calls) == 1
+    assert len(sink.texts()[0]) <= 100
+    assert buffer.pending()
+
+    buffer.flush()
+    assert not buffer.pending()
+    assert "".join(sink.texts()) == expected + "error\n"
+    assert sink.calls[-1][-1] == ("stderr", "error\n")
+
+
+def test_output_buffer_block():
+    sink = Sink()
+    buffer = OutputBuffer(sink, max_pending=10, overflow="block")
+
+    writer = threading.Thread(target=buffer.write, args=["x" * 20])
+    writer.start()
+    writer.join(0.1)
+    # waits for the GUI thread to catch up:
+    assert writer.is_alive()
+
+    buffer.flush()
+    writer.join(1)
+    assert not writer.is_alive()
+    assert sink.texts() == ["x" * 20]
+
+    # writes from the thread owning the buffer are flushed right away:
+    buffer.write("y" * 20)
+    assert sink.texts() == ["x" * 20, "y" * 20]
+
+
+def test_output_buffer_block_interrupt():
+    import ctypes
+
+    buffer = OutputBuffer(Sink(), max_pending=10, overflow="block")
+    interrupted = []
+
+    def write():
+        try:
+            buffer.write("x" * 20)
+        except KeyboardInterrupt:
+            interrupted.append(True)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join(0.1)
+    assert writer.is_alive()
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(writer.ident), ctypes.py_object(KeyboardInterrupt)
+    )
+    writer.join(1)
+    assert not writer.is_alive()
+    assert interrupted == [True]
+    # The lock was released:
+    assert buffer.pending()
+
+
+def test_output_buffer_block_spills_when_busy():
+    sink = Sink()
+    buffer = OutputBuffer(sink, max_pending=10, overflow="block")
+    buffer.owner_busy = lambda: True
+    writer = threading.Thread(target=buffer.write, args=["x" * 20])
+    writer.start()
+    writer.join(1)
+    assert not writer.is_alive()
+
+    buffer.owner_busy = None
+
+    def write():
+        never_block()
+        buffer.write("y" * 20)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join(1)
+    assert not writer.is_alive()
+    buffer.flush()
+    assert "".join(sink.texts()) == "x" * 20 + "y" * 20
+
+
+def test_output_buffer_filter():
+    sink = Sink()
+    buffer = OutputBuffer(sink)
+    buffer.set_filter("stderr", RateLimiter())
+    for _ in range(3):
+        buffer.write("warning\n", channel="stderr")
+        buffer.write("output\n")
+    buffer.flush()
+    assert sink.texts() == ["warning\noutput\noutput\noutput\n"]
+
+    buffer.finish()
+    assert sink.calls[-1] == [
+        ("stderr", "[previous line repeated 2 more times]\n"),
+    ]
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_rate_limiter_collapses_repeated_lines():
+    limiter = RateLimiter()
+    assert limiter.feed("spam\nspam\n") == "spam\n"
+    assert limiter.feed("spam") == ""
+    assert limiter.feed("\n") == ""
+    assert limiter.feed("eggs\n") == "[previous line repeated 2 more times]\neggs\n"
+    assert limiter.feed("eggs\n") == ""
+    assert limiter.finish() == "[previous line repeated 1 more times]\n"
+    assert limiter.finish() == ""
+
+
+def test_rate_limiter_limits_lines_per_period():
+    clock = Clock()
+    limiter = RateLimiter(max_lines=2, period=1.0, tail=0, clock=clock)
+    assert limiter.feed("a\nb\nc\nd\n") == "a\nb\n"
+    clock.time = 1.5
+    assert limiter.feed("e\n") == "[2 lines suppressed]\ne\n"
+    assert limiter.feed("f\ng\n") == "f\n"
+    assert limiter.finish() == "[1 lines suppressed]\n"
+
+
+def test_rate_limiter_shows_tail():
+    clock = Clock()
+    limiter = RateLimiter(max_lines=2, period=1.0, tail=2, clock=clock)
+    assert limiter.feed("a\nb\nc\nd\ne\nError\n") == "a\nb\n"
+    assert limiter.finish() == "[2 lines suppressed]\ne\nError\n"
+    assert limiter.feed("a\nb\nc\n") == "a\nb\n"
+    clock.time = 1.5
+    assert limiter.feed("d\n") == "c\nd\n"
+    assert limiter.finish() == ""
+
+
+def test_rate_limiter_partial_lines():
+    limiter = RateLimiter()
+    assert limiter.feed("incomplete") == ""
+    assert limiter.release() == "incomplete"
+    assert limiter.feed(" line\n") == " line\n"
+    # carriage returns (e.g. progress bars) are passed through immediately:
+    assert limiter.feed("50%\r") == "50%\r"
+    assert limiter.feed("partial") == ""
+    assert limiter.finish() == "partial"
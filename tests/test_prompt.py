@@ -0,0 +1,45 @@
+import pytest
+
+from pyqtconsole.prompt import PromptDocument
+
+
+def lines(doc):
+    return [doc[i] for i in range(len(doc))]
+
+
+def test_prompt_document_append():
+    doc = PromptDocument()
+    assert lines(doc) == [""]
+    assert doc.append("IN [1]: ") == ["IN [1]: "]
+    assert doc.append("\n...: \n") == ["...: "]
+    doc.add_lines(3)
+    assert doc.append("OUT[1]: ") == ["OUT[1]: "]
+    assert lines(doc) == ["IN [1]: ", "...: ", "", "", "", "OUT[1]: "]
+    assert doc[-1] == "OUT[1]: "
+    with pytest.raises(IndexError):
+        doc[6]
+
+
+def test_prompt_document_bulk_newlines():
+    doc = PromptDocument()
+    assert doc.append("\n" * 1000) == []
+    assert len(doc) == 1001
+    assert doc[500] == ""
+
+
+def test_prompt_document_remove():
+    doc = PromptDocument()
+    for i in range(5):
+        doc.append(f"IN [{i}]: \n\n")
+    assert len(doc) == 11
+
+    del doc[:4]
+    assert lines(doc)[:3] == ["IN [2]: ", "", "IN [3]: "]
+
+    del doc[1:3]
+    assert lines(doc) == ["IN [2]: ", "", "IN [4]: ", "", ""]
+
+    del doc[3:]
+    assert lines(doc) == ["IN [2]: ", "", "IN [4]: "]
+    doc.append("\nIN [5]: ")
+    assert lines(doc) == ["IN [2]: ", "", "IN [4]: ", "IN [5]: "]
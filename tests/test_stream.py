@@ -0,0 +1,118 @@
+import io
+import threading
+
+import pytest
+
+from pyqtconsole.stream import Stream
+
+
+def test_stream_readline():
+    stream = Stream()
+    stream.write("first\nsec")
+    stream.write("ond\nthi")
+    assert stream.readline() == "first\n"
+    assert stream.readline() == "second\n"
+    # incomplete line, wait for a newline until timeout:
+    assert stream.readline(timeout=0.01) == ""
+    stream.write("rd\n")
+    assert stream.readline() == "third\n"
+
+
+def test_stream_readline_waits_for_writer():
+    stream = Stream()
+    timer = threading.Timer(0.05, stream.write, ["late\n"])
+    timer.start()
+    assert stream.readline(timeout=5) == "late\n"
+    timer.join()
+
+
+def test_stream_readlines():
+    stream = Stream()
+    stream.write("a\nb\nc\nincomplete")
+    assert stream.readlines() == ["a\n", "b\n", "c\n"]
+    assert stream.readlines() == []
+    stream.write("\n")
+    assert stream.readlines() == ["incomplete\n"]
+
+    stream.write("aa\nbb\ncc\n")
+    assert stream.readlines(hint=4) == ["aa\n", "bb\n"]
+
+
+def test_stream_read():
+    stream = Stream()
+    stream.write("abc\ndef\ngh")
+    assert stream.read(2) == "ab"
+    assert stream.read(4) == "c\nde"
+    assert stream.read(10) == "f\ngh"
+    assert stream.read(1, timeout=0.01) == ""
+    stream.write("x\ny")
+    assert stream.read() == "x\ny"
+
+
+def test_stream_iteration_until_closed():
+    stream = Stream()
+    stream.write("one\ntwo\nthree")
+    stream.close()
+    assert list(stream) == ["one\n", "two\n", "three"]
+
+
+def test_stream_flush():
+    stream = Stream()
+    flushed = []
+    stream.flush_event.connect(flushed.append)
+    stream.write("abc\ndef")
+    assert stream.flush() == "abc\ndef"
+    assert flushed == ["abc\ndef"]
+    assert stream.readline(timeout=0.01) == ""
+
+
+def test_stream_write_only():
+    stream = Stream(readable=False)
+    written = []
+    stream.write_event.connect(written.append)
+    stream.write("abc\n")
+    assert written == ["abc\n"]
+    assert not stream.readable()
+    assert stream.flush() == ""
+    with pytest.raises(io.UnsupportedOperation):
+        stream.readline()
+
+
+def test_stream_buffer_decodes_incrementally():
+    stream = Stream()
+    written = []
+    stream.write_event.connect(written.append)
+
+    data = "snow \N{SNOWMAN} and \N{GRINNING FACE}\n".encode()
+    for i in range(len(data)):
+        assert stream.buffer.write(data[i : i + 1]) == 1
+    assert "".join(written) == "snow \N{SNOWMAN} and \N{GRINNING FACE}\n"
+    assert stream.readline() == "snow \N{SNOWMAN} and \N{GRINNING FACE}\n"
+
+    assert stream.buffer.write(memoryview(b"abc\n")) == 4
+    assert stream.buffer.write(bytearray(b"\xff\n")) == 2
+    assert stream.readline() == "abc\n"
+    assert stream.readline() == "\N{REPLACEMENT CHARACTER}\n"
+
+
+def test_stream_buffer_close_flushes_incomplete_sequence():
+    stream = Stream()
+    stream.buffer.write("\N{SNOWMAN}".encode()[:2])
+    assert stream.read(timeout=0.01) == ""
+    stream.buffer.close()
+    assert stream.read() == "\N{REPLACEMENT CHARACTER}"
+
+
+def test_stream_writer():
+    written = []
+    stream = Stream(readable=False, writer=written.append)
+    stream.write("abc")
+    assert written == ["abc"]
+
+    def interrupted(data):
+        raise KeyboardInterrupt
+
+    # exceptions of the writer are raised in the writing code:
+    stream.writer = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        stream.write("x")